@@ -15,15 +15,22 @@ from engine.sphere import Sphere
 from simulation.body import Bodies
 from simulation.load_bodies import LoadBodies
 from simulation.transferorbit import Spaceship
+from simulation.planner import LaunchPlanner
 from simulation.integrators import (
-    update_bodies_dormand_prince,
-    update_bodies_fixed_dormand_prince
+    AdaptiveStepper,
+    Tolerances,
+    step_sizes,
+    global_errors,
 )
+from simulation.tableaux import DORMAND_PRINCE
 from utils.deltatime import TimeManager
 
 
 class SimulationApp:
-    def __init__(self,  targets: list, width: int = 900, height: int = 900) -> None:
+    def __init__(self,  targets: list, width: int = 900, height: int = 900,
+                 tolerances: Tolerances | None = None, satellite_mode: str = "two_body",
+                 precision: str = "longdouble", launch_date: str = "2024-12-20", transfer_days: float = 185,
+                 correct_launch: bool = False) -> None:
         # window
         self.width = width
         self.height = height
@@ -41,10 +48,19 @@ class SimulationApp:
         self.launch = False
         self.launch_pressed = False
         self.satellite_exists = False
+        self.satellite_mode = satellite_mode  # see Spaceship.MODES
+        self.precision = precision            # see body.PRECISIONS
+        self.launches = 0
+        self.launch_date = launch_date        # YYYY-MM-DD, earliest launch
+        self.transfer_days = transfer_days    # lambert time of flight, see simulation/porkchop.py
+        self.correct_launch = correct_launch  # test particles corrected in the full system, see Spaceship
+        self.planner = LaunchPlanner("EARTH", "MARS", transfer_days,
+                                     datetime.strptime(launch_date, "%Y-%m-%d").timestamp())
 
         # integration step sizes
         self.fehlberg_timestep = (3.154e7) * 1 / (16 * 144)
         self.prince_timestep = (3.154e7) * 1 / (160 * 144)
+        self.stepper = AdaptiveStepper(DORMAND_PRINCE, self.prince_timestep, tolerances)
 
         # constants
         self.G = 6.67430e-11
@@ -107,7 +123,7 @@ class SimulationApp:
         # bodies
         bodies_to_load = self.targets
         all_bodies = LoadBodies("data/body_data.csv", bodies_to_load)
-        self.bodies_state = Bodies.from_bodies(all_bodies)
+        self.bodies_state = Bodies.from_bodies(all_bodies, precision=self.precision)
         self.bodies_state.check_csvs()
 
         # optional skybox sphere (radius, segments)
@@ -119,8 +135,6 @@ class SimulationApp:
     def process_input_camera(self, delta_time: float) -> None:
         if glfw.get_key(self.window, glfw.KEY_ESCAPE) == glfw.PRESS:
             try:
-                from simulation.integrators import step_sizes, global_errors
-
                 step_sizes_arr = np.array(step_sizes)
                 global_errors_arr = np.array(global_errors)
                 np.savez(
@@ -209,43 +223,45 @@ class SimulationApp:
         # toggle launch flag from input
         self.process_input_launch()
 
-        # launch date condition
+        # launch date condition, once a launch is armed the planner works out
+        # the lambert solutions ahead of time and it waits for its one
         current_unix = TimeManager.unix_start + TimeManager.simulated_time
-        launch_date = datetime.strptime("2024-12-20", "%Y-%m-%d").timestamp()
+        solution = None
+        if self.launch:
+            self.planner.plan(current_unix, self.bodies_state)
+            solution = self.planner.ready(current_unix)
 
-        if current_unix >= launch_date and self.launch:
+        if solution is not None:
             # empty buffer of old instance information if multiple launches
-            if self.satellite_exists and self.satellite is not None:
-                self.satellite.satellite.file.seek(0)
-                self.satellite.satellite.file.truncate(0)
-
-            self.satellite = Spaceship("EARTH", "MARS")
-            self.satellite.launch(current_unix, self.bodies_state)
-            self.satellite.bodies_state.check_csvs()
+            # as test particles earlier satellites keep flying in the main
+            # system, so every launch needs its own ID
+            if self.satellite_mode == "two_body" and self.satellite_exists and self.satellite is not None:
+                self.satellite.satellite.close_log()
+
+            self.launches += 1
+            satellite_id = "SATELLITE" if self.satellite_mode == "two_body" or self.launches == 1 \
+                else f"SATELLITE_{self.launches}"
+            self.satellite = Spaceship("EARTH", "MARS", self.satellite_mode, satellite_id, self.transfer_days,
+                                       correct=self.correct_launch)
+            self.satellite.launch(current_unix, self.bodies_state, solution)
+            self.satellite.bodies_state.check_csvs([self.satellite.satellite])
 
             self.launch = False
             self.satellite_exists = True
 
-        # propagate satellite if it exists
-        if self.satellite_exists and self.satellite is not None:
+        # propagate satellite if it exists, test particles are logged and
+        # stepped with the main system
+        if self.satellite_exists and self.satellite is not None and self.satellite.mode == "two_body":
             if self.satellite.mission_time >= self.satellite.t:
                 # satellite mission complete – no second impulse / shutdown
                 self.satellite_mission_complete = True
                 return
 
-            # log satellite state
+            # log satellite state, it is advanced with the main step
             self.satellite.satellite.log(
                 TimeManager.sim_date.translate({ord(","): None})
             )
 
-            #!!! propagate satellite using the same timestep as the main system
-            # we ignore the returned suggested dt here to keep it locked
-            update_bodies_fixed_dormand_prince(
-                self.satellite.bodies_state, self.prince_timestep
-            )
-
-            self.satellite.mission_time += self.prince_timestep
-
     def _step_simulation(self):
         if not self.simming:
             return
@@ -260,12 +276,20 @@ class SimulationApp:
         for body in self.bodies_state.bodies:
             body.log(TimeManager.sim_date.translate({ord(","): None}))
 
-        # timestep update
-        self.prince_timestep = update_bodies_dormand_prince(
-            self.bodies_state, self.prince_timestep
-        )
+        # timestep update, advance the clock by the step actually accepted
+        taken = self.stepper.step(self.bodies_state)
+        self.prince_timestep = self.stepper.dt
+
+        step_sizes.append(taken)
+        global_errors.append(self.stepper.error)
+
+        TimeManager.simulated_time += taken
 
-        TimeManager.simulated_time += self.prince_timestep
+        # the two body orbit is kepler's, advanced in closed form by the step
+        # the main system actually took so the two stay on the same clock
+        if self.satellite_exists and self.satellite is not None and self.satellite.mode == "two_body" \
+                and self.satellite.mission_time < self.satellite.t:
+            self.satellite.propagate(taken)
 
     # ------------------------------------------------------------------
     # Rendering
@@ -294,7 +318,7 @@ class SimulationApp:
             body.draw_orbit(self.orbits_shader, self.scale)
 
         # draw satellite if exists
-        if self.satellite_exists and self.satellite is not None:
+        if self.satellite_exists and self.satellite is not None and self.satellite.mode == "two_body":
             for body in self.satellite.bodies_state:
                 body.draw(self.sphere_shader, self.scale, self.simming)
                 body.draw_orbit(self.orbits_shader, self.scale)
@@ -343,15 +367,10 @@ class SimulationApp:
             # cleanup
             if self.bodies_state is not None:
                 for body in self.bodies_state.bodies:
-                    try:
-                        body.file.close()
-                    except Exception:
-                        pass
+                    body.close_log()
 
-            if self.satellite_exists and self.satellite is not None:
-                try:
-                    self.satellite.satellite.file.close()
-                except Exception:
-                    pass
+            if self.satellite_exists and self.satellite is not None and self.satellite.mode == "two_body":
+                self.satellite.satellite.close_log()
 
+            self.planner.close()
             glfw.terminate()
\ No newline at end of file
@@ -0,0 +1,146 @@
+# barnes-hut gravity, O(N log N) instead of the O(N^2) direct sum
+# https://en.wikipedia.org/wiki/Barnes%E2%80%93Hut_simulation
+#
+# the octree is built from morton (z-order) codes so that every cell is a
+# contiguous run of the sorted bodies, and the tree walk is done level by level
+# for all (body, cell) pairs at once rather than body by body in python.
+# a cell of size s at distance d is treated as a point mass when s / d < theta,
+# theta = 0 reproduces the direct sum (up to summation order).
+
+from simulation.odes import G
+import numpy as np
+
+MAX_DEPTH = 21  # 3 * 21 bits fit a uint64 morton code
+
+def _spread_bits(x : np.ndarray) -> np.ndarray :
+    # insert two zero bits between each of the low 21 bits
+    x = x & np.uint64(0x1fffff)
+    x = (x | x << np.uint64(32)) & np.uint64(0x1f00000000ffff)
+    x = (x | x << np.uint64(16)) & np.uint64(0x1f0000ff0000ff)
+    x = (x | x << np.uint64(8))  & np.uint64(0x100f00f00f00f00f)
+    x = (x | x << np.uint64(4))  & np.uint64(0x10c30c30c30c30c3)
+    x = (x | x << np.uint64(2))  & np.uint64(0x1249249249249249)
+    return x
+
+def morton_codes(positions : np.ndarray, lower : np.ndarray, size : float) -> np.ndarray :
+    cells = np.floor((positions - lower) / size * (1 << MAX_DEPTH))
+    cells = np.clip(cells, 0, (1 << MAX_DEPTH) - 1).astype(np.uint64)
+    return _spread_bits(cells[:, 0]) << np.uint64(2) | _spread_bits(cells[:, 1]) << np.uint64(1) | _spread_bits(cells[:, 2])
+
+
+class Octree :
+    # per level: first/last (exclusive) sorted body of every cell, its mass and
+    # centre of mass, and the range of its children on the next level
+
+    def __init__(self, positions : np.ndarray, masses : np.ndarray, leaf_size : int = 8) -> None :
+        lower = positions.min(axis=0)
+        self.size = float(np.max(positions.max(axis=0) - lower)) * (1 + 1e-12) or 1.0
+
+        codes = morton_codes(positions, lower, self.size)
+        self.order = np.argsort(codes, kind="stable")
+        codes = codes[self.order]
+        sorted_positions = positions[self.order]
+        sorted_masses = masses[self.order]
+        weighted = sorted_masses[:, np.newaxis] * sorted_positions
+
+        self.starts, self.ends, self.masses, self.centres, self.leaf = [], [], [], [], []
+        for level in range(MAX_DEPTH + 1) :
+            keys = codes >> np.uint64(3 * (MAX_DEPTH - level))
+            starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+            ends = np.r_[starts[1:], len(codes)]
+            mass = np.add.reduceat(sorted_masses, starts)
+            centre = np.add.reduceat(weighted, starts, axis=0)
+            np.divide(centre, mass[:, np.newaxis], out=centre, where=mass[:, np.newaxis] != 0)
+
+            self.starts.append(starts)
+            self.ends.append(ends)
+            self.masses.append(mass)
+            self.centres.append(centre)
+            self.leaf.append((ends - starts <= leaf_size) | (level == MAX_DEPTH))
+
+            if np.all(self.leaf[-1]) :
+                break
+
+        # children of cell i on level l are cells first[i]:last[i] on level l + 1
+        self.first_child, self.last_child = [], []
+        for level in range(len(self.starts) - 1) :
+            self.first_child.append(np.searchsorted(self.starts[level + 1], self.starts[level]))
+            self.last_child.append(np.searchsorted(self.starts[level + 1], self.ends[level]))
+
+        self.sorted_positions = sorted_positions
+        self.sorted_masses = sorted_masses
+
+
+def _expand(first : np.ndarray, last : np.ndarray, targets : np.ndarray) -> tuple[np.ndarray, np.ndarray] :
+    # every (target, index) pair for index in [first, last)
+    counts = last - first
+    repeated_targets = np.repeat(targets, counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return repeated_targets, np.repeat(first, counts) + offsets
+
+
+class BarnesHut :
+
+    def __init__(self, theta : float = 0.5, leaf_size : int = 8) -> None :
+        self.theta = theta
+        self.leaf_size = leaf_size
+
+    def accelerations(self, positions : np.ndarray, masses : np.ndarray) -> np.ndarray :
+        n = len(positions)
+        positions64 = np.asarray(positions, dtype=np.float64)
+        tree = Octree(positions64, np.asarray(masses, dtype=np.float64), self.leaf_size)
+        x = tree.sorted_positions
+        accelerations = np.zeros((n, 3))
+
+        def accumulate(targets, sources, source_masses) :
+            massive = source_masses != 0
+            targets, sources, source_masses = targets[massive], sources[massive], source_masses[massive]
+            drs = sources - x[targets]
+            norms = np.sqrt(np.einsum("ij,ij->i", drs, drs))
+            norms[norms == 0] = 1 # coincident bodies pull nothing, as in the direct sum
+            weights = G * source_masses / norms**3
+            for axis in range(3) :
+                accelerations[:, axis] += np.bincount(targets, weights * drs[:, axis], minlength=n)
+
+        # walk, all bodies start at the root
+        targets = np.arange(n)
+        cells = np.zeros(n, dtype=np.int64)
+        for level in range(len(tree.starts)) :
+            if len(targets) == 0 :
+                break
+
+            size = tree.size / (1 << level)
+            drs = tree.centres[level][cells] - x[targets]
+            distances = np.sqrt(np.einsum("ij,ij->i", drs, drs))
+            own = (tree.starts[level][cells] <= targets) & (targets < tree.ends[level][cells])
+            far = ~own & (size < self.theta * distances)
+
+            # far cells act as point masses
+            accumulate(targets[far], tree.centres[level][cells[far]], tree.masses[level][cells[far]])
+
+            # near leaves are summed body by body, skipping the target itself
+            near_leaf = ~far & tree.leaf[level][cells]
+            pair_targets, sources = _expand(tree.starts[level][cells[near_leaf]], tree.ends[level][cells[near_leaf]],
+                                            targets[near_leaf])
+            others = sources != pair_targets
+            accumulate(pair_targets[others], x[sources[others]], tree.sorted_masses[sources[others]])
+
+            # everything else opens up into its children
+            opened = ~far & ~near_leaf
+            targets, cells = _expand(tree.first_child[level][cells[opened]], tree.last_child[level][cells[opened]],
+                                     targets[opened]) if level < len(tree.first_child) else (targets[:0], cells[:0])
+
+        # back to the callers ordering
+        result = np.empty_like(accelerations)
+        result[tree.order] = accelerations
+        return result.astype(np.result_type(positions, masses), copy=False)
+
+    def __call__(self, t, positions, velocities, masses) :
+        if positions.ndim == 3 :
+            # ensemble (K, N, 3), one tree per member
+            masses = np.broadcast_to(masses, positions.shape[:-1])
+            return np.copy(velocities), np.stack([self.accelerations(p, m) for p, m in zip(positions, masses)])
+        return np.copy(velocities), self.accelerations(positions, masses)
+
+
+barnes_hut_gravitation = BarnesHut()
@@ -0,0 +1,103 @@
+# force kernel benchmark, times one evaluation of each gravity backend on a
+# random main-belt-like swarm around a solar mass and checks it against the
+# numpy kernel (median relative error of the accelerations), e.g.
+#
+#   python -m simulation.benchmark --sizes 250,1000,4000,16000 --theta 0.5
+#
+# the numpy kernel takes minutes per call at tens of thousands of bodies so it
+# is skipped above --max-direct
+
+import argparse
+import time
+
+import numpy as np
+
+from simulation.odes import GRAVITY_BACKENDS, make_gravity
+
+AU = 1.495978707e11
+SUN_MASS = 1.989e30
+
+
+def swarm(n : int, seed : int = 0) -> tuple[np.ndarray, np.ndarray, np.ndarray] :
+    # sun plus n - 1 bodies in a thick disc between 2 and 3.5 AU
+    rng = np.random.default_rng(seed)
+    radius = rng.uniform(2.0, 3.5, n) * AU
+    angle = rng.uniform(0, 2 * np.pi, n)
+    positions = np.stack([radius * np.cos(angle), radius * np.sin(angle), rng.normal(0, 0.1 * AU, n)], axis=1)
+    velocities = np.zeros_like(positions)
+    masses = rng.uniform(1e15, 1e20, n)
+    positions[0] = 0.0
+    masses[0] = SUN_MASS
+    return positions, velocities, masses
+
+
+def time_kernel(kernel, positions, velocities, masses, repeats : int) -> float :
+    # best of repeats, in seconds
+    best = np.inf
+    for _ in range(repeats) :
+        start = time.perf_counter()
+        kernel(0.0, positions, velocities, masses)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def median_relative_error(reference : np.ndarray, accelerations : np.ndarray) -> float :
+    return float(np.median(np.linalg.norm(accelerations - reference, axis=1) / np.linalg.norm(reference, axis=1)))
+
+
+def parse_args(argv=None) :
+    parser = argparse.ArgumentParser(description="Time the gravity backends against each other.")
+    parser.add_argument("--sizes", default="250,500,1000,2000,4000,8000,16000,32000",
+                        help="comma separated body counts")
+    parser.add_argument("--backends", default=",".join(GRAVITY_BACKENDS),
+                        help=f"comma separated, any of {', '.join(GRAVITY_BACKENDS)}")
+    parser.add_argument("--theta", type=float, default=0.5, help="barnes-hut opening angle")
+    parser.add_argument("--max-direct", type=int, default=8000,
+                        help="largest N for the numpy kernel, its time grows as N^2")
+    parser.add_argument("--repeats", type=int, default=3)
+    return parser.parse_args(argv)
+
+
+def main(argv=None) :
+    args = parse_args(argv)
+    sizes = [int(n) for n in args.sizes.split(",")]
+    backends = [name.strip() for name in args.backends.split(",")]
+    kernels = {name : make_gravity(name, **({"theta": args.theta} if name == "barnes_hut" else {}))
+               for name in backends}
+
+    # every other backend is checked against the numpy kernel where it runs
+    compared = [name for name in backends if name != "direct"] if "direct" in backends else []
+    print(f"{'N':>8}" + "".join(f"{name + ' [s]':>18}" for name in backends)
+          + "".join(f"{name + ' err':>18}" for name in compared))
+    crossovers = {}
+    for n in sizes :
+        positions, velocities, masses = swarm(n)
+        timings = {}
+        for name, kernel in kernels.items() :
+            if name == "direct" and n > args.max_direct :
+                continue
+            timings[name] = time_kernel(kernel, positions, velocities, masses, args.repeats)
+
+        errors = {}
+        if "direct" in timings :
+            reference = kernels["direct"](0.0, positions, velocities, masses)[1]
+            errors = {name : median_relative_error(reference, kernels[name](0.0, positions, velocities, masses)[1])
+                      for name in compared}
+
+        # smallest N at which the octree beats each direct summation kernel
+        if "barnes_hut" in timings :
+            for name in ("direct", "jit") :
+                if name in timings and name not in crossovers and timings["barnes_hut"] < timings[name] :
+                    crossovers[name] = n
+
+        print(f"{n:>8}" + "".join(f"{timings[name]:>18.4f}" if name in timings else f"{'-':>18}"
+                                  for name in backends)
+              + "".join(f"{errors[name]:>18.2e}" if name in errors else f"{'-':>18}" for name in compared))
+
+    if "barnes_hut" in kernels :
+        for name in ("direct", "jit") :
+            if name in kernels :
+                print(f"Crossover vs {name} :", f"N = {crossovers[name]}" if name in crossovers else "not reached in the sizes run")
+
+if __name__ == "__main__":
+    main()
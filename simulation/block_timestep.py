@@ -0,0 +1,175 @@
+# block (individual) time steps with the 4th order hermite predictor-corrector
+# Makino & Aarseth (1992), PASJ 44, 141, after Aarseth's NBODY codes
+#
+# every body gets its own step from its own dynamical timescale (aarseth's
+# criterion on the acceleration and its derivatives), rounded down to a power
+# of two fraction of max_dt so that bodies fall into blocks that share step
+# boundaries. at each block time only the bodies that are due are evaluated,
+# the others enter the force sum at positions predicted from their last
+# taylor expansion
+#
+#   x(t) = x0 + v0 dt + a0 dt^2 / 2 + j0 dt^3 / 6
+#
+# so with the MOON in the system the earth and the moon take short steps
+# while the sun and the outer planets are evaluated tens of times less
+# often. the kernel needs the jerk as well as the acceleration so it does not
+# go through the gravity backends. eta sets the accuracy, the steps scale as
+# sqrt(eta) and the error as eta^2, 1e-4 keeps the default bodies within a
+# few hundred m over a year (star cluster codes use 0.01 - 0.02).
+
+import numpy as np
+
+from simulation.odes import G
+
+DAY = 24 * 60 * 60
+LEVELS = 40                 # smallest step is max_dt / 2^LEVELS
+
+
+def accelerations_and_jerks(positions : np.ndarray, velocities : np.ndarray, sources : np.ndarray,
+                            source_velocities : np.ndarray, source_masses : np.ndarray) -> tuple[np.ndarray, np.ndarray] :
+    # acceleration and its time derivative on every target from every source,
+    # a target that is also a source sees itself at distance 0 and skips it
+    drs = sources[np.newaxis, :, :] - positions[:, np.newaxis, :]
+    dvs = source_velocities[np.newaxis, :, :] - velocities[:, np.newaxis, :]
+    r2 = np.sum(drs * drs, axis=-1)
+    r2[r2 == 0] = np.inf
+    inverse = G * source_masses / (r2 * np.sqrt(r2))
+    rv = np.sum(drs * dvs, axis=-1) / r2
+
+    accelerations = np.sum(inverse[..., np.newaxis] * drs, axis=1)
+    jerks = np.sum(inverse[..., np.newaxis] * (dvs - 3 * rv[..., np.newaxis] * drs), axis=1)
+    return accelerations, jerks
+
+
+class BlockHermite :
+
+    def __init__(self, max_dt : float = 16 * DAY, eta : float = 1e-4, eta_start : float = 0.005) -> None :
+        self.dt = np.inf            # to the next block time, capped by the caller to land on an epoch
+        self.t = 0.0
+        self.max_dt = max_dt
+        self.eta = eta
+        self.eta_start = eta_start
+        self._tick = max_dt / 2**LEVELS
+
+        self.accepted = 0
+        self.rejected = 0
+        self.evaluations = 0        # block steps, each evaluates only the bodies due
+        self.body_evaluations = 0   # forces on single bodies, N per evaluation for the global steppers
+        self.error = 0.0            # largest corrector change relative to the position
+
+        self._output = None
+
+    def _synchronised(self, bodies_state : object) -> bool :
+        # the state is ours unless someone changed it since the last step
+        # (impulses, added bodies), then every body restarts from it
+        return (self._output is not None and self._output[0].shape == bodies_state.positions.shape
+                and np.array_equal(self._output[0], bodies_state.positions)
+                and np.array_equal(self._output[1], bodies_state.velocities))
+
+    def _start(self, bodies_state : object) -> None :
+        assert bodies_state.members is None, "block time steps run a single system"
+        self._positions = np.copy(bodies_state.positions)
+        self._velocities = np.copy(bodies_state.velocities)
+        self._masses = bodies_state.masses
+        self._massive = np.flatnonzero(self._masses)
+
+        self._accelerations, self._jerks = self._evaluate(np.arange(len(self._masses)), self._positions, self._velocities)
+        a, j = np.linalg.norm(self._accelerations, axis=-1), np.linalg.norm(self._jerks, axis=-1)
+        dt = self.eta_start * np.divide(a, j, out=np.full_like(a, np.inf), where=j > 0)
+
+        self._origin = self.t
+        self._times = np.zeros(len(self._masses), dtype=np.int64)
+        self._steps = self._quantise(dt)
+
+    def _evaluate(self, targets : np.ndarray, positions : np.ndarray, velocities : np.ndarray) -> tuple :
+        self.evaluations += 1
+        self.body_evaluations += len(targets)
+        massive = self._massive
+        return accelerations_and_jerks(positions[targets], velocities[targets], positions[massive],
+                                       velocities[massive], self._masses[massive])
+
+    def _quantise(self, dt : np.ndarray) -> np.ndarray :
+        # largest power of two number of ticks that fits in dt
+        ticks = np.clip(np.asarray(dt, dtype=float) / self._tick, 1, 2**LEVELS)
+        return np.left_shift(1, np.floor(np.log2(ticks)).astype(np.int64))
+
+    def _predict(self, t : float) -> tuple[np.ndarray, np.ndarray] :
+        tau = (t - (self._origin + self._times * self._tick))[:, np.newaxis]
+        positions = self._positions + tau * (self._velocities + tau * (self._accelerations / 2 + tau * self._jerks / 6))
+        velocities = self._velocities + tau * (self._accelerations + tau * self._jerks / 2)
+        return positions, velocities
+
+    def step(self, bodies_state : object) -> float :
+        if not self._synchronised(bodies_state) :
+            self._start(bodies_state)
+
+        block = np.min(self._times + self._steps)
+        t = self._origin + block * self._tick
+
+        # a block past the requested end synchronises every body on it instead
+        synchronise = t > self.t + self.dt
+        if synchronise :
+            t = self.t + self.dt
+            targets = np.arange(len(self._masses))
+        else :
+            targets = np.flatnonzero(self._times + self._steps == block)
+
+        positions, velocities = self._predict(t)
+        a1, j1 = self._evaluate(targets, positions, velocities)
+
+        # hermite corrector from the two ends of each body's own step
+        h = (t - (self._origin + self._times[targets] * self._tick))[:, np.newaxis]
+        a0, j0 = self._accelerations[targets], self._jerks[targets]
+        snap = (-6 * (a0 - a1) - h * (4 * j0 + 2 * j1)) / h**2
+        crackle = (12 * (a0 - a1) + 6 * h * (j0 + j1)) / h**3
+        corrected = positions[targets] + h**4 * (snap / 24 + h * crackle / 120)
+        velocities[targets] += h**3 * (snap / 6 + h * crackle / 24)
+        self.error = float(np.max(np.linalg.norm(corrected - positions[targets], axis=-1)
+                                  / np.maximum(np.linalg.norm(corrected, axis=-1), 1e-300)))
+        positions[targets] = corrected
+
+        self._positions[targets] = corrected
+        self._velocities[targets] = velocities[targets]
+        self._accelerations[targets], self._jerks[targets] = a1, j1
+
+        # aarseth's criterion with the derivatives at the end of the step
+        snap = snap + h * crackle
+        a, j = np.linalg.norm(a1, axis=-1), np.linalg.norm(j1, axis=-1)
+        s, c = np.linalg.norm(snap, axis=-1), np.linalg.norm(crackle, axis=-1)
+        numerator, denominator = a * s + j**2, j * c + s**2
+        dt = np.sqrt(self.eta * np.divide(numerator, denominator, out=np.full_like(a, np.inf), where=denominator > 0))
+
+        if synchronise :
+            # every body is at t, the block grid starts over from there
+            self._origin = t
+            self._times[:] = 0
+            self._steps = self._quantise(dt)
+        else :
+            # shrink freely, grow by at most a factor two and only onto a
+            # boundary of the coarser block
+            current = self._steps[targets]
+            wanted = self._quantise(dt)
+            doubled = 2 * current
+            grow = (wanted > current) & (block % doubled == 0) & (doubled <= 2**LEVELS)
+            self._times[targets] = block
+            self._steps[targets] = np.where(wanted < current, wanted, np.where(grow, doubled, current))
+
+        # the state seen outside is every body at t, the ones not due predicted
+        bodies_state.assign(positions, velocities)
+        self._output = (np.copy(bodies_state.positions), np.copy(bodies_state.velocities))
+
+        taken = t - self.t
+        self.t = t
+        self.dt = self._origin + np.min(self._times + self._steps) * self._tick - t
+        self.accepted += 1
+        return taken
+
+
+_block_hermite = BlockHermite()
+
+def update_bodies_block_hermite(bodies_state : object, dt : float) -> float :
+    # advances to the next block time but never past dt, returns the time to
+    # the block after that
+    _block_hermite.dt = dt
+    _block_hermite.step(bodies_state)
+    return _block_hermite.dt
@@ -1,15 +1,31 @@
-import glm
 import numpy as np
-from engine.sphere import Sphere
-from OpenGL.GL import *
-from OpenGL.GL.shaders import compileProgram, compileShader
-from engine.shader import *
-from dataclasses import dataclass
 from collections.abc import MutableSequence
 import csv
-import os
 from pathlib import Path
 
+# rendering is optional, the physics state and integrators never touch GL so
+# bodies can be built on machines without a display or PyOpenGL installed
+try:
+    from OpenGL.GL import *
+    from engine.sphere import Sphere
+    from engine.shader import Shader
+except ImportError:
+    Sphere = None
+    Shader = None
+
+RESULTS_DIR = Path(__file__).resolve().parents[1] / "data" / "simulation_results"
+
+# precision policy of the state arrays. "compensated" keeps float64 state and
+# kernels but carries the rounding error of every position and velocity update
+# in a second array (kahan summation), which recovers most of what longdouble
+# buys at float64 speed. on platforms where longdouble is just float64 the
+# "longdouble" policy is too
+PRECISIONS = {
+    "float64": np.float64,
+    "longdouble": np.longdouble,
+    "compensated": np.float64,
+}
+
 class Body:
     def __init__(self, ID, color, radius, position, velocity, mass):
 
@@ -23,16 +39,30 @@ class Body:
         self.force = np.array([0,0,0])
         self.mass = mass
         self.acceleration = np.array([0,0,0])
-
-        # mesh
-        self.mesh = Sphere(self.radius, 50, self.position)
         self.ID = ID
 
-        # orbit
+        # mesh and orbit buffer are created on the first draw call, which is
+        # the first point a GL context is guaranteed to exist
+        self.mesh = None
+        self.VBO = None
+
+        # orbit, the trail is allocated with the mesh so that headless runs
+        # with thousands of test particles don't carry 10000 points each
         self.max_orbit_points = 10000
-        self.orbit_points = np.full((self.max_orbit_points, 3), None, dtype=np.float32)
+        self.orbit_points = None
         self.orbit_index = 0
 
+        # logging, the results file is opened on the first log call
+        self.file = None
+        self.writer = None
+
+    def init_render(self) -> None:
+        if Sphere is None:
+            raise RuntimeError("rendering requires PyOpenGL, glfw and PyGLM")
+
+        self.mesh = Sphere(self.radius, 50, self.position)
+        self.orbit_points = np.full((self.max_orbit_points, 3), None, dtype=np.float32)
+
         # orbit buffer of fixed length
         self.VBO = glGenBuffers(1)
         glBindBuffer(GL_ARRAY_BUFFER, self.VBO)
@@ -43,17 +73,13 @@ class Body:
             GL_DYNAMIC_DRAW,
         )
         glBindBuffer(GL_ARRAY_BUFFER, 0)
-        
-        # logging
-        results_dir = Path(__file__).resolve().parents[1] / "data" / "simulation_results"
-        results_dir.mkdir(parents=True, exist_ok=True)
-        
-        self.file = open(results_dir / f"{self.ID}.csv", "a", newline="")
-        self.writer = csv.writer(self.file)
 
     def draw(self, shader, scale, simming):
         # drawing the body consists of just drawing the sphere
         # mesh at the bodies position
+        if self.mesh is None :
+            self.init_render()
+
         self.mesh.draw(shader, self.position, scale)
         
         if simming : 
@@ -67,11 +93,14 @@ class Body:
             # cycle over the 500 index points in a circular fashion
             self.orbit_index = (self.orbit_index + 1) % self.max_orbit_points
 
-    def draw_orbit(self, shader : Shader, scale):
+    def draw_orbit(self, shader : 'Shader', scale):
         # each planet (body), has a trail , the sphere mesh doesnt. That is why
         # this method is located in the body class, doesn't require scale
         # as information passed has already been scaled.
 
+        if self.VBO is None :
+            self.init_render()
+
         shader.use()
         shader.setVec3('bodyColor',self.color)
         # bind buffer then bind and send data
@@ -108,66 +137,197 @@ class Body:
         glBindBuffer(GL_ARRAY_BUFFER, 0)
         
     def log(self,date) :
+        if self.file is None :
+            RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+            self.file = open(RESULTS_DIR / f"{self.ID}.csv", "a", newline="")
+            self.writer = csv.writer(self.file)
+
         self.writer.writerow([date,
                             self.position[0], self.position[1], self.position[2],
                             self.velocity[0], self.velocity[1], self.velocity[2]])  
 
+    def close_log(self) -> None :
+        if self.file is not None :
+            self.file.close()
+            self.file = None
+            self.writer = None
+
 class Bodies(MutableSequence):
-    def __init__(self, bodies : list[Body], positions: np.array, velocities: np.array, masses: np.array) -> None:
-        assert positions.shape[0] == velocities.shape[0] == masses.shape[0], "mismatched array dimensions"
+    # the first n_active bodies are massive, the rest are massless test
+    # particles (spacecraft, asteroid swarms) that feel the massive bodies but
+    # exert no force, their entry in masses is 0 so the kernels skip them as
+    # sources and a step costs N_massive x N instead of N x N
+    def __init__(self, bodies : list[Body], positions: np.array, velocities: np.array, masses: np.array,
+                 n_active : int | None = None, precision : str | None = None) -> None:
+        assert positions.shape[-2] == velocities.shape[-2] == masses.shape[-1], "mismatched array dimensions"
         self.bodies = bodies
-        self.positions = positions
-        self.velocities = velocities
-        self.masses = masses
         self.body_map = {body.ID: body for body in bodies}
+        self.n_active = len(bodies) if n_active is None else n_active
+
+        # without a policy the arrays are taken as they come
+        if precision is None :
+            precision = "longdouble" if positions.dtype == np.longdouble else "float64"
+        assert precision in PRECISIONS, f"precision must be one of {tuple(PRECISIONS)}"
+        self.precision = precision
+        dtype = PRECISIONS[precision]
+
+        self.positions = np.asarray(positions, dtype=dtype)
+        self.velocities = np.asarray(velocities, dtype=dtype)
+        self.masses = np.asarray(masses, dtype=dtype)
+
+        # kahan compensation, the exact state is positions - position_compensation.
+        # starts from what the cast to float64 rounded away
+        self.position_compensation = None
+        self.velocity_compensation = None
+        if precision == "compensated" :
+            self.position_compensation = (self.positions - positions).astype(dtype)
+            self.velocity_compensation = (self.velocities - velocities).astype(dtype)
 
     @classmethod
-    def from_bodies(cls, bodies: list[Body]) -> 'Bodies':
-        positions = np.array([body.position for body in bodies])
-        velocities = np.array([body.velocity for body in bodies])
-        masses = np.array([body.mass for body in bodies])
-        return cls(bodies, positions, velocities, masses)
-                
+    def from_bodies(cls, bodies: list[Body], test_particles: list[Body] = (), precision : str | None = None) -> 'Bodies':
+        bodies_state = cls(list(bodies),
+                           np.array([body.position for body in bodies]),
+                           np.array([body.velocity for body in bodies]),
+                           np.array([body.mass for body in bodies]),
+                           precision=precision)
+        if len(test_particles) :
+            bodies_state.add_test_particles(test_particles)
+        return bodies_state
+
+    def advance(self, drs : np.ndarray | None = None, dvs : np.ndarray | None = None) -> None :
+        # the one place integrators add their increments to the state, so the
+        # precision policy applies to all of them
+        if self.position_compensation is None :
+            if drs is not None :
+                self.positions += drs
+            if dvs is not None :
+                self.velocities += dvs
+            return
+
+        for state, compensation, increment in ((self.positions, self.position_compensation, drs),
+                                               (self.velocities, self.velocity_compensation, dvs)) :
+            if increment is None :
+                continue
+            y = increment - compensation
+            total = state + y
+            np.subtract(total - state, y, out=compensation)
+            np.copyto(state, total)
+
+    def assign(self, positions : np.ndarray, velocities : np.ndarray) -> None :
+        # overwrite the state outright (coordinate transforms, impulses), any
+        # carried compensation no longer belongs to it
+        np.copyto(self.positions, positions)
+        np.copyto(self.velocities, velocities)
+        if self.position_compensation is not None :
+            self.position_compensation[:] = 0
+            self.velocity_compensation[:] = 0
+
+    @property
+    def n_passive(self) -> int :
+        return len(self.bodies) - self.n_active
+
+    def add_test_particles(self, particles : list[Body]) -> None :
+        # appended to the passive block in one go, Body.mass is ignored (and
+        # reads 0 once accessed through the state). every ensemble member
+        # gets the same particles
+        particles = list(particles)
+        self.bodies = list(self.bodies) + particles
+        self.body_map.update({particle.ID: particle for particle in particles})
+
+        shape = self.positions.shape[:-2] + (len(particles), 3)
+        def extend(array, rows) :
+            return np.concatenate([array, np.broadcast_to(np.asarray(rows, dtype=array.dtype), shape)], axis=-2)
+
+        self.positions = extend(self.positions, [particle.position for particle in particles])
+        self.velocities = extend(self.velocities, [particle.velocity for particle in particles])
+        self.masses = np.concatenate([self.masses, np.zeros(self.masses.shape[:-1] + (len(particles),), dtype=self.masses.dtype)], axis=-1)
+        if self.position_compensation is not None :
+            self.position_compensation = extend(self.position_compensation, 0)
+            self.velocity_compensation = extend(self.velocity_compensation, 0)
+
+    @property
+    def members(self) -> int | None :
+        # ensemble size K for states shaped (K, N, 3), None for a single system
+        return self.positions.shape[0] if self.positions.ndim == 3 else None
+
+    def replicate(self, members : int) -> 'Bodies' :
+        # ensemble of identical copies shaped (K, N, 3), perturb positions and
+        # velocities afterwards. masses stay shared as (N,)
+        assert self.members is None, "already an ensemble"
+        ensemble = Bodies(self.bodies, np.repeat(self.positions[np.newaxis], members, axis=0),
+                          np.repeat(self.velocities[np.newaxis], members, axis=0), np.copy(self.masses),
+                          self.n_active, self.precision)
+        if self.position_compensation is not None :
+            ensemble.position_compensation = np.repeat(self.position_compensation[np.newaxis], members, axis=0)
+            ensemble.velocity_compensation = np.repeat(self.velocity_compensation[np.newaxis], members, axis=0)
+        return ensemble
+
     def __len__(self) -> int:
         return len(self.bodies)
     
     def __getitem__(self, key) -> Body:
+        # for an ensemble the body sees every member, position is (K, 3)
         body = self.bodies[key]
-        body.position = self.positions[key]
-        body.velocity = self.velocities[key]
-        body.mass = self.masses[key]
+        body.position = self.positions[..., key, :]
+        body.velocity = self.velocities[..., key, :]
+        body.mass = self.masses[..., key]
         return body
     
     def __setitem__(self, key, index, value) -> None :
         self.__dict__[key][index] = value
+        compensation = {"positions": self.position_compensation, "velocities": self.velocity_compensation}.get(key)
+        if compensation is not None :
+            compensation[index] = 0
         self.bodies[index] = self.__getitem__(index)
     
     def update(self, key, index, value) -> None : 
         self.__setitem__(key,index,value)
     
     def __delitem__(self, index) -> None :
-        del self.bodies[index]
+        # removes the body from every ensemble member, a massive one shrinks
+        # the active block
+        index = range(len(self.bodies))[index]
         del self.body_map[self.bodies[index].ID]
-        self.positions = np.delete(self.positions, index, axis=0)
-        self.velocities = np.delete(self.velocities, index, axis=0)
-        self.masses = np.delete(self.masses, index, axis=0)
+        del self.bodies[index]
+        if index < self.n_active :
+            self.n_active -= 1
+        self.positions = np.delete(self.positions, index, axis=-2)
+        self.velocities = np.delete(self.velocities, index, axis=-2)
+        self.masses = np.delete(self.masses, index, axis=-1)
+        if self.position_compensation is not None :
+            self.position_compensation = np.delete(self.position_compensation, index, axis=-2)
+            self.velocity_compensation = np.delete(self.velocity_compensation, index, axis=-2)
     
     def insert(self, body : Body) -> None :
-        self.bodies = np.append(self.bodies, body)
+        # a massive body goes at the end of the active block, a massless one
+        # at the end of the passive block. every ensemble member gets it
+        index = self.n_active if body.mass > 0 else len(self.bodies)
+        self.bodies = list(self.bodies)
+        self.bodies.insert(index, body)
         self.body_map[body.ID] = body
-        self.positions = np.append(self.positions, [body.position], axis=0)
-        self.velocities = np.append(self.velocities, [body.velocity], axis=0)
-        self.masses = np.append(self.masses, [body.mass], axis=0)
+        if body.mass > 0 :
+            self.n_active += 1
+
+        def place(array, row) :
+            row = np.broadcast_to(np.asarray(row, dtype=array.dtype), array.shape[:-2] + (3,))
+            return np.insert(array, index, row, axis=-2)
+
+        self.positions = place(self.positions, body.position)
+        self.velocities = place(self.velocities, body.velocity)
+        self.masses = np.insert(self.masses, index, body.mass, axis=-1)
+        if self.position_compensation is not None :
+            self.position_compensation = place(self.position_compensation, 0)
+            self.velocity_compensation = place(self.velocity_compensation, 0)
     
     def get_target(self, target_id) -> Body :
         return self.body_map.get(target_id)
         
-    def check_csvs(self) -> None :
-        results_dir = Path(__file__).resolve().parents[1] / "data" / "simulation_results"
-        results_dir.mkdir(parents=True, exist_ok=True)
+    def check_csvs(self, bodies : list[Body] | None = None) -> None :
+        # fresh result files with headers, for every body or only the given ones
+        RESULTS_DIR.mkdir(parents=True, exist_ok=True)
 
-        for body in self.bodies :
-            with open(results_dir / f"{body.ID}.csv", "w", newline="") as f:
+        for body in self.bodies if bodies is None else bodies :
+            with open(RESULTS_DIR / f"{body.ID}.csv", "w", newline="") as f:
                 writer = csv.writer(f)
                 writer.writerow([
                     'Date-time',
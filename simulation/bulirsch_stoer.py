@@ -0,0 +1,133 @@
+# gragg-bulirsch-stoer extrapolation
+# https://en.wikipedia.org/wiki/Bulirsch%E2%80%93Stoer_algorithm
+# (Hairer, Norsett & Wanner, Solving ODEs I, sec. II.9)
+#
+# a step is taken with the modified midpoint rule using n = 2, 4, 6, ...
+# substeps and the results are extrapolated to zero substep size. each new
+# column raises the order by two, so at tight tolerances a single step can be
+# very long compared with a fixed order runge-kutta method. the order is
+# controlled too: after each step the column with the least work per unit
+# step becomes the target, the next step is sized for it and builds at most
+# one column past it before it is rejected.
+
+from simulation.odes import gravitation
+from simulation.integrators import Tolerances
+import numpy as np
+
+SEQUENCE = (2, 4, 6, 8, 10, 12, 14, 16, 18, 20)   # deuflhard
+
+
+class BulirschStoer :
+
+    def __init__(self, dt : float = 3.154e7 / (160 * 144), tolerances : Tolerances | None = None,
+                 max_column : int = 9, safety : float = 0.9,
+                 min_factor : float = 0.2, max_factor : float = 4.0, min_dt : float = 1e-6,
+                 derivatives = gravitation) -> None :
+        assert 2 <= max_column <= len(SEQUENCE)
+
+        self.dt = dt
+        self.t = 0.0
+        self.tolerances = Tolerances() if tolerances is None else tolerances
+        self.max_column = max_column
+        self.target_column = None       # most efficient column of the last step, None until the first
+        self.safety = safety
+        self.min_factor = min_factor
+        self.max_factor = max_factor
+        self.min_dt = min_dt
+        self.derivatives = derivatives
+
+        self.accepted = 0
+        self.rejected = 0
+        self.evaluations = 0
+        self.error = 0.0
+
+    def _derivatives(self, t : float, positions : np.ndarray, velocities : np.ndarray, masses : np.ndarray) -> tuple :
+        self.evaluations += 1
+        return self.derivatives(t, positions, velocities, masses)
+
+    def _midpoint(self, bodies_state : object, f0 : tuple, dt : float, n : int) -> tuple[np.ndarray, np.ndarray] :
+        # modified midpoint over n substeps, returns the increment of the state
+        r0, v0, masses = bodies_state.positions, bodies_state.velocities, bodies_state.masses
+        h = dt / n
+
+        previous_r, previous_v = r0, v0
+        r = r0 + h * f0[0]
+        v = v0 + h * f0[1]
+        for m in range(1, n) :
+            fr, fv = self._derivatives(self.t + m * h, r, v, masses)
+            previous_r, r = r, previous_r + 2 * h * fr
+            previous_v, v = v, previous_v + 2 * h * fv
+
+        fr, fv = self._derivatives(self.t + dt, r, v, masses)
+        return (r + previous_r + h * fr) / 2 - r0, (v + previous_v + h * fv) / 2 - v0
+
+    def step(self, bodies_state : object) -> float :
+        f0 = self._derivatives(self.t, bodies_state.positions, bodies_state.velocities, bodies_state.masses)
+
+        # the first step may use every column, later ones one past the target
+        last = self.max_column - 1 if self.target_column is None else min(self.max_column - 1, self.target_column + 1)
+
+        dt = self.dt
+        while True :
+            # aitken-neville tableau on the increments, only the last row is kept,
+            # stopping at the first column whose error estimate is within tolerance
+            row_r, row_v = [], []
+            factors = {}
+            for k in range(last + 1) :
+                n = SEQUENCE[k]
+                new_r, new_v = [None] * (k + 1), [None] * (k + 1)
+                new_r[0], new_v[0] = self._midpoint(bodies_state, f0, dt, n)
+                for j in range(1, k + 1) :
+                    ratio = (n / SEQUENCE[k - j])**2 - 1
+                    new_r[j] = new_r[j - 1] + (new_r[j - 1] - row_r[j - 1]) / ratio
+                    new_v[j] = new_v[j - 1] + (new_v[j - 1] - row_v[j - 1]) / ratio
+                row_r, row_v = new_r, new_v
+
+                if k == 0 :
+                    continue
+
+                error = self.tolerances.norm(bodies_state, row_r[k], row_v[k],
+                                             row_r[k] - row_r[k - 1], row_v[k] - row_v[k - 1])
+                factors[k] = min(self.max_factor, max(self.min_factor, self.safety * max(error, 1e-10) ** (-1 / (2 * k + 1))))
+                if error <= 1.0 :
+                    break
+
+            if error <= 1.0 :
+                break
+
+            self.rejected += 1
+            dt *= min(1.0, factors[k])
+            if dt < self.min_dt :
+                raise RuntimeError(f"bulirsch-stoer step size underflow at t = {self.t} s (dt = {dt} s)")
+
+        bodies_state.advance(row_r[k], row_v[k])
+
+        # next step from the column with the least work per unit time, work
+        # being the evaluations needed to build that column. the order moves
+        # by one column at a time (the factors of the low columns are clipped
+        # and would make them look cheap), if the column we converged in is
+        # already the cheapest, aim one higher next time with the step scaled
+        # by the extra work
+        work = {column : 1 + sum(SEQUENCE[:column + 1]) for column in range(self.max_column)}
+        best = min((column for column in factors if column >= k - 1), key=lambda column : work[column] / factors[column])
+        factor = factors[best]
+        if best == k and k + 1 < self.max_column :
+            factor *= work[k + 1] / work[k]
+            best = k + 1
+        self.target_column = best
+
+        self.accepted += 1
+        self.error = error
+        self.t += dt
+        self.dt = dt * min(self.max_factor, factor)
+
+        return dt
+
+
+_bulirsch_stoer = BulirschStoer()
+
+def update_bodies_bulirsch_stoer(bodies_state : object, dt : float) -> float :
+    # one accepted step from a shared stepper, returns the suggested next step
+    _bulirsch_stoer.dt = dt
+    _bulirsch_stoer.step(bodies_state)
+    return _bulirsch_stoer.dt
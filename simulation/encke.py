@@ -0,0 +1,245 @@
+# encke's method for spacecraft (massless) on cruise arcs through the solar system
+# (Battin, An Introduction to the Mathematics and Methods of Astrodynamics, ch. 9.2)
+#
+# the spacecraft follows an osculating kepler orbit about the central body
+# (kepler.kepler_propagate, exact at any time) and only the deviation from it
+#
+#   delta'' = -(mu / rho^3) (delta - f(q) r) + a_perturbations
+#
+# is integrated, rho being the reference and r = rho + delta the true
+# heliocentric position. the sun's pull is taken out of the integration, what
+# is left (the planets, and the sun's own reaction to them) is small and
+# smooth so the steps can be days long. when delta grows past a fraction of
+# rho the reference is rectified onto the current osculating orbit.
+#
+# the massive bodies come from an ephemeris, e.g. a headless propagation of
+# the main system sampled every day, interpolated in between
+#
+#   python -m simulation.encke --host EARTH --offset 1e9 --dv 2950 --days 260 --cowell
+
+import argparse
+import time
+from datetime import datetime
+
+import numpy as np
+
+from simulation.body import Body, Bodies
+from simulation.integrators import AdaptiveStepper, Tolerances
+from simulation.kepler import kepler_propagate
+from simulation.load_bodies import LoadBodies
+from simulation.odes import G, newtonian_gravitation
+from simulation.propagate import BODY_DATA, DEFAULT_TARGETS, propagate
+from simulation.tableaux import DORMAND_PRINCE
+from utils.deltatime import TimeManager
+
+DAY = 24 * 60 * 60
+
+
+class SampledEphemeris :
+    # positions and velocities of the massive bodies sampled at times, cubic
+    # hermite interpolation in between (exact for the sampled velocities)
+
+    def __init__(self, times : np.ndarray, positions : np.ndarray, velocities : np.ndarray) -> None :
+        self.times = np.asarray(times, dtype=float)
+        self.positions = np.asarray(positions, dtype=float)
+        self.velocities = np.asarray(velocities, dtype=float)
+
+    @classmethod
+    def from_result(cls, result : dict, t0 : float = 0.0) -> 'SampledEphemeris' :
+        # from the output of propagate, whose times start at 0
+        return cls(result["times"] + t0, result["positions"], result["velocities"])
+
+    def __call__(self, t : float | np.ndarray) -> tuple[np.ndarray, np.ndarray] :
+        # at one time (N, 3) or at an array of times t.shape + (N, 3)
+        t = np.asarray(t, dtype=float)
+        k = np.clip(np.searchsorted(self.times, t, side="right") - 1, 0, len(self.times) - 2)
+        h = (self.times[k + 1] - self.times[k])[..., np.newaxis, np.newaxis]
+        s = (t - self.times[k])[..., np.newaxis, np.newaxis] / h
+        p0, p1 = self.positions[k], self.positions[k + 1]
+        m0, m1 = h * self.velocities[k], h * self.velocities[k + 1]
+
+        positions = ((2*s**3 - 3*s**2 + 1) * p0 + (s**3 - 2*s**2 + s) * m0
+                     + (-2*s**3 + 3*s**2) * p1 + (s**3 - s**2) * m1)
+        velocities = ((6*s**2 - 6*s) * p0 + (3*s**2 - 4*s + 1) * m0
+                      + (-6*s**2 + 6*s) * p1 + (3*s**2 - 2*s) * m1) / h
+        return positions, velocities
+
+
+class Encke :
+
+    def __init__(self, ephemeris : SampledEphemeris, masses : np.ndarray, central : int = 0, dt : float = DAY,
+                 tolerances : Tolerances | None = None, rectify : float = 0.01, cowell : bool = False) -> None :
+        # cowell = True integrates the full heliocentric motion instead, with
+        # the same perturbations and stepper, for comparison
+        self.ephemeris = ephemeris
+        self.masses = np.asarray(masses, dtype=float)
+        self.central = central
+        self.mu = G * self.masses[central]
+        self.dt = dt
+        # errors are absolute, the deviation is too small for a relative scale.
+        # 1 cm is rtol 1e-13 of an orbit at 1 AU
+        self.tolerances = Tolerances(0.0, 1e-2, 1e-8) if tolerances is None else tolerances
+        self.rectify = rectify
+        self.cowell = cowell
+
+        # sources for the perturbations, the central body's own pull is the
+        # kepler part so it only appears as a target (its reaction)
+        self._perturbing = np.copy(self.masses)
+        self._perturbing[central] = 0
+        self.rectifications = 0
+
+    def _perturbations(self, t : float, positions : np.ndarray) -> np.ndarray :
+        # planets on heliocentric spacecraft positions, minus the acceleration
+        # they give the central body
+        bodies, _ = self.ephemeris(t)
+        stack = np.concatenate([bodies, bodies[self.central] + positions])
+        masses = np.concatenate([self._perturbing, np.zeros(len(positions))])
+        _, accelerations = newtonian_gravitation(t, stack, np.zeros_like(stack), masses)
+        return accelerations[len(bodies):] - accelerations[self.central]
+
+    def _reference(self, t : float) -> tuple[np.ndarray, np.ndarray] :
+        return kepler_propagate(self._r0, self._v0, self.mu, t - self._epochs)
+
+    def _derivatives(self, t, deviations, deviation_velocities, masses) :
+        t = self._t0 + t
+        if self.cowell :
+            r = np.linalg.norm(deviations, axis=-1)[:, np.newaxis]
+            return np.copy(deviation_velocities), -self.mu * deviations / r**3 + self._perturbations(t, deviations)
+
+        reference, _ = self._reference(t)
+        positions = reference + deviations
+
+        # f(q) = 1 - (rho / r)^3 without the cancellation
+        rho2 = np.sum(reference * reference, axis=-1)
+        q = np.sum(deviations * (2 * reference + deviations), axis=-1) / rho2
+        root = (1 + q)**1.5
+        f = q * (3 + 3*q + q**2) / (root * (1 + root))
+
+        rho3 = (rho2 * np.sqrt(rho2))[:, np.newaxis]
+        accelerations = -self.mu / rho3 * (deviations - f[:, np.newaxis] * positions) + self._perturbations(t, positions)
+        return np.copy(deviation_velocities), accelerations
+
+    def propagate(self, positions : np.ndarray, velocities : np.ndarray, t0 : float, duration : float,
+                  sample_interval : float | None = None) -> dict :
+        # barycentric spacecraft states (n, 3) at t0 to t0 + duration, the
+        # samples are barycentric too
+        centre_r, centre_v = (array[self.central] for array in self.ephemeris(t0))
+        self._t0 = t0
+        self._r0 = np.array(positions, dtype=float) - centre_r
+        self._v0 = np.array(velocities, dtype=float) - centre_v
+        self._epochs = np.full(len(self._r0), t0)
+
+        ids = [f"SPACECRAFT_{i}" for i in range(len(self._r0))]
+        if self.cowell :
+            state = Bodies([Body(ID, None, 0.0, None, None, 0.0) for ID in ids], self._r0, self._v0, np.zeros(len(ids)))
+        else :
+            state = Bodies([Body(ID, None, 0.0, None, None, 0.0) for ID in ids], np.zeros_like(self._r0),
+                           np.zeros_like(self._v0), np.zeros(len(ids)))
+        stepper = AdaptiveStepper(DORMAND_PRINCE, self.dt, self.tolerances, derivatives=self._derivatives)
+
+        if sample_interval is None or sample_interval <= 0 :
+            sample_interval = duration
+        times, samples_r, samples_v = [t0], [np.copy(positions)], [np.copy(velocities)]
+        next_sample = min(sample_interval, duration)
+
+        t, steps = 0.0, 0
+        while t < duration :
+            # land on every sample epoch like propagate
+            wanted = stepper.dt
+            stepper.dt = min(wanted, next_sample - t)
+            cut = stepper.dt < wanted
+            t += stepper.step(state)
+            if cut :
+                stepper.dt = max(stepper.dt, wanted)
+            if next_sample - t <= 1e-9 * sample_interval :
+                t = next_sample
+            steps += 1
+            heliocentric_r, heliocentric_v = self._state(t0 + t, state)
+
+            if not self.cowell :
+                reference = heliocentric_r - state.positions
+                drift = np.linalg.norm(state.positions, axis=-1) > self.rectify * np.linalg.norm(reference, axis=-1)
+                if np.any(drift) :
+                    self._r0[drift], self._v0[drift] = heliocentric_r[drift], heliocentric_v[drift]
+                    self._epochs[drift] = t0 + t
+                    deviations, deviation_velocities = np.copy(state.positions), np.copy(state.velocities)
+                    deviations[drift], deviation_velocities[drift] = 0, 0
+                    state.assign(deviations, deviation_velocities)
+                    self.rectifications += int(np.sum(drift))
+
+            if t >= next_sample :
+                centre_r, centre_v = (array[self.central] for array in self.ephemeris(t0 + t))
+                times.append(t0 + t)
+                samples_r.append(heliocentric_r + centre_r)
+                samples_v.append(heliocentric_v + centre_v)
+                next_sample = min(next_sample + sample_interval, duration)
+
+        return {
+            "times": np.array(times),
+            "positions": np.array(samples_r),
+            "velocities": np.array(samples_v),
+            "steps": steps,
+            "rejected": stepper.rejected,
+            "evaluations": stepper.evaluations,
+            "rectifications": self.rectifications,
+        }
+
+    def _state(self, t : float, state : Bodies) -> tuple[np.ndarray, np.ndarray] :
+        # heliocentric spacecraft positions and velocities
+        if self.cowell :
+            return np.copy(state.positions), np.copy(state.velocities)
+        reference, reference_velocities = self._reference(t)
+        return reference + state.positions, reference_velocities + state.velocities
+
+
+def parse_args(argv=None) :
+    parser = argparse.ArgumentParser(description="Propagate a spacecraft with encke's method.")
+    parser.add_argument("--bodies", default=",".join(DEFAULT_TARGETS), help="massive bodies, the first is the central one")
+    parser.add_argument("--host", default="EARTH", help="body the spacecraft departs from")
+    parser.add_argument("--offset", type=float, default=1e9, help="start this far from the host, away from the sun, in m")
+    parser.add_argument("--dv", type=float, default=2950.0, help="along track departure speed relative to the host in m/s")
+    parser.add_argument("--days", type=float, default=260.0)
+    parser.add_argument("--dt", type=float, default=DAY, help="initial step in s")
+    parser.add_argument("--rectify", type=float, default=0.01, help="rectify when |delta| > rectify x |rho|")
+    parser.add_argument("--cowell", action="store_true", help="also propagate with cowell's method and compare")
+    parser.add_argument("--data", default=str(BODY_DATA))
+    return parser.parse_args(argv)
+
+
+def main(argv=None) :
+    args = parse_args(argv)
+    targets = [body.strip().upper() for body in args.bodies.split(",") if body.strip()]
+    duration = args.days * DAY
+
+    # the ephemeris, one sample a day of the main system
+    bodies_state = Bodies.from_bodies(LoadBodies(args.data, targets), precision="float64")
+    host = bodies_state.get_target(args.host)
+    sun = bodies_state[0]
+    outward = (host.position - sun.position) / np.linalg.norm(host.position - sun.position)
+    along = host.velocity - sun.velocity
+    along = along / np.linalg.norm(along)
+    position = host.position + args.offset * outward
+    velocity = host.velocity + args.dv * along
+
+    start = time.perf_counter()
+    ephemeris = SampledEphemeris.from_result(propagate(bodies_state, duration, 1369.0, "dop853", DAY))
+    print("Ephemeris :", f"{time.perf_counter() - start:.2f}", "s")
+
+    runs = [("encke", False)] + ([("cowell", True)] if args.cowell else [])
+    results = {}
+    for name, cowell in runs :
+        encke = Encke(ephemeris, bodies_state.masses, 0, args.dt, rectify=args.rectify, cowell=cowell)
+        start = time.perf_counter()
+        result = encke.propagate(position[np.newaxis], velocity[np.newaxis], 0.0, duration)
+        results[name] = result
+        print(f"{name:>7} : {result['steps']} steps ({result['rejected']} rejected), {result['evaluations']} evaluations,",
+              f"{result['rectifications']} rectifications, {time.perf_counter() - start:.2f} s")
+
+    final = results["encke"]["positions"][-1, 0]
+    print("Final Position :", final, "m", f"({datetime.fromtimestamp(TimeManager.unix_start + duration):%Y-%m-%d})")
+    if "cowell" in results :
+        print("Encke - Cowell :", f"{np.linalg.norm(final - results['cowell']['positions'][-1, 0]):.3e}", "m")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+# binary cache of the ephemeris traces (data/traces/{ID}_TRACE.csv) that the
+# lambert targeting reads
+#
+# a trace is converted once into an (n, 7) float64 .npy table, unix epoch
+# then px, py, pz, vx, vy, vz, next to a stamp of the csv's mtime and size.
+# later lookups memory-map the table and only stat the csv, a new or edited
+# trace is converted again. state_at interpolates linearly between the
+# samples around any array of times (np.searchsorted on the epoch column),
+# clamped to the first and last sample like lambert.get_dt always did
+#
+#   positions, velocities = TraceEphemeris().state_at("MARS", times)
+
+import csv
+import os
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parents[1]
+TRACE_DIR = ROOT / "data" / "traces"
+TRACE_DATE_FORMAT = "%A %B %d %Y %H:%M:%S"
+
+
+class TraceEphemeris :
+
+    def __init__(self, directory : Path = TRACE_DIR, cache : Path | None = None) -> None :
+        self.directory = Path(directory)
+        self.cache = self.directory / "cache" if cache is None else Path(cache)
+        self._tables = {}   # ID -> (stamp, memory-mapped table)
+
+    def _source(self, body : str) -> Path :
+        return self.directory / f"{body}_TRACE.csv"
+
+    @staticmethod
+    def _stamp(path : Path) -> str :
+        status = path.stat()
+        return f"{status.st_mtime_ns} {status.st_size}"
+
+    def _convert(self, source : Path, binary : Path, stamp : str) -> None :
+        # the one pass over the csv. written under a name of this process and
+        # moved into place so planner workers converting at the same time
+        # never see half a table
+        with open(source, newline="") as f :
+            reader = csv.reader(f)
+            next(reader)
+            rows = [[datetime.strptime(row[0], TRACE_DATE_FORMAT).timestamp()] + [float(value) for value in row[1:7]]
+                    for row in reader if row]
+        table = np.array(rows, dtype=np.float64).reshape(-1, 7)
+
+        self.cache.mkdir(parents=True, exist_ok=True)
+        temporary = binary.with_name(f"{binary.name}.{os.getpid()}.tmp")
+        with open(temporary, "wb") as f :
+            np.save(f, table)
+        os.replace(temporary, binary)
+        temporary = binary.with_suffix(f".stamp.{os.getpid()}.tmp")
+        temporary.write_text(stamp)
+        os.replace(temporary, binary.with_suffix(".stamp"))
+
+    def table(self, body : str) -> np.ndarray :
+        # (n, 7) epochs and states of body, converted first if the csv changed
+        stamp = self._stamp(self._source(body))
+        cached = self._tables.get(body)
+        if cached is not None and cached[0] == stamp :
+            return cached[1]
+
+        binary = self.cache / f"{body}_TRACE.npy"
+        key = binary.with_suffix(".stamp")
+        if not (binary.exists() and key.exists() and key.read_text() == stamp) :
+            self._convert(self._source(body), binary, stamp)
+        table = np.load(binary, mmap_mode="r")
+        self._tables[body] = (stamp, table)
+        return table
+
+    def epochs(self, body : str) -> np.ndarray :
+        return self.table(body)[:, 0]
+
+    def state_at(self, body : str, times : float | np.ndarray) -> tuple[np.ndarray, np.ndarray] :
+        # positions and velocities times.shape + (3,) of body at unix times
+        table = self.table(body)
+        epochs = table[:, 0]
+        times = np.asarray(times, dtype=np.float64)
+        upper = np.clip(np.searchsorted(epochs, times, side="left"), 0, len(epochs) - 1)
+        lower = np.maximum(upper - 1, 0)
+
+        span = epochs[upper] - epochs[lower]
+        with np.errstate(divide="ignore", invalid="ignore") :
+            alpha = np.where(span > 0, (times - epochs[lower]) / span, 0.0)
+        alpha = np.clip(alpha, 0.0, 1.0)[..., np.newaxis]
+        states = (1.0 - alpha) * table[lower, 1:] + alpha * table[upper, 1:]
+        return states[..., :3], states[..., 3:]
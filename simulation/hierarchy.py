@@ -0,0 +1,86 @@
+# hierarchical jacobi coordinates for systems with tight subsystems
+# (Beust 2003, A&A 400, 1129, after Wisdom & Holman 1991)
+#
+# tight groups (a planet and its moons) are replaced by the group's
+# barycenter plus one jacobi vector per moon, each moon measured from the
+# barycenter of the planet and the moons before it. the barycenters and the
+# ungrouped bodies are jacobi vectors about the central body in the order
+# they come in the state:
+#
+#   row of the central body    barycenter of everything
+#   row of a planet / group    its (group) barycenter - barycenter of the central body and the units before it
+#   row of a moon              moon - barycenter of its planet and the moons before it
+#
+# the map is linear and the same for positions, velocities and accelerations,
+# x' = T x, so the state itself stays cartesian and the steppers convert on
+# the way in and out. every non central row has a kepler problem of its own
+# (mu = G x the interior mass plus its own), see HierarchicalWisdomHolman in
+# symplectic.py
+
+import numpy as np
+
+from simulation.odes import G
+
+DEFAULT_GROUPS = {
+    "EARTH": ("MOON",),
+    "JUPITER": ("IO", "GANYMEDE", "CALLISTO"),
+}
+
+
+class Hierarchy :
+
+    def __init__(self, ids : list[str], masses : np.ndarray, groups : dict = DEFAULT_GROUPS, central : str = "SUN") -> None :
+        # groups whose planet or moons are missing from ids are skipped
+        n = len(ids)
+        index = {ID: i for i, ID in enumerate(ids)}
+        self.centre = index.get(central, 0)
+        self.groups = {index[primary] : [index[moon] for moon in moons if moon in index]
+                       for primary, moons in groups.items() if primary in index}
+        self.groups = {primary : moons for primary, moons in self.groups.items() if moons}
+        moons = {moon for group in self.groups.values() for moon in group}
+
+        masses = np.asarray(masses, dtype=float)
+        self.matrix = np.zeros((n, n))
+        self.mu = np.zeros(n)
+        self.matrix[self.centre] = masses / np.sum(masses)
+
+        interior = np.zeros(n)
+        interior[self.centre] = masses[self.centre]
+        for unit in (i for i in range(n) if i != self.centre and i not in moons) :
+            members = [unit] + self.groups.get(unit, [])
+            weights = np.zeros(n)
+            weights[members] = masses[members]
+            if np.sum(weights) == 0 :
+                weights[unit] = 1.0         # test particle, its own position
+            self.matrix[unit] = weights / np.sum(weights) - interior / np.sum(interior)
+            self.mu[unit] = G * (np.sum(interior) + np.sum(masses[members]))
+            interior[members] += masses[members]
+
+            inner = np.zeros(n)
+            inner[unit] = masses[unit]
+            for moon in self.groups.get(unit, []) :
+                self.matrix[moon] = -inner / np.sum(inner)
+                self.matrix[moon, moon] += 1.0
+                self.mu[moon] = G * (np.sum(inner) + masses[moon])
+                inner[moon] = masses[moon]
+
+        self.inverse = np.linalg.inv(self.matrix)
+        self.moving = np.arange(n) != self.centre
+
+    @classmethod
+    def from_state(cls, bodies_state : object, groups : dict = DEFAULT_GROUPS, central : str = "SUN") -> 'Hierarchy' :
+        return cls([body.ID for body in bodies_state.bodies], bodies_state.masses, groups, central)
+
+    def to_hierarchical(self, vectors : np.ndarray) -> np.ndarray :
+        return (self.matrix.astype(vectors.dtype) @ vectors)
+
+    def to_cartesian(self, vectors : np.ndarray) -> np.ndarray :
+        return (self.inverse.astype(vectors.dtype) @ vectors)
+
+    def kepler_accelerations(self, positions : np.ndarray) -> np.ndarray :
+        # -mu x / |x|^3 of every row in hierarchical coordinates, 0 for the barycenter
+        accelerations = np.zeros_like(positions)
+        X = positions[self.moving]
+        r = np.linalg.norm(X, axis=-1)[:, np.newaxis]
+        accelerations[self.moving] = -self.mu[self.moving, np.newaxis].astype(X.dtype) * X / r**3
+        return accelerations
@@ -0,0 +1,166 @@
+# IAS15, 15th order gauss-radau integrator with adaptive steps
+# Rein & Spiegel (2015), MNRAS 446, 1424, after Everhart (1985)
+#
+# the acceleration over a step is expanded as a polynomial in h = (t - t0) / dt
+#
+#   a(h) = a0 + b0 h + b1 h^2 + ... + b6 h^7
+#
+# whose coefficients are found by predictor-corrector iteration on the 7
+# gauss-radau substeps. the step size follows from the size of the last term
+# b6 relative to the acceleration, so close encounters (perihelia of comets,
+# the moon) are resolved automatically while quiet stretches take long steps.
+
+from simulation.odes import gravitation
+from math import comb
+import numpy as np
+
+# gauss-radau spacings
+NODES = np.array([0.0,
+                  0.0562625605369221464656521910318,
+                  0.180240691736892364987579942780,
+                  0.352624717113169637373907769648,
+                  0.547153626330555383001448554766,
+                  0.734210177215410531523210605558,
+                  0.885320946839095768090359771030,
+                  0.977520613561287501891174488626])
+
+def _conversion_matrix(nodes : np.ndarray) -> np.ndarray :
+    # a(h) - a0 = sum_k g_k h (h - h1) ... (h - hk), c[k, i] is the coefficient
+    # of h^(i+1) in that product so that b_i = sum_k c[k, i] g_k
+    c = np.zeros((7, 7))
+    product = np.array([1.0])                   # coefficients in increasing powers of h, times h
+    for k in range(7) :
+        if k > 0 :
+            product = np.convolve(product, [-nodes[k], 1.0])
+        c[k, :k + 1] = product
+    return c
+
+CONVERSION = _conversion_matrix(NODES)
+INVERSE_CONVERSION = np.linalg.inv(CONVERSION)    # g from b
+
+# taylor coefficients of the position and velocity updates, 1/((k+2)(k+3)) and 1/(k+2)
+POSITION_COEFFICIENTS = np.array([1 / ((k + 2) * (k + 3)) for k in range(7)])
+VELOCITY_COEFFICIENTS = np.array([1 / (k + 2) for k in range(7)])
+
+# binomial coefficients used to re-expand the polynomial about the next step
+BINOMIAL = np.array([[comb(j + 1, i + 1) for j in range(7)] for i in range(7)], dtype=float)
+
+
+class IAS15 :
+
+    def __init__(self, dt : float = 3.154e7 / (160 * 144), epsilon : float = 1e-9, safety : float = 0.25,
+                 min_dt : float = 1e-6, max_iterations : int = 12, derivatives = gravitation) -> None :
+        self.dt = dt
+        self.t = 0.0
+        self.epsilon = epsilon
+        self.safety = safety
+        self.min_dt = min_dt
+        self.max_iterations = max_iterations
+        self.derivatives = derivatives
+
+        self.accepted = 0
+        self.rejected = 0
+        self.evaluations = 0
+        self.error = 0.0
+
+        # b of the last accepted step and the prediction that was made for it
+        self._b = None
+        self._e = None
+        self._previous_dt = None
+
+    def _accelerations(self, t : float, positions : np.ndarray, velocities : np.ndarray, masses : np.ndarray) -> np.ndarray :
+        _, accelerations = self.derivatives(t, positions, velocities, masses)
+        self.evaluations += 1
+        return accelerations
+
+    def _predict(self, ratio : float) -> np.ndarray :
+        # polynomial of the previous step re-expanded about its end point and
+        # rescaled to the new step, corrected by how far off the last
+        # prediction was
+        b = self._b
+        q = ratio ** np.arange(1, 8)
+        e = np.einsum("i,ij,j...->i...", q, BINOMIAL, b)
+        prediction = e if self._e is None else e + (b - self._e)
+        self._e = e
+        return prediction
+
+    def _substep(self, h : float, dt : float, x0, v0, a0, b) -> tuple[np.ndarray, np.ndarray] :
+        hp = h ** np.arange(1, 8)
+        x = x0 + dt * h * v0 + dt**2 * h**2 * (a0 / 2 + np.tensordot(POSITION_COEFFICIENTS * hp, b, axes=1))
+        v = v0 + dt * h * (a0 + np.tensordot(VELOCITY_COEFFICIENTS * hp, b, axes=1))
+        return x, v
+
+    def step(self, bodies_state : object) -> float :
+        x0, v0, masses = bodies_state.positions, bodies_state.velocities, bodies_state.masses
+        a0 = self._accelerations(self.t, x0, v0, masses)
+        scale_a = np.max(np.abs(a0))
+
+        dt = self.dt
+        if self._b is not None and self._b.shape[1:] == x0.shape and self._previous_dt :
+            b = self._predict(dt / self._previous_dt)
+        else :
+            b = np.zeros((7,) + x0.shape, dtype=x0.dtype)
+            self._e = None
+
+        while True :
+            g = np.einsum("ki,k...->i...", INVERSE_CONVERSION, b) if np.any(b) else np.zeros_like(b)
+            accelerations = np.empty((8,) + x0.shape, dtype=x0.dtype)
+            accelerations[0] = a0
+
+            previous_correction = np.inf
+            for iteration in range(self.max_iterations) :
+                for n in range(1, 8) :
+                    x, v = self._substep(NODES[n], dt, x0, v0, a0, b)
+                    accelerations[n] = self._accelerations(self.t + NODES[n] * dt, x, v, masses)
+
+                    # newton divided difference for g_(n-1)
+                    gk = (accelerations[n] - a0) / NODES[n]
+                    for j in range(1, n) :
+                        gk = (gk - g[j - 1]) / (NODES[n] - NODES[j])
+                    dg = gk - g[n - 1]
+                    g[n - 1] = gk
+                    b[:n] += CONVERSION[n - 1, :n, np.newaxis, np.newaxis] * dg
+
+                # converged once the last correction is at roundoff level
+                correction = np.max(np.abs(dg)) / max(np.max(np.abs(accelerations[7])), 1e-300)
+                if correction < 1e-16 or (iteration > 1 and correction >= previous_correction) :
+                    break
+                previous_correction = correction
+
+            # step size from the size of the highest order term
+            error = np.max(np.abs(b[6])) / max(scale_a, 1e-300)
+            new_dt = dt * (self.epsilon / error) ** (1/7) if error > 0 else dt / self.safety
+
+            if new_dt / dt >= self.safety :
+                break
+
+            # rejected, retry with the suggested step from scratch
+            self.rejected += 1
+            dt = new_dt
+            b = np.zeros_like(b)
+            self._e = None
+            if dt < self.min_dt :
+                raise RuntimeError(f"ias15 step size underflow at t = {self.t} s (dt = {dt} s)")
+
+        # accept, h = 1
+        dx = dt * v0 + dt**2 * (a0 / 2 + np.tensordot(POSITION_COEFFICIENTS, b, axes=1))
+        dv = dt * (a0 + np.tensordot(VELOCITY_COEFFICIENTS, b, axes=1))
+        bodies_state.advance(dx, dv)
+
+        self.accepted += 1
+        self.error = float(error)
+        self.t += dt
+        self.dt = min(new_dt, dt / self.safety)
+        self._b = b
+        self._previous_dt = dt
+
+        return dt
+
+
+_ias15 = IAS15()
+
+def update_bodies_ias15(bodies_state : object, dt : float) -> float :
+    # one accepted step from a shared stepper, returns the suggested next step
+    _ias15.dt = dt
+    _ias15.step(bodies_state)
+    return _ias15.dt
@@ -1,255 +1,486 @@
 # https://en.wikipedia.org/wiki/Runge%E2%80%93Kutta%E2%80%93Fehlberg_method
 # https://en.wikipedia.org/wiki/Adaptive_step_size
 
-from simulation.odes import newtonian_gravitation
+from simulation.odes import gravitation
+from simulation.tableaux import ButcherTableau, RK4, BUTCHER_RK5, FEHLBERG_RK45, DORMAND_PRINCE, DOP853
 import numpy as np
 
 step_sizes = []
 global_errors = []
 
+class RungeKutta :
+    # generic explicit runge-kutta engine driven by a butcher tableau. the stage
+    # derivatives, stage states and solution increments live in a workspace
+    # that is reused between steps and only reallocated when the number of
+    # bodies (or the dtype) changes, every combination is accumulated in place.
+    # stages are stored pre-multiplied by dt, i.e. k_i = dt * f(t + c_i dt, y_i)
+
+    def __init__(self, tableau : ButcherTableau, derivatives = gravitation) -> None :
+        self.tableau = tableau
+        self.derivatives = derivatives
+        self.evaluations = 0
+
+        # only the non-zero coefficients are ever touched
+        self._a = [[(j, a) for j, a in enumerate(row) if a != 0] for row in tableau.a]
+        self._b = [(j, b) for j, b in enumerate(tableau.b) if b != 0]
+        self._b_hat = None if tableau.b_hat is None else [(j, b) for j, b in enumerate(tableau.b_hat) if b != 0]
+        self._e = None if tableau.e is None else [(j, e) for j, e in enumerate(tableau.e) if e != 0]
+        self._e_low = None if tableau.e_low is None else [(j, e) for j, e in enumerate(tableau.e_low) if e != 0]
+
+        # stages the propagated solution depends on, trailing stages only used
+        # by the error estimate are skipped by fixed steps
+        self.solution_stages = self._b[-1][0] + 1
+
+        self._shape = None
+        self._dtype = None
+
+    def _allocate(self, positions : np.ndarray) -> None :
+        if positions.shape == self._shape and positions.dtype == self._dtype :
+            return
+
+        self._shape, self._dtype = positions.shape, positions.dtype
+        stages = (self.tableau.stages,) + positions.shape
+
+        self.krs = np.empty(stages, dtype=self._dtype)
+        self.kvs = np.empty(stages, dtype=self._dtype)
+
+        self._stage_r   = np.empty(self._shape, dtype=self._dtype)
+        self._stage_v   = np.empty(self._shape, dtype=self._dtype)
+        self._scratch_r = np.empty(self._shape, dtype=self._dtype)
+        self._scratch_v = np.empty(self._shape, dtype=self._dtype)
+
+        self.drs  = np.empty(self._shape, dtype=self._dtype)
+        self.dvs  = np.empty(self._shape, dtype=self._dtype)
+        self.errs = np.empty(self._shape, dtype=self._dtype)
+        self.errv = np.empty(self._shape, dtype=self._dtype)
+
+        if self._e_low is not None :
+            self.errs_low = np.empty(self._shape, dtype=self._dtype)
+            self.errv_low = np.empty(self._shape, dtype=self._dtype)
+
+    @staticmethod
+    def _accumulate(out : np.ndarray, ks : np.ndarray, terms : list, scratch : np.ndarray) -> None :
+        # out += sum(coefficient * k) one term at a time, left to right
+        for j, coefficient in terms :
+            np.multiply(ks[j], coefficient, out=scratch)
+            out += scratch
+
+    @staticmethod
+    def _weighted_sum(out : np.ndarray, ks : np.ndarray, terms : list, scratch : np.ndarray) -> None :
+        j, coefficient = terms[0]
+        np.multiply(ks[j], coefficient, out=out)
+        RungeKutta._accumulate(out, ks, terms[1:], scratch)
+
+    def stages(self, bodies_state : object, dt : float, t : float = 0, count : int | None = None, first : int = 0) -> None :
+        # evaluate stages [first, count), stages before first must already be in krs/kvs
+        self._allocate(bodies_state.positions)
+        count = self.tableau.stages if count is None else count
+
+        for i in range(first, count) :
+            terms = self._a[i]
+            if terms :
+                np.copyto(self._stage_r, bodies_state.positions)
+                np.copyto(self._stage_v, bodies_state.velocities)
+                self._accumulate(self._stage_r, self.krs, terms, self._scratch_r)
+                self._accumulate(self._stage_v, self.kvs, terms, self._scratch_v)
+                positions, velocities = self._stage_r, self._stage_v
+            else :
+                positions, velocities = bodies_state.positions, bodies_state.velocities
+
+            drs, dvs = self.derivatives(t + self.tableau.c[i] * dt, positions, velocities, bodies_state.masses)
+            np.multiply(drs, dt, out=self.krs[i])
+            np.multiply(dvs, dt, out=self.kvs[i])
+            self.evaluations += 1
+
+        # unscaled derivative of the last stage evaluated, for fsal reuse
+        self.derivative = (drs, dvs)
+
+    def seed(self, drs : np.ndarray, dvs : np.ndarray, dt : float) -> None :
+        # first stage from an already known derivative, follow with stages(first=1)
+        self._allocate(drs)
+        np.multiply(drs, dt, out=self.krs[0])
+        np.multiply(dvs, dt, out=self.kvs[0])
+
+    def stage_state(self) -> tuple[np.ndarray, np.ndarray] :
+        # state the last stage was evaluated at, for fsal tableaux this is the
+        # propagated solution
+        return self._stage_r, self._stage_v
+
+    def increment(self) -> tuple[np.ndarray, np.ndarray] :
+        # propagated solution increment from the current stages
+        self._weighted_sum(self.drs, self.krs, self._b, self._scratch_r)
+        self._weighted_sum(self.dvs, self.kvs, self._b, self._scratch_v)
+        if self.tableau.b_scale != 1.0 :
+            self.drs *= self.tableau.b_scale
+            self.dvs *= self.tableau.b_scale
+        return self.drs, self.dvs
+
+    def error(self) -> tuple[np.ndarray, np.ndarray] :
+        # local error estimate, increment() must have been called first when
+        # the tableau carries an embedded solution rather than error weights
+        if self._e is not None :
+            self._weighted_sum(self.errs, self.krs, self._e, self._scratch_r)
+            self._weighted_sum(self.errv, self.kvs, self._e, self._scratch_v)
+        else :
+            self._weighted_sum(self.errs, self.krs, self._b_hat, self._scratch_r)
+            self._weighted_sum(self.errv, self.kvs, self._b_hat, self._scratch_v)
+            np.subtract(self.drs, self.errs, out=self.errs)
+            np.subtract(self.dvs, self.errv, out=self.errv)
+        return self.errs, self.errv
+
+    def low_error(self) -> tuple[np.ndarray, np.ndarray] :
+        # secondary lower order error estimate (dop853)
+        self._weighted_sum(self.errs_low, self.krs, self._e_low, self._scratch_r)
+        self._weighted_sum(self.errv_low, self.kvs, self._e_low, self._scratch_v)
+        return self.errs_low, self.errv_low
+
+    def step(self, bodies_state : object, dt : float, t : float = 0) -> None :
+        # fixed step
+        self.stages(bodies_state, dt, t, self.solution_stages)
+        drs, dvs = self.increment()
+        bodies_state.advance(drs, dvs)
+
+
+class Tolerances :
+    # per component error scaling for the adaptive steppers (hairer's norm)
+    #
+    #   scale_i = atol_i + rtol_i * max(|y0_i|, |y1_i|)
+    #   error   = sqrt(mean((e_i / scale_i)**2))
+    #
+    # and a step is accepted when error <= 1. positions (m) and velocities (m/s)
+    # get their own tolerances so that neither block swamps the other, and any
+    # of them can be overridden per body, e.g.
+    #
+    #   Tolerances(rtol=1e-13, bodies={"MOON": {"rtol_positions": 1e-15}})
+
+    FIELDS = ("rtol_positions", "atol_positions", "rtol_velocities", "atol_velocities")
+
+    def __init__(self, rtol : float = 1e-13, atol_positions : float = 1e-4, atol_velocities : float = 1e-10,
+                 rtol_velocities : float | None = None, bodies : dict | None = None) -> None :
+        self.rtol_positions = rtol
+        self.rtol_velocities = rtol if rtol_velocities is None else rtol_velocities
+        self.atol_positions = atol_positions
+        self.atol_velocities = atol_velocities
+        self.bodies = bodies or {}
+
+        self._ids = None
+        self._resolved = None
+
+    def _resolve(self, bodies_state : object) -> tuple :
+        defaults = tuple(getattr(self, field) for field in self.FIELDS)
+        if not self.bodies :
+            return defaults
+
+        # per body values as (N, 1) columns, rebuilt only when the bodies change
+        ids = tuple(body.ID for body in bodies_state.bodies)
+        if ids != self._ids :
+            self._ids = ids
+            self._resolved = tuple(
+                np.array([[self.bodies.get(ID, {}).get(field, default)] for ID in ids])
+                for field, default in zip(self.FIELDS, defaults)
+            )
+        return self._resolved
+
+    def _scales(self, bodies_state : object, drs : np.ndarray, dvs : np.ndarray) -> tuple[np.ndarray, np.ndarray] :
+        rtol_r, atol_r, rtol_v, atol_v = self._resolve(bodies_state)
+
+        scale_r = atol_r + rtol_r * np.maximum(np.abs(bodies_state.positions), np.abs(bodies_state.positions + drs))
+        scale_v = atol_v + rtol_v * np.maximum(np.abs(bodies_state.velocities), np.abs(bodies_state.velocities + dvs))
+        return scale_r, scale_v
+
+    def norm(self, bodies_state : object, drs : np.ndarray, dvs : np.ndarray, errs : np.ndarray, errv : np.ndarray,
+             members : bool = False) -> float | np.ndarray :
+        # members = True gives one error per ensemble member (leading axis)
+        scale_r, scale_v = self._scales(bodies_state, drs, dvs)
+        axes, size = self._reduction(errs, errv, members)
+
+        total = np.sum((errs / scale_r)**2, axis=axes) + np.sum((errv / scale_v)**2, axis=axes)
+        error = np.sqrt(total / size)
+        return error if members else float(error)
+
+    def blended_norm(self, bodies_state : object, drs : np.ndarray, dvs : np.ndarray, errs : np.ndarray, errv : np.ndarray,
+                     errs_low : np.ndarray, errv_low : np.ndarray, members : bool = False) -> float | np.ndarray :
+        # dop853's estimate, the high order error damped by a lower order one
+        scale_r, scale_v = self._scales(bodies_state, drs, dvs)
+        axes, size = self._reduction(errs, errv, members)
+
+        high = np.sum((errs / scale_r)**2, axis=axes) + np.sum((errv / scale_v)**2, axis=axes)
+        low = np.sum((errs_low / scale_r)**2, axis=axes) + np.sum((errv_low / scale_v)**2, axis=axes)
+        denominator = np.sqrt((high + 0.01 * low) * size)
+        error = np.divide(high, denominator, out=np.zeros_like(high), where=high != 0)
+        return error if members else float(error)
+
+    @staticmethod
+    def _reduction(errs : np.ndarray, errv : np.ndarray, members : bool) -> tuple :
+        if not members :
+            return None, errs.size + errv.size
+        return tuple(range(1, errs.ndim)), (errs.size + errv.size) // len(errs)
+
+
+class AdaptiveStepper :
+    # embedded runge-kutta with a PI (Gustafsson) step size controller.
+    # rejected steps are retried in a loop with a smaller dt rather than by
+    # recursion, and the derivative at the start of a step is evaluated once
+    # and kept across retries. for fsal tableaux (dormand prince) the last stage
+    # of an accepted step is the first stage of the next one, so it is cached
+    # and the next step costs one evaluation less.
+
+    def __init__(self, tableau : ButcherTableau = DORMAND_PRINCE, dt : float = 3.154e7 / (160 * 144),
+                 tolerances : Tolerances | None = None, safety : float = 0.9, min_factor : float = 0.2, max_factor : float = 5.0,
+                 min_dt : float = 1e-6, derivatives = gravitation) -> None :
+        assert tableau.adaptive, f"{tableau.name} has no embedded error estimate"
+        assert tableau.error_exponent is not None, f"{tableau.name} has no error_exponent for the controller"
+
+        self.engine = RungeKutta(tableau, derivatives)
+        self.dt = dt                    # step the next call will attempt
+        self.t = 0.0                    # simulated time of accepted steps
+        self.tolerances = Tolerances() if tolerances is None else tolerances
+
+        # controller, exponents from the tableau's error estimate
+        self.alpha = 0.7 * tableau.error_exponent
+        self.beta  = 0.4 * tableau.error_exponent
+        self.safety = safety
+        self.min_factor = min_factor
+        self.max_factor = max_factor
+        self.min_dt = min_dt
+
+        self.accepted = 0
+        self.rejected = 0
+        self.error = 0.0                # scaled error of the last accepted step
+        self._previous_error = 1.0
+
+        # derivative at the current state and the state it belongs to
+        self._derivative_r = None
+        self._derivative_v = None
+        self._state_r = None
+        self._state_v = None
+        self._masses = None
+
+    @property
+    def evaluations(self) -> int :
+        return self.engine.evaluations
+
+    def _cached_derivative(self, bodies_state : object) -> bool :
+        # the cache is only valid if nothing touched the state since our last step
+        return (self._state_r is not None
+                and self._state_r.shape == bodies_state.positions.shape
+                and self._state_r.dtype == bodies_state.positions.dtype
+                and np.array_equal(self._state_r, bodies_state.positions)
+                and np.array_equal(self._state_v, bodies_state.velocities)
+                and np.array_equal(self._masses, bodies_state.masses))
+
+    def _store_derivative(self, bodies_state : object, drs : np.ndarray, dvs : np.ndarray) -> None :
+        if self._state_r is None or self._state_r.shape != drs.shape or self._state_r.dtype != drs.dtype :
+            self._derivative_r = np.empty_like(drs)
+            self._derivative_v = np.empty_like(dvs)
+            self._state_r = np.empty_like(bodies_state.positions)
+            self._state_v = np.empty_like(bodies_state.velocities)
+
+        np.copyto(self._derivative_r, drs)
+        np.copyto(self._derivative_v, dvs)
+        np.copyto(self._state_r, bodies_state.positions)
+        np.copyto(self._state_v, bodies_state.velocities)
+        self._masses = np.copy(bodies_state.masses)
+
+    def step(self, bodies_state : object) -> float :
+        # take one accepted step, returns the step taken, self.dt is then the
+        # suggestion for the next one
+        engine = self.engine
+        tableau = engine.tableau
+
+        if not self._cached_derivative(bodies_state) :
+            drs, dvs = engine.derivatives(self.t, bodies_state.positions, bodies_state.velocities, bodies_state.masses)
+            engine.evaluations += 1
+            self._store_derivative(bodies_state, drs, dvs)
+
+        dt = self.dt
+        max_factor = self.max_factor
+
+        while True :
+            engine.seed(self._derivative_r, self._derivative_v, dt)
+            engine.stages(bodies_state, dt, self.t, first=1)
+            drs, dvs = engine.increment()
+            if tableau.e_low is None :
+                error = self.tolerances.norm(bodies_state, drs, dvs, *engine.error())
+            else :
+                error = self.tolerances.blended_norm(bodies_state, drs, dvs, *engine.error(), *engine.low_error())
+
+            if error <= 1.0 :
+                break
+
+            # rejected, shrink and never grow on the retry
+            self.rejected += 1
+            factor = self.safety * error ** (-self.alpha)
+            dt *= min(max_factor, max(self.min_factor, factor))
+            max_factor = 1.0
+
+            if dt < self.min_dt :
+                raise RuntimeError(f"{tableau.name} step size underflow at t = {self.t} s (dt = {dt} s)")
+
+        # accept
+        if tableau.fsal and bodies_state.position_compensation is None :
+            # the last stage was evaluated at the new state, adopt that exact
+            # state so its derivative can be reused
+            stage_r, stage_v = engine.stage_state()
+            np.copyto(bodies_state.positions, stage_r)
+            np.copyto(bodies_state.velocities, stage_v)
+            self._store_derivative(bodies_state, *engine.derivative)
+        else :
+            # compensated states take the increment, the last stage then lies
+            # within rounding of the new state and its derivative is still reused
+            bodies_state.advance(drs, dvs)
+            if tableau.fsal :
+                self._store_derivative(bodies_state, *engine.derivative)
+
+        self.accepted += 1
+        self.error = error
+        self.t += dt
+
+        # PI controller on the scaled error
+        error = max(error, 1e-10)
+        factor = self.safety * error ** (-self.alpha) * self._previous_error ** self.beta
+        self.dt = dt * min(max_factor, max(self.min_factor, factor))
+        self._previous_error = error
+
+        return dt
+
+
+class EnsembleStepper(AdaptiveStepper) :
+    # adaptive steps for an ensemble state shaped (K, N, 3), all members
+    # advanced by the same vectorised stages. each member keeps its own step
+    # size and error history, or with synchronised = True they all share the
+    # step the worst member allows. one call is one attempt for every member,
+    # members whose attempt is rejected stay put and retry on the next call,
+    # so step() returns the step each member took (0 where rejected).
+    # dt, t, accepted, rejected and error are arrays over the members
+
+    def __init__(self, tableau : ButcherTableau = DORMAND_PRINCE, dt : float = 3.154e7 / (160 * 144),
+                 tolerances : Tolerances | None = None, synchronised : bool = False, **options) -> None :
+        super().__init__(tableau, dt, tolerances, **options)
+        self.synchronised = synchronised
+
+    def _members(self, members : int) -> None :
+        # spread the scalar state of a fresh stepper over the members
+        if np.ndim(self.t) == 0 or len(self.t) != members :
+            self.dt = np.array(np.broadcast_to(self.dt, members), dtype=float)
+            self.t = np.full(members, float(np.max(self.t)))
+            self.accepted = np.zeros(members, dtype=int)
+            self.rejected = np.zeros(members, dtype=int)
+            self.error = np.zeros(members)
+            self._previous_error = np.ones(members)
+            self._retrying = np.zeros(members, dtype=bool)
+
+    def step(self, bodies_state : object) -> np.ndarray :
+        engine = self.engine
+        tableau = engine.tableau
+        self._members(bodies_state.members)
+
+        if not self._cached_derivative(bodies_state) :
+            drs, dvs = engine.derivatives(self.t[:, np.newaxis, np.newaxis], bodies_state.positions,
+                                          bodies_state.velocities, bodies_state.masses)
+            engine.evaluations += 1
+            self._store_derivative(bodies_state, drs, dvs)
+
+        dt = np.asarray(self.dt, dtype=float)
+        column = dt[:, np.newaxis, np.newaxis]
+        engine.seed(self._derivative_r, self._derivative_v, column)
+        engine.stages(bodies_state, column, self.t[:, np.newaxis, np.newaxis], first=1)
+        drs, dvs = engine.increment()
+        if tableau.e_low is None :
+            error = self.tolerances.norm(bodies_state, drs, dvs, *engine.error(), members=True)
+        else :
+            error = self.tolerances.blended_norm(bodies_state, drs, dvs, *engine.error(), *engine.low_error(), members=True)
+        if self.synchronised :
+            error[:] = np.max(error)
+
+        accepted = error <= 1.0
+        mask = accepted[:, np.newaxis, np.newaxis]
+
+        if tableau.fsal and bodies_state.position_compensation is None :
+            stage_r, stage_v = engine.stage_state()
+            np.copyto(bodies_state.positions, stage_r, where=mask)
+            np.copyto(bodies_state.velocities, stage_v, where=mask)
+        else :
+            bodies_state.advance(np.where(mask, drs, 0), np.where(mask, dvs, 0))
+
+        if tableau.fsal :
+            # keep the old derivative for the members that retry
+            derivative_r, derivative_v = engine.derivative
+            np.copyto(self._derivative_r, derivative_r, where=mask)
+            np.copyto(self._derivative_v, derivative_v, where=mask)
+            np.copyto(self._state_r, bodies_state.positions)
+            np.copyto(self._state_v, bodies_state.velocities)
+
+        # rejected members shrink and never grow on the retry, accepted ones
+        # go through the PI controller
+        clipped = np.maximum(error, 1e-10)
+        retry = np.clip(self.safety * clipped ** (-self.alpha), self.min_factor, 1.0)
+        factor = np.clip(self.safety * clipped ** (-self.alpha) * self._previous_error ** self.beta,
+                         self.min_factor, np.where(self._retrying, 1.0, self.max_factor))
+
+        taken = np.where(accepted, dt, 0.0)
+        self.dt = np.where(accepted, dt * factor, dt * retry)
+        self.t = self.t + taken
+        self.accepted += accepted
+        self.rejected += ~accepted
+        self.error = np.where(accepted, error, self.error)
+        self._previous_error = np.where(accepted, clipped, self._previous_error)
+        self._retrying = ~accepted
+
+        if np.any(~accepted & (self.dt < self.min_dt)) :
+            raise RuntimeError(f"{tableau.name} step size underflow in ensemble members {np.flatnonzero(~accepted & (self.dt < self.min_dt))}")
+
+        return taken
+
+
+# one engine (and so one workspace) per stepper, the main system and the
+# satellite use different steppers and would otherwise keep reallocating
+_rungekutta                = RungeKutta(RK4)
+_butchers_rungekutta       = RungeKutta(BUTCHER_RK5)
+_fehlberg_rungekutta       = AdaptiveStepper(FEHLBERG_RK45)
+_fixed_fehlberg_rungekutta = RungeKutta(FEHLBERG_RK45)
+_dormand_prince            = AdaptiveStepper(DORMAND_PRINCE)
+_fixed_dormand_prince      = RungeKutta(DORMAND_PRINCE)
+_dop853                    = AdaptiveStepper(DOP853)
+
 def update_bodies_rungekutta(bodies_state : object, dt : float) -> None :
-    
-    t  = 0 # no time dependence
-    
-    drs1, dvs1 = newtonian_gravitation(t,        bodies_state.positions,          bodies_state.velocities,          bodies_state.masses)
-    drs1 *= dt; dvs1 *= dt
-    drs2, dvs2 = newtonian_gravitation(t + dt/2, bodies_state.positions + drs1/2, bodies_state.velocities + dvs1/2, bodies_state.masses)
-    drs2 *= dt; dvs2 *= dt
-    drs3, dvs3 = newtonian_gravitation(t + dt/2, bodies_state.positions + drs2/2, bodies_state.velocities + dvs2/2, bodies_state.masses)
-    drs3 *= dt; dvs3 *= dt
-    drs4, dvs4 = newtonian_gravitation(t + dt,   bodies_state.positions + drs3,   bodies_state.velocities + dvs3,   bodies_state.masses)
-    drs4 *= dt; dvs4 *= dt
-
-    drs = 1/6 * (drs1 + 2*drs2 + 2*drs3 + drs4)
-    dvs = 1/6 * (dvs1 + 2*dvs2 + 2*dvs3 + dvs4)
-
-    bodies_state.positions += drs
-    bodies_state.velocities += dvs 
+    _rungekutta.step(bodies_state, dt)
     
 def update_bodies_butchers_rungekutta(bodies_state : object, dt : float) -> None : 
-    
-    t  = 0 # no time dependence
-    
-    drs1, dvs1 = newtonian_gravitation(t,        bodies_state.positions,          bodies_state.velocities,          bodies_state.masses)
-    drs1 *= dt; dvs1 *= dt
-    drs2, dvs2 = newtonian_gravitation(t + dt/4, bodies_state.positions + drs1/4, bodies_state.velocities + dvs1/4, bodies_state.masses)
-    drs2 *= dt; dvs2 *= dt
-    drs3, dvs3 = newtonian_gravitation(t + dt/4, bodies_state.positions + drs1/8 + drs2/8, 
-                                                 bodies_state.velocities + dvs1/8 + dvs2/8, bodies_state.masses)
-    drs3 *= dt; dvs3 *= dt
-    drs4, dvs4 = newtonian_gravitation(t + dt/2, bodies_state.positions - drs2/2 + drs3,   
-                                                 bodies_state.velocities - dvs2/2 + dvs3,   bodies_state.masses)
-    drs4 *= dt; dvs4 *= dt
-    drs5, dvs5 = newtonian_gravitation(t + 3/4 * dt, bodies_state.positions + 3/16 * drs1 + 9/16 * drs4, 
-                                                     bodies_state.velocities + 3/16 * dvs1 + 9/16 * dvs4, bodies_state.masses)
-    drs5 *= dt; dvs5 *= dt
-    drs6, dvs6 = newtonian_gravitation(t + dt, bodies_state.positions - 3/7 * drs1 + 2/7 * drs2 + 12/7 * drs3 - 12/7 * drs4 + 8/7 * drs5,
-                                               bodies_state.velocities - 3/7 * dvs1 + 2/7 * dvs2 + 12/7 * dvs3 - 12/7 * dvs4 + 8/7 * dvs5, bodies_state.masses) 
-    drs6 *= dt; dvs6 *= dt
-    
-    drs = 1/90 * (7*drs1 + 32*drs3 + 12*drs4 + 32*drs5 + 7*drs6)
-    dvs = 1/90 * (7*dvs1 + 32*dvs3 + 12*dvs4 + 32*dvs5 + 7*dvs6)
-    
-    bodies_state.positions += drs
-    bodies_state.velocities += dvs 
+    _butchers_rungekutta.step(bodies_state, dt)
     
 def update_bodies_fehlberg_rungekutta(bodies_state : object, dt : float) -> float :
-    
-    t = 0 # no time dependence
-
-    drs1, dvs1 = newtonian_gravitation(t,          bodies_state.positions,
-                                                   bodies_state.velocities,          
-                                                   bodies_state.masses)
-    drs1 *= dt; dvs1 *= dt
-    drs2, dvs2 = newtonian_gravitation(t + 1/2*dt, bodies_state.positions + 1/2*drs1,
-                                                   bodies_state.velocities + 1/2*dvs1, 
-                                                   bodies_state.masses)
-    drs2 *= dt; dvs2 *= dt
-    drs3, dvs3 = newtonian_gravitation(t + 1/2*dt, bodies_state.positions + 1/4*drs1 + 1/4*drs2,
-                                                   bodies_state.velocities + 1/4*dvs1 + 1/4*dvs2, 
-                                                   bodies_state.masses)
-    drs3 *= dt; dvs3 *= dt
-    drs4, dvs4 = newtonian_gravitation(t + dt,     bodies_state.positions + 0*drs1 + (-1)*drs2 + 2*drs3,
-                                                   bodies_state.velocities + 0*dvs1 + (-1)*dvs2 + 2*dvs3, 
-                                                   bodies_state.masses)
-    drs4 *= dt; dvs4 *= dt
-    drs5, dvs5 = newtonian_gravitation(t + 2/3*dt, bodies_state.positions + 7/27*drs1 + 10/27*drs2 + 0*drs3 + 1/27*drs4,
-                                                   bodies_state.velocities + 7/27*dvs1 + 10/27*dvs2 + 0*dvs3 + 1/27*dvs4, 
-                                                   bodies_state.masses)
-    drs5 *= dt; dvs5 *= dt
-    drs6, dvs6 = newtonian_gravitation(t + 1/5*dt, bodies_state.positions + 28/625*drs1 + (-1/5)*drs2 + 546/625*drs3 + 54/625*drs4 + (-378/625)*drs5,
-                                                   bodies_state.velocities + 28/625*dvs1 + (-1/5)*dvs2 + 546/625*dvs3 + 54/625*dvs4 + (-378/625)*dvs5, 
-                                                   bodies_state.masses)
-    drs6 *= dt; dvs6 *= dt
-
-    drs = 1/24*drs1 + 0*drs2 + 0*drs3 + 5/48*drs4 + 27/56*drs5 + 125/336*drs6 
-    dvs = 1/24*dvs1 + 0*dvs2 + 0*dvs3 + 5/48*dvs4 + 27/56*dvs5 + 125/336*dvs6 
-
-    _drse = 1/8*drs1 + 0*drs2 + 2/3*drs3 + 1/16*drs4 + (-27/56)*drs5 + (-125/336)*drs6
-    _dvse = 1/8*dvs1 + 0*dvs2 + 2/3*dvs3 + 1/16*dvs4 + (-27/56)*dvs5 + (-125/336)*dvs6
-
-    tolerance = 1e-6
-
-    error = (np.linalg.norm(_drse, axis=(0,1))**2+np.linalg.norm(_drse, axis=(0,1))**2)**(1/2)
-
-    _dt = 0.9 * dt * ( tolerance / error) ** (1/5)
-
-    if error > tolerance :
-        update_bodies_fehlberg_rungekutta(bodies_state, _dt)
-
-    else : 
-        print('p',dt)
-        bodies_state.positions += drs
-        bodies_state.velocities += dvs 
-        
-    return _dt
+    # one accepted step from a shared stepper, returns the suggested next step
+    stepper = _fehlberg_rungekutta
+    stepper.dt = dt
+    stepper.step(bodies_state)
+    return stepper.dt
         
 def update_bodies_fixed_fehlberg_rungekutta(bodies_state : object, dt : float) :
-
-    t = 0 # no time dependence
-
-    drs1, dvs1 = newtonian_gravitation(t,          bodies_state.positions,
-                                                   bodies_state.velocities,          
-                                                   bodies_state.masses)
-    drs1 *= dt; dvs1 *= dt
-    drs2, dvs2 = newtonian_gravitation(t + 1/2*dt, bodies_state.positions + 1/2*drs1,
-                                                   bodies_state.velocities + 1/2*dvs1, 
-                                                   bodies_state.masses)
-    drs2 *= dt; dvs2 *= dt
-    drs3, dvs3 = newtonian_gravitation(t + 1/2*dt, bodies_state.positions + 1/4*drs1 + 1/4*drs2,
-                                                   bodies_state.velocities + 1/4*dvs1 + 1/4*dvs2, 
-                                                   bodies_state.masses)
-    drs3 *= dt; dvs3 *= dt
-    drs4, dvs4 = newtonian_gravitation(t + dt,     bodies_state.positions + 0*drs1 + (-1)*drs2 + 2*drs3,
-                                                   bodies_state.velocities + 0*dvs1 + (-1)*dvs2 + 2*dvs3, 
-                                                   bodies_state.masses)
-    drs4 *= dt; dvs4 *= dt
-    drs5, dvs5 = newtonian_gravitation(t + 2/3*dt, bodies_state.positions + 7/27*drs1 + 10/27*drs2 + 0*drs3 + 1/27*drs4,
-                                                   bodies_state.velocities + 7/27*dvs1 + 10/27*dvs2 + 0*dvs3 + 1/27*dvs4, 
-                                                   bodies_state.masses)
-    drs5 *= dt; dvs5 *= dt
-    drs6, dvs6 = newtonian_gravitation(t + 1/5*dt, bodies_state.positions + 28/625*drs1 + (-1/5)*drs2 + 546/625*drs3 + 54/625*drs4 + (-378/625)*drs5,
-                                                   bodies_state.velocities + 28/625*dvs1 + (-1/5)*dvs2 + 546/625*dvs3 + 54/625*dvs4 + (-378/625)*dvs5, 
-                                                   bodies_state.masses)
-    drs6 *= dt; dvs6 *= dt
-
-    drs = 1/24*drs1 + 0*drs2 + 0*drs3 + 5/48*drs4 + 27/56*drs5 + 125/336*drs6 
-    dvs = 1/24*dvs1 + 0*dvs2 + 0*dvs3 + 5/48*dvs4 + 27/56*dvs5 + 125/336*dvs6 
-
-    print('s',dt)
-    bodies_state.positions += drs
-    bodies_state.velocities += dvs 
+    _fixed_fehlberg_rungekutta.step(bodies_state, dt)
 
 def update_bodies_dormand_prince(bodies_state: object, dt: float) -> float:
+    # one accepted step from a shared stepper, returns the suggested next step
     
     global step_sizes, global_errors
     
-    t = 0 
-    
-    drs1, dvs1 = newtonian_gravitation(t, bodies_state.positions, bodies_state.velocities, bodies_state.masses)
-    drs1 *= dt; dvs1 *= dt
-
-    drs2, dvs2 = newtonian_gravitation(t + (1/5) * dt, bodies_state.positions + (1/5) * drs1,
-                                                     bodies_state.velocities + (1/5) * dvs1, 
-                                                     bodies_state.masses)
-    drs2 *= dt; dvs2 *= dt
-    
-    drs3, dvs3 = newtonian_gravitation(t + (3/10) * dt, bodies_state.positions + (3/40) * drs1 + (9/40) * drs2,
-                                                       bodies_state.velocities + (3/40) * dvs1 + (9/40) * dvs2, 
-                                                       bodies_state.masses)
-    drs3 *= dt; dvs3 *= dt
-    
-    drs4, dvs4 = newtonian_gravitation(t + (4/5) * dt, bodies_state.positions + (44/45) * drs1 + (-56/15) * drs2 + (32/9) * drs3,
-                                                       bodies_state.velocities + (44/45) * dvs1 + (-56/15) * dvs2 + (32/9) * dvs3,
-                                                       bodies_state.masses)
-    drs4 *= dt; dvs4 *= dt
-    
-    drs5, dvs5 = newtonian_gravitation(t + (8/9) * dt, bodies_state.positions + (19372/6561) * drs1 + (-25360/2187) * drs2 + (64448/6561) * drs3 + (-212/729) * drs4,
-                                                       bodies_state.velocities + (19372/6561) * dvs1 + (-25360/2187) * dvs2 + (64448/6561) * dvs3 + (-212/729) * dvs4,
-                                                       bodies_state.masses)
-    drs5 *= dt; dvs5 *= dt
-    
-    drs6, dvs6 = newtonian_gravitation(t + dt, bodies_state.positions + (9017/3168) * drs1 + (-355/33) * drs2 + (46732/5247) * drs3 + (49/176) * drs4 + (-5103/18656) * drs5,
-                                                    bodies_state.velocities + (9017/3168) * dvs1 + (-355/33) * dvs2 + (46732/5247) * dvs3 + (49/176) * dvs4 + (-5103/18656) * dvs5,
-                                                    bodies_state.masses)
-    drs6 *= dt; dvs6 *= dt
-    
-    drs7, dvs7 = newtonian_gravitation(t + dt, bodies_state.positions + (35/384) * drs1 + (0) * drs2 + (500/1113) * drs3 + (125/192) * drs4 + (-2187/6784) * drs5 + (11/84) * drs6,
-                                                    bodies_state.velocities + (35/384) * dvs1 + (0) * dvs2 + (500/1113) * dvs3 + (125/192) * dvs4 + (-2187/6784) * dvs5 + (11/84) * dvs6,
-                                                    bodies_state.masses)
-    drs7 *= dt; dvs7 *= dt
+    stepper = _dormand_prince
+    stepper.dt = dt
+    taken = stepper.step(bodies_state)
 
-
-    drs5_order = (35/384) * drs1 + (500/1113) * drs3 + (125/192) * drs4 + (-2187/6784) * drs5 + (11/84) * drs6  
-    dvs5_order = (35/384) * dvs1 + (500/1113) * dvs3 + (125/192) * dvs4 + (-2187/6784) * dvs5 + (11/84) * dvs6  
-    
-    drs4_order = (5179/57600) * drs1 + (7571/16695) * drs3 + (393/640) * drs4 + (-92097/339200) * drs5 + (187/2100) * drs6 + (1/40) * drs7
-    dvs4_order = (5179/57600) * dvs1 + (7571/16695) * dvs3 + (393/640) * dvs4 + (-92097/339200) * dvs5 + (187/2100) * dvs6 + (1/40) * dvs7
-
-    # Compute error estimate
-    _drse = drs5_order - drs4_order
-    _dvse = dvs5_order - dvs4_order
-    
-    error = (np.linalg.norm(_drse, axis=(0, 1))**2 + np.linalg.norm(_dvse, axis=(0, 1))**2)**(1/2)
-    tolerance = 1e-4
-    
-    # Compute optimal time step
-    _dt = 0.9 * dt * (tolerance / error) ** (1/(5+1))
-    
-    # Adaptive step-size control
-    if error > tolerance:
-        update_bodies_dormand_prince(bodies_state, _dt)
-    
-    else:
-        step_sizes.append(dt)
-        global_errors.append(error)
-        
-        bodies_state.positions += drs5_order
-        bodies_state.velocities += dvs5_order
+    step_sizes.append(taken)
+    global_errors.append(stepper.error)
     
-    return _dt
+    return stepper.dt
 
 def update_bodies_fixed_dormand_prince(bodies_state: object, dt: float) -> float:
-    
-    t = 0  # No explicit time dependence
-    
-    drs1, dvs1 = newtonian_gravitation(t, bodies_state.positions, bodies_state.velocities, bodies_state.masses)
-    drs1 *= dt; dvs1 *= dt
-    
-    drs2, dvs2 = newtonian_gravitation(t + (1/5) * dt, bodies_state.positions + (1/5) * drs1,
-                                                     bodies_state.velocities + (1/5) * dvs1, 
-                                                     bodies_state.masses)
-    drs2 *= dt; dvs2 *= dt
-    
-    drs3, dvs3 = newtonian_gravitation(t + (3/10) * dt, bodies_state.positions + (3/40) * drs1 + (9/40) * drs2,
-                                                       bodies_state.velocities + (3/40) * dvs1 + (9/40) * dvs2, 
-                                                       bodies_state.masses)
-    drs3 *= dt; dvs3 *= dt
-    
-    drs4, dvs4 = newtonian_gravitation(t + (4/5) * dt, bodies_state.positions + (44/45) * drs1 + (-56/15) * drs2 + (32/9) * drs3,
-                                                       bodies_state.velocities + (44/45) * dvs1 + (-56/15) * dvs2 + (32/9) * dvs3,
-                                                       bodies_state.masses)
-    drs4 *= dt; dvs4 *= dt
-    
-    drs5, dvs5 = newtonian_gravitation(t + (8/9) * dt, bodies_state.positions + (19372/6561) * drs1 + (-25360/2187) * drs2 + (64448/6561) * drs3 + (-212/729) * drs4,
-                                                       bodies_state.velocities + (19372/6561) * dvs1 + (-25360/2187) * dvs2 + (64448/6561) * dvs3 + (-212/729) * dvs4,
-                                                       bodies_state.masses)
-    drs5 *= dt; dvs5 *= dt
-    
-    drs6, dvs6 = newtonian_gravitation(t + dt, bodies_state.positions + (9017/3168) * drs1 + (-355/33) * drs2 + (46732/5247) * drs3 + (49/176) * drs4 + (-5103/18656) * drs5,
-                                                    bodies_state.velocities + (9017/3168) * dvs1 + (-355/33) * dvs2 + (46732/5247) * dvs3 + (49/176) * dvs4 + (-5103/18656) * dvs5,
-                                                    bodies_state.masses)
-    drs6 *= dt; dvs6 *= dt
-    
-    drs7, dvs7 = newtonian_gravitation(t + dt, bodies_state.positions + (35/384) * drs1 + (0) * drs2 + (500/1113) * drs3 + (125/192) * drs4 + (-2187/6784) * drs5 + (11/84) * drs6,
-                                                    bodies_state.velocities + (35/384) * dvs1 + (0) * dvs2 + (500/1113) * dvs3 + (125/192) * dvs4 + (-2187/6784) * dvs5 + (11/84) * dvs6,
-                                                    bodies_state.masses)
-    drs7 *= dt; dvs7 *= dt
-
-    drs5_order = (35/384) * drs1 + (500/1113) * drs3 + (125/192) * drs4 + (-2187/6784) * drs5 + (11/84) * drs6  
-    dvs5_order = (35/384) * dvs1 + (500/1113) * dvs3 + (125/192) * dvs4 + (-2187/6784) * dvs5 + (11/84) * dvs6  
-    
-    bodies_state.positions += drs5_order
-    bodies_state.velocities += dvs5_order
-    
+    _fixed_dormand_prince.step(bodies_state, dt)
     return dt
+
+
+def update_bodies_dop853(bodies_state: object, dt: float) -> float:
+    # one accepted step from a shared stepper, returns the suggested next step
+    stepper = _dop853
+    stepper.dt = dt
+    stepper.step(bodies_state)
+    return stepper.dt
@@ -0,0 +1,185 @@
+# lambert's problem for whole arrays of problems at once
+# Izzo, "Revisiting Lambert's problem" (2015), CMDA 121, 1-15, after
+# poliastro.core.iod.izzo which solves one problem per call
+#
+# every problem is reduced to its non-dimensional time of flight T(x) with
+# lambda = +-sqrt(1 - c / s) fixing the geometry, the householder (4th order)
+# iterations on x then run on all problems in lockstep, the converged ones
+# drop out of the active set. with M revolutions there are two solutions,
+# the low and the high path, and none when T is below the minimum time of
+# flight of M revolutions, those come back as nan instead of raising
+#
+#   v1, v2 = izzo(r1, r2, tof, mu, revolutions=1, low_path=False)
+
+import numpy as np
+
+HYPERGEOMETRIC_TERMS = 60
+
+
+def _hyp2f1b(x : np.ndarray) -> np.ndarray :
+    # gauss' 2F1(3, 1, 5/2, x) by its series, x < 1 near the parabola
+    result = np.ones_like(x)
+    term = np.ones_like(x)
+    for i in range(HYPERGEOMETRIC_TERMS) :
+        term = term * (3 + i) * (1 + i) / (2.5 + i) * x / (i + 1)
+        result += term
+        if np.all(np.abs(term) <= 1e-16 * np.abs(result)) :
+            break
+    return np.where(x >= 1.0, np.inf, result)
+
+
+def _y(x : np.ndarray, ll : np.ndarray) -> np.ndarray :
+    return np.sqrt(1 - ll**2 * (1 - x**2))
+
+
+def _tof(x : np.ndarray, y : np.ndarray, ll : np.ndarray, M : np.ndarray) -> np.ndarray :
+    # non-dimensional time of flight T(x), the battin series near the
+    # parabola (x ~ 1) of single revolutions, lagrange's form elsewhere
+    T = np.empty_like(x)
+    near = (M == 0) & (x > np.sqrt(0.6)) & (x < np.sqrt(1.4))
+    if np.any(near) :
+        xn, yn, ln = x[near], y[near], ll[near]
+        eta = yn - ln * xn
+        Q = 4 / 3 * _hyp2f1b((1 - ln - xn * eta) / 2)
+        T[near] = (eta**3 * Q + 4 * ln * eta) / 2
+
+    far = ~near
+    if np.any(far) :
+        xf, yf, lf = x[far], y[far], ll[far]
+        psi = np.zeros_like(xf)
+        elliptic, hyperbolic = xf < 1, xf > 1
+        psi[elliptic] = np.arccos(np.clip(xf[elliptic] * yf[elliptic] + lf[elliptic] * (1 - xf[elliptic]**2), -1, 1))
+        psi[hyperbolic] = np.arcsinh((yf[hyperbolic] - xf[hyperbolic] * lf[hyperbolic]) * np.sqrt(xf[hyperbolic]**2 - 1))
+        with np.errstate(divide="ignore", invalid="ignore") :
+            T[far] = ((psi + M[far] * np.pi) / np.sqrt(np.abs(1 - xf**2)) - xf + lf * yf) / (1 - xf**2)
+    return T
+
+
+def _derivatives(x : np.ndarray, y : np.ndarray, T : np.ndarray, ll : np.ndarray) -> tuple :
+    # dT/dx up to the third, in closed form from T itself
+    one = 1 - x**2
+    d1 = (3 * T * x - 2 + 2 * ll**3 * x / y) / one
+    d2 = (3 * T + 5 * x * d1 + 2 * (1 - ll**2) * ll**3 / y**3) / one
+    d3 = (7 * x * d2 + 8 * d1 - 6 * (1 - ll**2) * ll**5 * x / y**5) / one
+    return d1, d2, d3
+
+
+def _minimum_tof(ll : np.ndarray, M : np.ndarray, tolerance : float, max_iterations : int) -> np.ndarray :
+    # smallest T of M > 0 revolutions, halley on dT/dx = 0 from x = 0.1
+    # (x > 0 stays clear of the singularity at ll = -1)
+    x = np.full_like(ll, 0.1)
+    active = np.ones(ll.shape, dtype=bool)
+    for _ in range(max_iterations) :
+        xa, la, Ma = x[active], ll[active], M[active]
+        ya = _y(xa, la)
+        d1, d2, d3 = _derivatives(xa, ya, _tof(xa, ya, la, Ma), la)
+        with np.errstate(divide="ignore", invalid="ignore") :
+            step = 2 * d1 * d2 / (2 * d2**2 - d1 * d3)
+        step = np.where(np.isfinite(step), step, 0.0)
+        x[active] = xa - step
+        active[active] = np.abs(step) >= tolerance
+        if not np.any(active) :
+            break
+    return _tof(x, _y(x, ll), ll, M)
+
+
+def _initial_guess(T : np.ndarray, ll : np.ndarray, M : np.ndarray, low_path : np.ndarray) -> np.ndarray :
+    x = np.empty_like(T)
+    single = M == 0
+    if np.any(single) :
+        Ts, ls = T[single], ll[single]
+        T0 = np.arccos(ls) + ls * np.sqrt(1 - ls**2)
+        T1 = 2 * (1 - ls**3) / 3
+        with np.errstate(divide="ignore", invalid="ignore") :
+            # the piecewise guess after eq. 30 of the paper is corrected as in poliastro #1362
+            guess = np.where(Ts >= T0, (T0 / Ts)**(2 / 3) - 1,
+                             np.where(Ts < T1, 2.5 * T1 / Ts * (T1 - Ts) / (1 - ls**5) + 1,
+                                      np.exp(np.log(2) * np.log(Ts / T0) / np.log(T1 / T0)) - 1))
+        x[single] = guess
+
+    multiple = ~single
+    if np.any(multiple) :
+        Tm, Mm = T[multiple], M[multiple]
+        left = ((Mm * np.pi + np.pi) / (8 * Tm))**(2 / 3)
+        right = ((8 * Tm) / (Mm * np.pi))**(2 / 3)
+        x_left, x_right = (left - 1) / (left + 1), (right - 1) / (right + 1)
+        x[multiple] = np.where(low_path[multiple], np.maximum(x_left, x_right), np.minimum(x_left, x_right))
+    return x
+
+
+def izzo(r1 : np.ndarray, r2 : np.ndarray, tof : np.ndarray, mu : float, revolutions : np.ndarray | int = 0,
+         prograde : np.ndarray | bool = True, low_path : np.ndarray | bool = True, tolerance : float = 1e-12,
+         max_iterations : int = 35) -> tuple[np.ndarray, np.ndarray] :
+    # departure and arrival velocities (..., 3) of the transfers r1 -> r2
+    # (..., 3) in tof (...), every argument broadcasts against the others.
+    # prograde is about +z, problems without a solution for their number of
+    # revolutions (or with a 180 degree transfer, which has no plane) are nan
+    r1, r2 = np.asarray(r1, dtype=float), np.asarray(r2, dtype=float)
+    shape = np.broadcast_shapes(r1.shape[:-1], r2.shape[:-1], np.shape(tof), np.shape(revolutions),
+                                np.shape(prograde), np.shape(low_path))
+    r1 = np.broadcast_to(r1, shape + (3,)).reshape(-1, 3)
+    r2 = np.broadcast_to(r2, shape + (3,)).reshape(-1, 3)
+    tof, M, prograde, low_path = (np.broadcast_to(np.asarray(array, dtype=dtype), shape).ravel()
+                                  for array, dtype in ((tof, float), (revolutions, int), (prograde, bool), (low_path, bool)))
+
+    c = r2 - r1
+    c_norm, n1, n2 = (np.linalg.norm(vector, axis=-1) for vector in (c, r1, r2))
+    s = (n1 + n2 + c_norm) / 2
+    i_r1, i_r2 = r1 / n1[:, np.newaxis], r2 / n2[:, np.newaxis]
+    with np.errstate(divide="ignore", invalid="ignore") :
+        i_h = np.cross(i_r1, i_r2)
+        i_h = i_h / np.linalg.norm(i_h, axis=-1)[:, np.newaxis]
+
+    # lambda and the tangential directions, flipped for the long way round
+    ll = np.sqrt(1 - np.minimum(1.0, c_norm / s))
+    flip = i_h[:, 2] < 0
+    ll = np.where(flip, -ll, ll)
+    i_t1 = np.where(flip[:, np.newaxis], np.cross(i_r1, i_h), np.cross(i_h, i_r1))
+    i_t2 = np.where(flip[:, np.newaxis], np.cross(i_r2, i_h), np.cross(i_h, i_r2))
+    sign = np.where(prograde, 1.0, -1.0)
+    ll = sign * ll
+    i_t1, i_t2 = sign[:, np.newaxis] * i_t1, sign[:, np.newaxis] * i_t2
+    T = np.sqrt(2 * mu / s**3) * tof
+
+    # most revolutions T allows, one less where it falls below that branch's minimum
+    M_max = np.floor(T / np.pi)
+    T00 = np.arccos(ll) + ll * np.sqrt(1 - ll**2)
+    check = (T < T00 + M_max * np.pi) & (M_max > 0)
+    if np.any(check) :
+        T_min = _minimum_tof(ll[check], M_max[check].astype(int), tolerance, max_iterations)
+        M_max[check] -= T[check] < T_min
+    feasible = (M <= M_max) & np.isfinite(ll) & np.all(np.isfinite(i_h), axis=-1)
+
+    # householder on every feasible problem at once
+    x = np.full_like(T, np.nan)
+    x[feasible] = _initial_guess(T[feasible], ll[feasible], M[feasible], low_path[feasible])
+    active = feasible.copy()
+    for _ in range(max_iterations) :
+        xa, la, Ma, Ta = x[active], ll[active], M[active], T[active]
+        ya = _y(xa, la)
+        value = _tof(xa, ya, la, Ma)
+        f = value - Ta
+        d1, d2, d3 = _derivatives(xa, ya, value, la)
+        with np.errstate(divide="ignore", invalid="ignore") :
+            step = f * (d1**2 - f * d2 / 2) / (d1 * (d1**2 - f * d2) + d3 * f**2 / 6)
+        step = np.where(np.isfinite(step), step, 0.0)
+        x[active] = xa - step
+        active[active] = np.abs(step) >= tolerance
+        if not np.any(active) :
+            break
+    y = _y(x, ll)
+
+    # velocities from x and y
+    gamma = np.sqrt(mu * s / 2)
+    rho = (n1 - n2) / c_norm
+    sigma = np.sqrt(1 - rho**2)
+    radial_1 = gamma * ((ll * y - x) - rho * (ll * y + x)) / n1
+    radial_2 = -gamma * ((ll * y - x) + rho * (ll * y + x)) / n2
+    tangential_1 = gamma * sigma * (y + ll * x) / n1
+    tangential_2 = gamma * sigma * (y + ll * x) / n2
+    v1 = radial_1[:, np.newaxis] * i_r1 + tangential_1[:, np.newaxis] * i_t1
+    v2 = radial_2[:, np.newaxis] * i_r2 + tangential_2[:, np.newaxis] * i_t2
+    v1[~feasible] = np.nan
+    v2[~feasible] = np.nan
+    return v1.reshape(shape + (3,)), v2.reshape(shape + (3,))
+
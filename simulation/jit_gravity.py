@@ -0,0 +1,108 @@
+# compiled direct summation, same result as odes.newtonian_gravitation but
+# every pair is visited once (newton's third law) and the accelerations are
+# accumulated in place, so there are no N x N x 3 temporaries. numba is
+# optional, without it (or for np.longdouble, which numba can't compile)
+# the numpy kernel is used instead.
+
+import numpy as np
+
+from simulation.odes import G, newtonian_gravitation
+
+try:
+    import numba
+    from numba import njit, prange
+except ImportError:
+    numba = None
+
+# below this the thread start up costs more than the pairs themselves
+PARALLEL_THRESHOLD = 512
+COMPILED_DTYPES = (np.dtype(np.float64), np.dtype(np.float32))
+
+if numba is not None :
+
+    @njit(cache=True, inline="always")
+    def _row(i, positions, masses, sources, accelerations) :
+        # pairs (i, j > i), both sides updated. a massless i only pairs with
+        # the massive j, the other test particles exert nothing on it
+        n = positions.shape[0]
+        xi, yi, zi = positions[i, 0], positions[i, 1], positions[i, 2]
+        mi = masses[i]
+        axi = ayi = azi = 0.0
+
+        if mi != 0 :
+            first, count = i + 1, n
+        else :
+            first, count = np.searchsorted(sources, i + 1), sources.shape[0]
+
+        for k in range(first, count) :
+            j = k if mi != 0 else sources[k]
+            dx = positions[j, 0] - xi
+            dy = positions[j, 1] - yi
+            dz = positions[j, 2] - zi
+            r2 = dx * dx + dy * dy + dz * dz
+            if r2 == 0 :
+                continue
+            inverse = G / (r2 * np.sqrt(r2))
+            sj = masses[j] * inverse
+            si = mi * inverse
+            axi += sj * dx
+            ayi += sj * dy
+            azi += sj * dz
+            accelerations[j, 0] -= si * dx
+            accelerations[j, 1] -= si * dy
+            accelerations[j, 2] -= si * dz
+
+        accelerations[i, 0] += axi
+        accelerations[i, 1] += ayi
+        accelerations[i, 2] += azi
+
+    @njit(cache=True)
+    def _pairwise_serial(positions, masses, sources, accelerations) :
+        accelerations[:] = 0
+        for i in range(positions.shape[0]) :
+            _row(i, positions, masses, sources, accelerations)
+
+    @njit(cache=True, parallel=True)
+    def _pairwise_parallel(positions, masses, sources, accelerations, threads) :
+        # every thread owns a private copy of the accelerations so the j side
+        # of the pair can be written without races, rows are dealt out
+        # round-robin to balance the triangle
+        n = positions.shape[0]
+        partial = np.zeros((threads, n, 3), dtype=accelerations.dtype)
+        for thread in prange(threads) :
+            for i in range(thread, n, threads) :
+                _row(i, positions, masses, sources, partial[thread])
+
+        for i in prange(n) :
+            for axis in range(3) :
+                total = 0.0
+                for thread in range(threads) :
+                    total += partial[thread, i, axis]
+                accelerations[i, axis] = total
+
+
+def accelerations(positions : np.ndarray, masses : np.ndarray, out : np.ndarray | None = None) -> np.ndarray :
+    positions = np.ascontiguousarray(positions)
+    masses = np.ascontiguousarray(masses, dtype=positions.dtype)
+    if out is None :
+        out = np.empty_like(positions)
+    sources = np.flatnonzero(masses)
+
+    if len(positions) < PARALLEL_THRESHOLD :
+        _pairwise_serial(positions, masses, sources, out)
+    else :
+        _pairwise_parallel(positions, masses, sources, out, numba.get_num_threads())
+    return out
+
+
+def jit_gravitation(t, positions, velocities, masses) :
+    if numba is None or positions.dtype not in COMPILED_DTYPES :
+        return newtonian_gravitation(t, positions, velocities, masses)
+    if positions.ndim == 3 :
+        # ensemble (K, N, 3), member by member
+        out = np.empty_like(positions)
+        masses = np.broadcast_to(masses, positions.shape[:-1])
+        for member in range(len(positions)) :
+            accelerations(positions[member], masses[member], out[member])
+        return np.copy(velocities), out
+    return np.copy(velocities), accelerations(positions, masses)
@@ -0,0 +1,158 @@
+# universal variable two-body propagation, vectorised over any number of orbits
+# https://en.wikipedia.org/wiki/Universal_variable_formulation
+# (Curtis, Orbital Mechanics for Engineering Students, ch. 3.7)
+
+import numpy as np
+
+# taylor coefficients 1 / (2k+2)! of C and 1 / (2k+3)! of S, k = 0 .. 11, in
+# longdouble and cast to the dtype of the state
+SERIES = np.empty((2, 12), dtype=np.longdouble)
+SERIES[:, 0] = np.longdouble(1) / 2, np.longdouble(1) / 6
+for _k in range(1, 12) :
+    SERIES[0, _k] = SERIES[0, _k - 1] / ((2*_k + 1) * (2*_k + 2))
+    SERIES[1, _k] = SERIES[1, _k - 1] / ((2*_k + 2) * (2*_k + 3))
+
+def stumpff(z : np.ndarray) -> tuple[np.ndarray, np.ndarray] :
+    # stumpff functions C(z), S(z). closed forms cancel badly for small |z|
+    # (which is every step of a short drift) so the series is used there
+    z = np.asarray(z)
+    C = np.empty_like(z)
+    S = np.empty_like(z)
+
+    small = np.abs(z) < 1.0
+    elliptic = (z > 0) & ~small
+    hyperbolic = (z < 0) & ~small
+
+    # series, sum_k (-z)^k / (2k+2)! and (-z)^k / (2k+3)! by horner, both at
+    # once. a single orbit only ever needs one of the branches, the empty
+    # ones are skipped
+    if np.any(small) :
+        # every z of a short drift is small, then no gather is needed
+        everywhere = np.all(small)
+        w = -z if everywhere else -z[small]
+        coefficients = SERIES.astype(z.dtype)
+        series = np.repeat(coefficients[:, -1:], w.size, axis=1)
+        for k in range(coefficients.shape[1] - 2, -1, -1) :
+            series *= w
+            series += coefficients[:, k:k + 1]
+        if everywhere :
+            return series[0], series[1]
+        C[small], S[small] = series
+
+    if np.any(elliptic) :
+        sz = np.sqrt(z[elliptic])
+        C[elliptic] = 2 * np.sin(sz / 2)**2 / z[elliptic]
+        S[elliptic] = (sz - np.sin(sz)) / sz**3
+
+    if np.any(hyperbolic) :
+        sz = np.sqrt(-z[hyperbolic])
+        C[hyperbolic] = 2 * np.sinh(sz / 2)**2 / -z[hyperbolic]
+        S[hyperbolic] = (np.sinh(sz) - sz) / sz**3
+
+    return C, S
+
+
+def _laguerre_anomaly(r0, vr0, alpha, sqrt_mu, dt, tolerance : float = 1e-14, max_iterations : int = 50) -> np.ndarray :
+    # universal anomaly chi of kepler's equation
+    #
+    #   F(chi) = r0 vr0 / sqrt(mu) chi^2 C + (1 - alpha r0) chi^3 S + r0 chi - sqrt(mu) dt = 0
+    #
+    # by laguerre-conway iteration (Conway 1986, n = 5), which converges from
+    # any start, unlike newton far from periapsis or after many periods. only
+    # the unconverged problems are iterated
+    n = 5
+    a_term = r0 * vr0 / sqrt_mu
+    b_term = 1 - alpha * r0
+    chi = sqrt_mu * alpha * dt
+    parabolic = np.abs(alpha) < 1e-12 / r0
+    chi[parabolic] = (sqrt_mu * dt / r0)[parabolic]
+
+    # hyperbolic start from the asymptotic growth of chi (Vallado, alg. 8)
+    hyperbolic = (alpha < 0) & ~parabolic
+    if np.any(hyperbolic) :
+        a = 1 / alpha[hyperbolic]
+        sign = np.sign(dt[hyperbolic])
+        sqrt_a = np.sqrt(-a)
+        mu_h = sqrt_mu[hyperbolic]**2
+        numerator = -2 * mu_h * alpha[hyperbolic] * dt[hyperbolic]
+        denominator = (r0 * vr0)[hyperbolic] + sign * mu_h**0.5 * sqrt_a * b_term[hyperbolic]
+        ratio = np.divide(numerator, denominator, out=np.ones_like(numerator), where=denominator != 0)
+        chi[hyperbolic] = sign * sqrt_a * np.log(np.maximum(ratio, 1e-300))
+
+    # a short arc (every drift of a symplectic step) starts from the taylor
+    # expansion of chi = sqrt(mu) integral dt / r instead, one iteration less
+    short = np.abs(dt) * sqrt_mu < 0.1 * r0**1.5
+    if np.any(short) :
+        chi = np.where(short, sqrt_mu * dt / r0 * (1 - vr0 * dt / (2 * r0)), chi)
+
+    # the problems still iterating, gathered only once some have converged
+    active = np.ones(chi.shape, dtype=bool)
+    x, a, b, r, alp, target = chi, a_term, b_term, r0, alpha, sqrt_mu * dt
+    for _ in range(max_iterations) :
+        z = alp * x**2
+        C, S = stumpff(z)
+        F = a * x**2 * C + b * x**3 * S + r * x - target
+        dF = a * x * (1 - z * S) + b * x**2 * C + r
+        ddF = a * (1 - z * C) + b * x * (1 - z * S)
+        root = np.sqrt(np.abs((n - 1)**2 * dF**2 - n * (n - 1) * F * ddF))
+        delta = n * F / (dF + np.where(dF < 0, -root, root))
+        x = x - delta
+        chi[active] = x
+
+        done = np.abs(delta) <= tolerance * np.maximum(np.abs(x), 1.0)
+        if np.all(done) :
+            break
+        if np.any(done) :
+            active[active] = ~done
+            x, a, b, r, alp, target = x[~done], a_term[active], b_term[active], r0[active], alpha[active], target[~done]
+    return chi
+
+
+def kepler_propagate(positions : np.ndarray, velocities : np.ndarray, mu, times) -> tuple[np.ndarray, np.ndarray] :
+    # relative states (..., 3) about a central mass mu = G M at any times
+    # after them, in one shot per query instead of stepping. positions and
+    # velocities, mu and times broadcast against each other, e.g. n orbits
+    # (n, 3) at m times each: times (n, m) or (m,) with positions[:, np.newaxis]
+    times = np.asarray(times)
+    shape = np.broadcast_shapes(positions.shape[:-1], np.shape(mu), times.shape)
+    flat = (int(np.prod(shape)),)
+    positions = np.broadcast_to(positions, shape + (3,)).reshape(flat + (3,))
+    velocities = np.broadcast_to(velocities, shape + (3,)).reshape(flat + (3,))
+    mu = np.broadcast_to(mu, shape).reshape(flat)
+    times = np.broadcast_to(times, shape).reshape(flat)
+
+    r0 = np.linalg.norm(positions, axis=-1)
+    v0_sq = np.sum(velocities * velocities, axis=-1)
+    vr0 = np.sum(positions * velocities, axis=-1) / r0
+    mu = np.asarray(mu, dtype=r0.dtype)
+    sqrt_mu = np.sqrt(mu)
+    alpha = 2 / r0 - v0_sq / mu
+
+    # whole periods of closed orbits change nothing, dropping them keeps chi
+    # (and its roundoff) small for queries years ahead. open orbits get an
+    # infinite period, which fmod leaves alone
+    period = np.full(r0.shape, np.inf, dtype=r0.dtype)
+    np.divide(2 * np.pi, sqrt_mu * np.abs(alpha)**1.5, out=period, where=alpha > 0)
+    dt = np.fmod(np.asarray(times, dtype=r0.dtype), period)
+
+    chi = _laguerre_anomaly(r0, vr0, alpha, sqrt_mu, dt)
+    z = alpha * chi**2
+    C, S = stumpff(z)
+
+    f = 1 - chi**2 / r0 * C
+    g = dt - chi**3 * S / sqrt_mu
+    new_positions = f[..., np.newaxis] * positions + g[..., np.newaxis] * velocities
+
+    r = np.linalg.norm(new_positions, axis=-1)
+    f_dot = sqrt_mu / (r * r0) * (alpha * chi**3 * S - chi)
+    g_dot = 1 - chi**2 / r * C
+    new_velocities = f_dot[..., np.newaxis] * positions + g_dot[..., np.newaxis] * velocities
+
+    return new_positions.reshape(shape + (3,)), new_velocities.reshape(shape + (3,))
+
+
+def kepler_drift(positions : np.ndarray, velocities : np.ndarray, mu, dt) -> tuple[np.ndarray, np.ndarray] :
+    # advance relative states (n, 3) about a central mass mu = G M by dt, the
+    # drift of the wisdom-holman splittings. mu and dt may be scalars or one
+    # value per orbit
+    return kepler_propagate(positions, velocities, np.asarray(mu), np.asarray(dt))
@@ -1,55 +1,37 @@
-from poliastro.core.iod import izzo
-from poliastro.bodies import Sun, Earth, Mars
 from datetime import datetime
-import bisect
 import numpy as np
-from lamberthub import izzo2015
-from pathlib import Path
+from simulation.ephemeris import TRACE_DIR, TraceEphemeris
+from simulation.izzo import izzo
+
+SUN_MU = 1.32712442099e20 # m^3/s^2, poliastro's Sun.k
 
 # paths 
-ROOT = Path(__file__).resolve().parents[1]
-TRACE_DIR = ROOT / "data" / "traces"
 TRACE_DIR.mkdir(parents=True, exist_ok=True)
 
-def lambert(host : str, target : str, t0 : float, r0 : np.array, desired_mission_duration : int) -> dict :
-
-    # load positions [x,y,z] , velocities [vx,vy,vz]
-    trace_path = TRACE_DIR / f"{target}_TRACE.csv"
-    sun_trace_path = TRACE_DIR / "SUN_TRACE.csv"
-
-    dates_target = np.genfromtxt(trace_path, delimiter=',', usecols=[0], skip_header=True, dtype=str)
-
-    _data_target = np.genfromtxt(trace_path, delimiter=',', usecols=[1,2,3], skip_header=True)
-    _data_v_target = np.genfromtxt(trace_path, delimiter=',', usecols=[4,5,6], skip_header=True)
+# the traces are read through their binary cache, see simulation/ephemeris.py
+EPHEMERIS = TraceEphemeris(TRACE_DIR)
 
-    _sun = np.genfromtxt(sun_trace_path, delimiter=',', usecols=[1,2,3], skip_header=True)
-    _sun_v = np.genfromtxt(sun_trace_path, delimiter=',', usecols=[4,5,6], skip_header=True)
-
-    # convert to heliocentric (target relative to Sun)
-    data_target = _data_target - _sun
-    data_v_target = _data_v_target - _sun_v
+def lambert(host : str, target : str, t0 : float, r0 : np.array, desired_mission_duration : int) -> dict :
 
-    info = get_dt(t0, host, target, dates_target, data_target, data_v_target, desired_mission_duration)
+    info = get_dt(t0, host, target, EPHEMERIS, desired_mission_duration)
 
     # use time-interpolated target state instead of just the lower sample
     r_target = info[f"{target}_LOC_INTERP"]
     corrected_duration = info["INTERP_DT"]
 
-    v_i, v_f = izzo(Sun.k, r0, r_target, corrected_duration, 0, True, False, 150, 1e-8)
-    # alt
-    # v_i, v_f = izzo2015(Sun.k, r0, r_target, corrected_duration, 0, True, True, 35, 0.00001, 1e-6)
+    v_i, v_f = izzo(r0, r_target, corrected_duration, SUN_MU, 0, True, False, 1e-8, 150)
 
     return v_i, info[f"{target}_VEL_INTERP"], corrected_duration
 
 
-def get_dt(t0 : float, host : str, target : str, target_dates : np.array, target_trace : np.array, target_velocity_trace : np.array, mission_duration : float):
+def get_dt(t0 : float, host : str, target : str, ephemeris : TraceEphemeris, mission_duration : float):
     periods = {
         "MARS": 686.980 * 24 * 60 * 60,
         "EARTH": 365 * 24 * 60 * 60,
     } # if you want to launch between different bodies youd have to add their periods here... :(
 
-    # convert to unix timestamps
-    timestamps = [datetime.strptime(ts, "%A %B %d %Y %H:%M:%S").timestamp() for ts in target_dates]
+    # unix timestamps of the target's samples
+    timestamps = ephemeris.epochs(target)
 
     # convert duration to seconds
     delta_t = mission_duration * 24 * 60 * 60
@@ -65,29 +47,22 @@ def get_dt(t0 : float, host : str, target : str, target_dates : np.array, target
         while t_target < timestamps[0]:
             t_target += orbit_time
 
-    # find floor and ceil using bisect
-    idx = bisect.bisect_left(timestamps, t_target)
+    # find floor and ceil
+    idx = int(np.searchsorted(timestamps, t_target, side="left"))
 
     floor_idx = max(0, idx - 1)
     ceil_idx = min(idx, len(timestamps) - 1)
 
-    t_floor = timestamps[floor_idx]
-    t_ceil = timestamps[ceil_idx]
-
-    loc_lower = target_trace[floor_idx]
-    loc_upper = target_trace[ceil_idx]
-    vel_lower = target_velocity_trace[floor_idx]
-    vel_upper = target_velocity_trace[ceil_idx]
-
-    # linear interpolation in time for smoother, more consistent target state
-    if t_ceil == t_floor:
-        alpha = 0.0
-    else:
-        alpha = (t_target - t_floor) / (t_ceil - t_floor)
-        alpha = max(0.0, min(1.0, alpha))
+    t_floor = float(timestamps[floor_idx])
+    t_ceil = float(timestamps[ceil_idx])
 
-    loc_interp = (1.0 - alpha) * loc_lower + alpha * loc_upper
-    vel_interp = (1.0 - alpha) * vel_lower + alpha * vel_upper
+    # heliocentric states at the two samples and linearly interpolated in
+    # time between them, for a smoother, more consistent target state
+    times = np.array([t_floor, t_ceil, t_target])
+    target_locs, target_vels = ephemeris.state_at(target, times)
+    sun_locs, sun_vels = ephemeris.state_at("SUN", times)
+    loc_lower, loc_upper, loc_interp = target_locs - sun_locs
+    vel_lower, vel_upper, vel_interp = target_vels - sun_vels
 
     return {
         f"{target}_LOC_LOWER": loc_lower,
@@ -1,9 +1,167 @@
+import os
 import numpy as np
+from contextlib import contextmanager
+from importlib import import_module
+from importlib.util import find_spec
 G = 6.67430e-11
 
-def newtonian_gravitation(t, positions, velocities, masses) : # vectorised approach
-    drs = positions[np.newaxis] - positions[:, np.newaxis]
+# the pair matrix is evaluated in tiles of rows so that the N x N_massive x 3
+# temporaries never exceed a memory budget, which also keeps them in cache at
+# mid-size N. each tile holds about PAIR_ARRAYS arrays of rows x sources x 3
+PAIR_ARRAYS = 4
+TILE_BYTES = 16 * 2**20
+
+def available_memory() -> int | None :
+    # free physical memory in bytes, None where the platform doesn't say
+    try :
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError) :
+        return None
+
+def tile_rows(n : int, n_sources : int, itemsize : int, budget : int | None = None) -> int :
+    # rows per tile that fit the budget, by default TILE_BYTES capped at a
+    # quarter of the free memory
+    if budget is None :
+        free = available_memory()
+        budget = TILE_BYTES if free is None else min(TILE_BYTES, free // 4)
+    return int(np.clip(budget // (PAIR_ARRAYS * 3 * itemsize * max(n_sources, 1)), 1, max(n, 1)))
+
+def _pair_accelerations(targets, sources, masses) :
+    drs = sources[..., np.newaxis, :, :] - targets[..., :, np.newaxis, :]
     norms = np.linalg.norm(drs, axis=-1)[..., np.newaxis]
     norms[norms == 0] = 1 # mitigate division by zero
-    as_ = G * np.sum(masses[np.newaxis, :, np.newaxis] * drs / norms**3, axis=1)
-    return np.copy(velocities), as_
\ No newline at end of file
+    return G * np.sum(masses[..., np.newaxis, :, np.newaxis] * drs / norms**3, axis=-2)
+
+def tiled_accelerations(positions, masses, rows : int | None = None, budget : int | None = None, targets = None) :
+    # positions (N, 3) or an ensemble (K, N, 3) with masses (N,) or (K, N),
+    # accelerations on targets (a block of the positions) or on every body.
+    # only massive bodies act as sources, massless test particles feel the
+    # field without adding to it, N x N_massive pairs instead of N x N
+    sources = positions
+    massive = np.any(masses != 0, axis=tuple(range(masses.ndim - 1)))
+    if not np.all(massive) :
+        sources, masses = positions[..., massive, :], masses[..., massive]
+    if targets is None :
+        targets = positions
+
+    n = targets.shape[-2]
+    if rows is None :
+        members = targets.size // (3 * n) if n else 1
+        rows = tile_rows(n, sources.shape[-2] * members, targets.itemsize, budget)
+    if rows >= n :
+        return _pair_accelerations(targets, sources, masses)
+
+    as_ = np.empty(targets.shape, dtype=np.result_type(targets, masses))
+    for start in range(0, n, rows) :
+        as_[..., start:start + rows, :] = _pair_accelerations(targets[..., start:start + rows, :], sources, masses)
+    return as_
+
+def newtonian_gravitation(t, positions, velocities, masses) : # vectorised approach, tiled for large N
+    return np.copy(velocities), tiled_accelerations(positions, masses)
+
+
+class TiledGravitation :
+    # newtonian_gravitation with a fixed tile, rows per tile or a memory
+    # budget in bytes
+
+    def __init__(self, rows : int | None = None, budget : int | None = None) -> None :
+        self.rows = rows
+        self.budget = budget
+
+    def __call__(self, t, positions, velocities, masses) :
+        return np.copy(velocities), tiled_accelerations(positions, masses, self.rows, self.budget)
+
+
+# gravity backends, all share the signature of newtonian_gravitation. entries
+# are "module:attribute", imported on first use, a class is instantiated with
+# the backend options (e.g. theta for barnes_hut)
+GRAVITY_BACKENDS = {
+    "direct": "simulation.odes:newtonian_gravitation",
+    "barnes_hut": "simulation.barnes_hut:BarnesHut",
+    "jit": "simulation.jit_gravity:jit_gravitation",
+    "tiled": "simulation.odes:TiledGravitation",
+    "parallel": "simulation.parallel_gravity:ParallelGravitation",
+}
+
+def _pair_accelerations_and_gradients(targets, sources, masses) :
+    # the tidal tensor da/dr = sum G m (3 d d^T / r^5 - I / r^3) from the same
+    # pair separations, a target that is also a source skips itself
+    drs = sources[..., np.newaxis, :, :] - targets[..., :, np.newaxis, :]
+    r2 = np.sum(drs * drs, axis=-1)
+    r2[r2 == 0] = np.inf
+    inverse = G * masses[..., np.newaxis, :] / (r2 * np.sqrt(r2))
+
+    accelerations = np.sum(inverse[..., np.newaxis] * drs, axis=-2)
+    outer = drs[..., :, np.newaxis] * drs[..., np.newaxis, :]
+    gradients = 3 * np.sum((inverse / r2)[..., np.newaxis, np.newaxis] * outer, axis=-3)
+    gradients -= np.sum(inverse, axis=-1)[..., np.newaxis, np.newaxis] * np.eye(3)
+    return accelerations, gradients
+
+def accelerations_and_gradients(positions, masses, rows : int | None = None, budget : int | None = None) :
+    # accelerations (..., N, 3) and their gradients with respect to each
+    # body's own position (..., N, 3, 3) in one pass, for the variational
+    # equations. tiled like tiled_accelerations, a pair holds 3 x 3 more
+    massive = np.any(masses != 0, axis=tuple(range(masses.ndim - 1)))
+    sources, source_masses = positions, masses
+    if not np.all(massive) :
+        sources, source_masses = positions[..., massive, :], masses[..., massive]
+
+    n = positions.shape[-2]
+    if rows is None :
+        members = positions.size // (3 * n) if n else 1
+        rows = tile_rows(n, 3 * sources.shape[-2] * members, positions.itemsize, budget)
+    if rows >= n :
+        return _pair_accelerations_and_gradients(positions, sources, source_masses)
+
+    dtype = np.result_type(positions, masses)
+    accelerations = np.empty(positions.shape, dtype=dtype)
+    gradients = np.empty(positions.shape + (3,), dtype=dtype)
+    for start in range(0, n, rows) :
+        block = slice(start, start + rows)
+        accelerations[..., block, :], gradients[..., block, :, :] = _pair_accelerations_and_gradients(
+            positions[..., block, :], sources, source_masses)
+    return accelerations, gradients
+
+# the compiled kernel when numba is installed, it falls back to the numpy one
+# by itself for dtypes numba can't handle (np.longdouble)
+DEFAULT_GRAVITY = "jit" if find_spec("numba") is not None else "direct"
+
+def make_gravity(name : str, **options) :
+    module, attribute = GRAVITY_BACKENDS[name].split(":")
+    backend = getattr(import_module(module), attribute)
+    if isinstance(backend, type) :
+        return backend(**options)
+    if options :
+        raise TypeError(f"gravity backend '{name}' takes no options")
+    return backend
+
+_gravity = None # resolved on the first call, importing numba is slow
+
+def set_gravity(backend = DEFAULT_GRAVITY, **options) -> None :
+    # select the kernel used by every integrator for the rest of the run, by
+    # name from GRAVITY_BACKENDS or as any callable with the same signature
+    global _gravity
+    _gravity = make_gravity(backend, **options) if isinstance(backend, str) else backend
+
+@contextmanager
+def using_gravity(backend, **options) :
+    # set_gravity for the length of a with block, the previous kernel is put back after
+    global _gravity
+    previous = _gravity
+    set_gravity(backend, **options)
+    try :
+        yield _gravity
+    finally :
+        _gravity = previous
+
+def gravitation(t, positions, velocities, masses) : # dispatches to the selected backend
+    if _gravity is None :
+        set_gravity()
+    return _gravity(t, positions, velocities, masses)
+
+
+def total_energy(positions, velocities, masses) : # kinetic + potential, for monitoring drift
+    kinetic = 0.5 * np.sum(masses * np.sum(velocities**2, axis=-1))
+    i, j = np.triu_indices(len(masses), 1)
+    potential = -G * np.sum(masses[i] * masses[j] / np.linalg.norm(positions[i] - positions[j], axis=-1))
+    return kinetic + potential
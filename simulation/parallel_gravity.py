@@ -0,0 +1,154 @@
+# direct summation spread over a persistent pool of worker processes, for one
+# large system (planets plus tens of thousands of massive asteroids). the
+# bodies are split by the i index, every worker computes the accelerations on
+# its block of rows against all sources and writes them into a shared output
+# buffer. positions and masses are shared the same way so a call only sends a
+# few bytes down each pipe. same signature as newtonian_gravitation, select it
+# with set_gravity("parallel", processes=...) and every stepper uses it.
+
+import atexit
+import os
+from multiprocessing import get_context, resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from simulation.odes import tiled_accelerations
+
+BUFFERS = ("positions", "masses", "accelerations")
+
+
+def _attach(layout : dict) -> tuple[list, dict] :
+    blocks, arrays = [], {}
+    for key in BUFFERS :
+        name, shape, dtype = layout[key]
+        block = SharedMemory(name=name)
+        blocks.append(block)
+        arrays[key] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+    return blocks, arrays
+
+
+def _worker(connection) -> None :
+    # wait for (layout, start, end), compute rows [start, end), reply. a new
+    # layout means the parent reallocated the buffers
+    blocks, arrays = [], None
+    while True :
+        message = connection.recv()
+        if message is None :
+            break
+
+        layout, start, end = message
+        try :
+            if layout is not None :
+                arrays = None
+                for block in blocks :
+                    block.close()
+                blocks, arrays = _attach(layout)
+
+            positions, masses = arrays["positions"], arrays["masses"]
+            arrays["accelerations"][..., start:end, :] = tiled_accelerations(positions, masses,
+                                                                             targets=positions[..., start:end, :])
+            connection.send(None)
+        except Exception as error :
+            connection.send(repr(error))
+
+    arrays = None
+    for block in blocks :
+        block.close()
+
+
+class ParallelGravitation :
+
+    def __init__(self, processes : int | None = None) -> None :
+        self.processes = processes or os.cpu_count() or 1
+        self._workers = []
+        self._connections = []
+        self._blocks = {}
+        self._arrays = {}
+        self._layout = None
+        self._sent = set()      # workers that already have the current layout
+
+    def _start(self) -> None :
+        # the workers have to inherit the parent's resource tracker, one of
+        # their own would unlink the shared blocks when the worker exits.
+        # spawned, not forked: a fork after numba's threading layer has
+        # started (jit_gravity's parallel kernel) hangs the interpreter at exit
+        resource_tracker.ensure_running()
+        context = get_context("spawn")
+        for _ in range(self.processes) :
+            parent, child = context.Pipe()
+            worker = context.Process(target=_worker, args=(child,), daemon=True)
+            worker.start()
+            self._workers.append(worker)
+            self._connections.append(parent)
+        atexit.register(self.close)
+
+    def _allocate(self, positions : np.ndarray, masses : np.ndarray) -> None :
+        wanted = {"positions": (positions.shape, positions.dtype), "masses": (masses.shape, masses.dtype),
+                  "accelerations": (positions.shape, np.result_type(positions, masses))}
+        if self._layout is not None and all(self._layout[key][1:] == (shape, np.dtype(dtype).str)
+                                            for key, (shape, dtype) in wanted.items()) :
+            return
+
+        # the old blocks stay until every worker has moved to the new ones
+        old = list(self._blocks.values())
+        self._blocks, self._arrays, layout = {}, {}, {}
+        for key, (shape, dtype) in wanted.items() :
+            dtype = np.dtype(dtype)
+            block = SharedMemory(create=True, size=max(int(np.prod(shape)) * dtype.itemsize, 1))
+            self._blocks[key] = block
+            self._arrays[key] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+            layout[key] = (block.name, shape, dtype.str)
+        self._layout = layout
+        self._sent = set()
+        self._retired = old
+
+    def accelerations(self, positions : np.ndarray, masses : np.ndarray) -> np.ndarray :
+        if not self._workers :
+            self._start()
+        self._allocate(positions, masses)
+
+        np.copyto(self._arrays["positions"], positions)
+        np.copyto(self._arrays["masses"], masses)
+
+        n = positions.shape[-2]
+        bounds = np.linspace(0, n, len(self._connections) + 1).astype(int)
+        busy = []
+        for worker, connection in enumerate(self._connections) :
+            if bounds[worker] == bounds[worker + 1] :
+                continue
+            layout = None if worker in self._sent else self._layout
+            connection.send((layout, int(bounds[worker]), int(bounds[worker + 1])))
+            self._sent.add(worker)
+            busy.append(connection)
+
+        errors = [error for error in (connection.recv() for connection in busy) if error is not None]
+        if errors :
+            raise RuntimeError(f"parallel gravity worker failed: {errors[0]}")
+
+        for block in getattr(self, "_retired", []) :
+            block.close()
+            block.unlink()
+        self._retired = []
+
+        return np.copy(self._arrays["accelerations"])
+
+    def __call__(self, t, positions, velocities, masses) :
+        return np.copy(velocities), self.accelerations(positions, masses)
+
+    def close(self) -> None :
+        for connection in self._connections :
+            try :
+                connection.send(None)
+            except (BrokenPipeError, OSError) :
+                pass
+        for worker in self._workers :
+            worker.join(timeout=1)
+        self._workers, self._connections = [], []
+        atexit.unregister(self.close)
+
+        self._arrays = {}
+        for block in list(self._blocks.values()) + getattr(self, "_retired", []) :
+            block.close()
+            block.unlink()
+        self._blocks, self._retired, self._layout = {}, [], None
@@ -0,0 +1,216 @@
+# parareal, parallel in time propagation for long reference runs
+# Lions, Maday & Turinici (2001), Gander & Vandewalle (2007)
+#
+# the span is cut into S slices. a cheap coarse propagator G (fixed step rk4
+# or a kepler drift about the first body) sweeps the slices serially, the
+# accurate fine propagator F (dormand prince by default) runs on every slice
+# at once on a process pool, and the slice boundaries are corrected with
+#
+#   U[n+1] <- G(U_new[n]) + F(U_old[n]) - G(U_old[n])
+#
+# until they stop changing by more than the fine tolerances. after k
+# iterations the first k slices are exact, so S iterations reproduce the
+# serial run and the gain is when it converges in a few, the wall time is
+# then ~ (T / S) x iterations on S cores. e.g.
+#
+#   python -m simulation.parareal --until 2034-01-01 --slices 16 --coarse kepler --bodies SUN,EARTH,MARS,JUPITER,SATURN
+
+import argparse
+import os
+import time
+from datetime import datetime
+from multiprocessing import get_context
+
+import numpy as np
+
+from simulation.body import Body, Bodies, PRECISIONS
+from simulation.integrators import Tolerances, update_bodies_rungekutta
+from simulation.kepler import kepler_drift
+from simulation.load_bodies import LoadBodies
+from simulation.odes import G
+from simulation.propagate import ADAPTIVE, BODY_DATA, DEFAULT_TARGETS, DEFAULT_TIMESTEP, INTEGRATORS, ROOT, propagate
+from utils.deltatime import TimeManager
+
+DAY = 24 * 60 * 60
+
+
+def rungekutta_coarse(bodies_state : Bodies, duration : float, dt : float) -> None :
+    t = 0.0
+    while t < duration :
+        h = min(dt, duration - t)
+        update_bodies_rungekutta(bodies_state, h)
+        t += h
+
+def kepler_coarse(bodies_state : Bodies, duration : float, dt : float) -> None :
+    # every body on its osculating orbit about the first one (the sun), which
+    # keeps its velocity. one drift per slice whatever dt is
+    positions, velocities, masses = bodies_state.positions, bodies_state.velocities, bodies_state.masses
+    drs, dvs = kepler_drift(positions[1:] - positions[0], velocities[1:] - velocities[0],
+                            G * (masses[0] + masses[1:]), duration)
+    centre = positions[0] + velocities[0] * duration
+    bodies_state.assign(np.concatenate([centre[np.newaxis], centre + drs]),
+                        np.concatenate([velocities[:1], velocities[0] + dvs]))
+
+COARSE = {
+    "rungekutta": rungekutta_coarse,
+    "kepler": kepler_coarse,
+}
+
+
+def _fine(task : tuple) -> tuple :
+    # one slice on a worker. only arrays and ids are sent, the Body objects
+    # may hold GL resources
+    ids, positions, velocities, masses, n_active, precision, duration, dt, integrator, tolerances, epsilon = task
+    bodies = [Body(ID, None, 0.0, None, None, None) for ID in ids]
+    bodies_state = Bodies(bodies, positions, velocities, masses, n_active, precision)
+    result = propagate(bodies_state, duration, dt, integrator, None, tolerances, epsilon)
+    # in full n-body evaluations, block_hermite's are of single bodies
+    evaluations = result["body_evaluations"] / len(ids) if integrator == "block_hermite" else result["evaluations"]
+    return bodies_state.positions, bodies_state.velocities, result["steps"], evaluations
+
+
+def parareal(bodies_state : Bodies, duration : float, slices : int, dt : float = DEFAULT_TIMESTEP,
+             integrator : str = "dormand_prince", tolerances : Tolerances | None = None, epsilon : float = 1e-9,
+             coarse : str = "rungekutta", coarse_dt : float = DAY / 4, processes : int | None = None,
+             max_iterations : int | None = None, report : bool = False) -> dict :
+    # boundary states at the slice ends, the final one is written back into
+    # bodies_state. converged means no boundary moved by more than the fine
+    # tolerances (Tolerances.norm <= 1) in the last iteration
+    assert bodies_state.members is None, "parareal runs a single system, not an ensemble"
+    tolerances = tolerances or Tolerances()
+    max_iterations = slices if max_iterations is None else min(max_iterations, slices)
+    times = np.linspace(0.0, duration, slices + 1)
+    spans = np.diff(times)
+
+    ids = [body.ID for body in bodies_state.bodies]
+    masses = bodies_state.masses
+    scratch = Bodies(bodies_state.bodies, np.copy(bodies_state.positions), np.copy(bodies_state.velocities),
+                     np.copy(masses), bodies_state.n_active, bodies_state.precision)
+
+    def coarse_step(positions : np.ndarray, velocities : np.ndarray, span : float) -> tuple :
+        scratch.assign(positions, velocities)
+        COARSE[coarse](scratch, span, coarse_dt)
+        return np.copy(scratch.positions), np.copy(scratch.velocities)
+
+    shape = (slices + 1,) + bodies_state.positions.shape
+    positions = np.empty(shape, dtype=bodies_state.positions.dtype)
+    velocities = np.empty(shape, dtype=bodies_state.velocities.dtype)
+    positions[0], velocities[0] = bodies_state.positions, bodies_state.velocities
+
+    # G(U[n]) of the current boundaries, the first prediction is the serial coarse sweep
+    coarse_positions = np.empty_like(positions[1:])
+    coarse_velocities = np.empty_like(velocities[1:])
+    start = time.perf_counter()
+    for n in range(slices) :
+        coarse_positions[n], coarse_velocities[n] = coarse_step(positions[n], velocities[n], spans[n])
+        positions[n + 1], velocities[n + 1] = coarse_positions[n], coarse_velocities[n]
+
+    changes, steps, evaluations = [], 0, 0
+    # spawned workers, see parallel_gravity.py
+    with get_context("spawn").Pool(processes) as pool :
+        for iteration in range(1, max_iterations + 1) :
+            # slices before first start from exact boundaries and are done
+            first = iteration - 1
+            tasks = [(ids, positions[n], velocities[n], masses, bodies_state.n_active, bodies_state.precision,
+                      spans[n], dt, integrator, tolerances, epsilon) for n in range(first, slices)]
+            fine = pool.map(_fine, tasks, chunksize=1)
+            steps += sum(result[2] for result in fine)
+            evaluations += sum(result[3] for result in fine)
+
+            change = 0.0
+            for n in range(first, slices) :
+                fine_positions, fine_velocities = fine[n - first][:2]
+                # U[first] did not move so its coarse term cancels
+                if n > first :
+                    new_coarse = coarse_step(positions[n], velocities[n], spans[n])
+                else :
+                    new_coarse = coarse_positions[n], coarse_velocities[n]
+                new_positions = new_coarse[0] + fine_positions - coarse_positions[n]
+                new_velocities = new_coarse[1] + fine_velocities - coarse_velocities[n]
+                coarse_positions[n], coarse_velocities[n] = new_coarse
+
+                drs, dvs = positions[n + 1] - new_positions, velocities[n + 1] - new_velocities
+                scratch.assign(new_positions, new_velocities)
+                change = max(change, tolerances.norm(scratch, drs, dvs, drs, dvs))
+                positions[n + 1], velocities[n + 1] = new_positions, new_velocities
+
+            changes.append(change)
+            if report :
+                print(f"iteration {iteration:>3} : boundary change {change:10.3e} (tolerance 1),"
+                      f" {time.perf_counter() - start:.1f} s")
+            # after the last slice's own iteration every boundary is exact
+            if change <= 1 or first == slices - 1 :
+                break
+
+    bodies_state.assign(positions[-1], velocities[-1])
+    return {
+        "ids": np.array(ids),
+        "times": times,
+        "positions": positions,
+        "velocities": velocities,
+        "iterations": len(changes),
+        "changes": np.array(changes),
+        "converged": changes[-1] <= 1 or len(changes) == slices,
+        "steps": steps,
+        "evaluations": evaluations,
+    }
+
+
+def parse_args(argv=None) :
+    parser = argparse.ArgumentParser(description="Parallel in time (parareal) propagation.")
+    parser.add_argument("--bodies", default=",".join(DEFAULT_TARGETS), help="comma separated body ids")
+    parser.add_argument("--until", required=True, help="end date YYYY-MM-DD")
+    parser.add_argument("--slices", type=int, default=os.cpu_count(), help="time slices, one per core is natural")
+    parser.add_argument("--processes", type=int, default=None, help="worker processes, all cores by default")
+    parser.add_argument("--integrator", default="dormand_prince", choices=sorted(INTEGRATORS),
+                        help="fine propagator")
+    parser.add_argument("--coarse", default="rungekutta", choices=list(COARSE))
+    parser.add_argument("--coarse-days", type=float, default=0.25, help="rk4 step of the coarse propagator in days")
+    parser.add_argument("--max-iterations", type=int, default=None)
+    parser.add_argument("--dt", type=float, default=DEFAULT_TIMESTEP)
+    parser.add_argument("--rtol", type=float, default=1e-13)
+    parser.add_argument("--atol-positions", type=float, default=1e-4)
+    parser.add_argument("--atol-velocities", type=float, default=1e-10)
+    parser.add_argument("--epsilon", type=float, default=1e-9, help="ias15 precision parameter")
+    parser.add_argument("--precision", default="longdouble", choices=list(PRECISIONS))
+    parser.add_argument("--serial", action="store_true", help="also run the fine propagator serially and compare")
+    parser.add_argument("--data", default=str(BODY_DATA))
+    parser.add_argument("--output", default=str(ROOT / "data" / "parareal.npz"))
+    return parser.parse_args(argv)
+
+
+def main(argv=None) :
+    args = parse_args(argv)
+
+    targets = [body.strip().upper() for body in args.bodies.split(",") if body.strip()]
+    end = datetime.strptime(args.until, "%Y-%m-%d").timestamp()
+    duration = end - TimeManager.unix_start
+    if duration <= 0 :
+        raise SystemExit("--until must be after the TimeManager start date")
+    tolerances = Tolerances(args.rtol, args.atol_positions, args.atol_velocities)
+
+    bodies_state = Bodies.from_bodies(LoadBodies(args.data, targets), precision=args.precision)
+    start = time.perf_counter()
+    result = parareal(bodies_state, duration, args.slices, args.dt, args.integrator, tolerances, args.epsilon,
+                      args.coarse, args.coarse_days * DAY, args.processes, args.max_iterations, report=True)
+    elapsed = time.perf_counter() - start
+
+    result["times"] = result["times"] + TimeManager.unix_start
+    np.savez(args.output, **result)
+    print("Simulated Time :", f"{duration/3.154e+7:.5f}", "yr", f"in {args.slices} slices,",
+          f"{result['iterations']} iterations", "" if result["converged"] else "(not converged)")
+    if args.integrator in ADAPTIVE :
+        print("Fine Evaluations :", f"{result['evaluations']:.0f}")
+    print("Wall Time :", f"{elapsed:.2f}", "s")
+
+    if args.serial :
+        reference = Bodies.from_bodies(LoadBodies(args.data, targets), precision=args.precision)
+        start = time.perf_counter()
+        propagate(reference, duration, args.dt, args.integrator, None, tolerances, args.epsilon)
+        print("Serial Wall Time :", f"{time.perf_counter() - start:.2f}", "s")
+        print("Max Position Difference :", f"{float(np.max(np.abs(bodies_state.positions - reference.positions))):.3e}", "m")
+    print("Saved :", args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+# lambert solutions of upcoming launches computed off the render thread
+#
+# a launch used to parse the trace csvs and run the lambert solve on the
+# frame that triggered it. the planner solves the launches of a grid of
+# epochs (every spacing seconds from the earliest launch) on a process pool
+# a little ahead of the simulation clock, and caches them by
+# (host, target, epoch, tof). the frame that launches only looks up the
+# finished solution of the last epoch it passed, nothing waits on the pool.
+#
+# the host's position at a future epoch is predicted with its kepler orbit
+# about the sun from the current state, good to well below the spread of the
+# lambert targeting for the lookahead of a day. a launch between two epochs
+# starts on the transfer of the earlier one, advanced by the lag about the
+# sun (the states are barycentric, the sun's is taken out and put back)
+
+import atexit
+from multiprocessing import get_context
+
+import numpy as np
+
+from simulation.body import Bodies
+from simulation.kepler import kepler_propagate
+from simulation.lambert import SUN_MU, lambert
+from simulation.odes import G
+
+HOUR = 60 * 60
+
+
+def _solve(task : tuple) -> dict :
+    # one launch on a worker
+    host, target, epoch, r0, sun_r, sun_v, transfer_days = task
+    v_i, v_f, t = lambert(host, target, epoch, r0, transfer_days)
+    return {"epoch": epoch, "position": r0, "velocity": np.asarray(v_i, dtype=float),
+            "arrival_velocity": np.asarray(v_f, dtype=float), "duration": float(t),
+            "sun_position": sun_r, "sun_velocity": sun_v}
+
+
+class LaunchPlanner :
+
+    def __init__(self, host : str, target : str, transfer_days : float, earliest : float, spacing : float = 6 * HOUR,
+                 lookahead : float = 24 * HOUR, processes : int = 1) -> None :
+        # earliest is the unix time of the first launch epoch, one worker is
+        # plenty and leaves the cores to the render loop
+        self.host = host
+        self.target = target
+        self.transfer_days = transfer_days
+        self.earliest = earliest
+        self.spacing = spacing
+        self.lookahead = lookahead
+        self.processes = processes
+        self._pool = None
+        self._pending = {}      # key -> AsyncResult
+        self._solutions = {}    # key -> solution
+        self._failed = set()    # keys whose solve raised on the worker
+
+    def _key(self, epoch : float) -> tuple :
+        return (self.host, self.target, epoch, self.transfer_days)
+
+    def _epoch(self, index : int) -> float :
+        return self.earliest + index * self.spacing
+
+    def _floor(self, t : float) -> int :
+        return max(0, int(np.floor((t - self.earliest) / self.spacing)))
+
+    def plan(self, t : float, current_state : Bodies) -> None :
+        # submit the epochs from the last one passed to t + lookahead that
+        # aren't solved or in flight, nearest first and at most two per
+        # worker queued so the pool never falls behind the clock
+        if t + self.lookahead < self.earliest :
+            return
+        first, last = self._floor(t), self._floor(t + self.lookahead)
+
+        # epochs the clock has left behind are of no use any more
+        for cache in (self._solutions, self._pending) :
+            for key in [key for key in cache if key[2] < self._epoch(first)] :
+                del cache[key]
+        self._failed = {key for key in self._failed if key[2] >= self._epoch(first)}
+
+        wanted = [self._epoch(index) for index in range(first, last + 1)]
+        wanted = [epoch for epoch in wanted if not any(self._key(epoch) in cache
+                                                       for cache in (self._solutions, self._pending, self._failed))]
+        wanted = wanted[:max(0, 2 * self.processes - len(self._pending))]
+        if not wanted :
+            return
+
+        if self._pool is None :
+            # spawned, see parallel_gravity.py
+            self._pool = get_context("spawn").Pool(self.processes)
+            atexit.register(self.close)
+        positions, sun_positions, sun_velocity = self._predict(np.array(wanted) - t, current_state)
+        for epoch, position, sun_position in zip(wanted, positions, sun_positions) :
+            task = (self.host, self.target, epoch, position, sun_position, sun_velocity, self.transfer_days)
+            self._pending[self._key(epoch)] = self._pool.apply_async(_solve, (task,))
+
+    def _predict(self, leads : np.ndarray, current_state : Bodies) -> tuple[np.ndarray, np.ndarray, np.ndarray] :
+        # barycentric positions of the host and of the sun leads seconds from
+        # now, (len(leads), 3) each, and the sun's velocity
+        ids = [body.ID for body in current_state.bodies]
+        host, sun = current_state[ids.index(self.host)], current_state[ids.index("SUN")]
+        sun_r, sun_v = np.asarray(sun.position, dtype=float), np.asarray(sun.velocity, dtype=float)
+        r = np.asarray(host.position, dtype=float) - sun_r
+        v = np.asarray(host.velocity, dtype=float) - sun_v
+        relative, _ = kepler_propagate(r, v, SUN_MU + G * float(host.mass), leads)
+        sun_positions = sun_r + sun_v * leads[:, np.newaxis]
+        return sun_positions + relative, sun_positions, sun_v
+
+    def ready(self, t : float) -> dict | None :
+        # the solution of the last epoch before t if it is finished, without
+        # blocking. position and velocity are the barycentric launch state at
+        # t. a solve that failed on the worker is reported once and its epoch
+        # skipped, the launch goes with the next one
+        if t < self.earliest :
+            return None
+        key = self._key(self._epoch(self._floor(t)))
+        if key not in self._solutions :
+            result = self._pending.get(key)
+            if result is None or not result.ready() :
+                return None
+            del self._pending[key]
+            try :
+                self._solutions[key] = result.get()
+            except Exception as error :
+                print(f"Launch solve for {key} failed : {error!r}")
+                self._failed.add(key)
+                return None
+
+        solution = dict(self._solutions[key])
+        lag = t - solution["epoch"]
+        sun_r, sun_v = solution["sun_position"], solution["sun_velocity"]
+        position, velocity = kepler_propagate(solution["position"] - sun_r, solution["velocity"] - sun_v, SUN_MU, lag)
+        solution.update(position=sun_r + sun_v * lag + position, velocity=sun_v + velocity,
+                        duration=solution["duration"] - lag)
+        return solution
+
+    def close(self) -> None :
+        if self._pool is not None :
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+            atexit.unregister(self.close)
+        self._pending = {}
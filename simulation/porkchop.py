@@ -0,0 +1,153 @@
+# launch window search, departure C3 and arrival v-infinity of the two-body
+# transfer between any two bodies of body_data.csv over a grid of departure
+# dates x times of flight (a porkchop plot)
+#
+# the bodies come from a headless propagation sampled daily and interpolated
+# (encke.SampledEphemeris), every cell is one lambert solve (izzo.py, with
+# any number of revolutions on either branch) and the solver takes whole
+# arrays of cells at once. the rows of departure dates are split over a
+# process pool. e.g.
+#
+#   python -m simulation.porkchop --host EARTH --target MARS --to 2026-12-31 --tof-min 120 --tof-max 360
+
+import argparse
+import os
+import time
+from datetime import datetime
+from multiprocessing import get_context
+
+import numpy as np
+
+from simulation.body import Bodies
+from simulation.encke import SampledEphemeris
+from simulation.izzo import izzo
+from simulation.load_bodies import LoadBodies
+from simulation.odes import G
+from simulation.propagate import BODY_DATA, ROOT, propagate
+from utils.deltatime import TimeManager
+
+DAY = 24 * 60 * 60
+OBJECTIVES = ("c3", "arrival", "total")
+
+
+def _solve(task : tuple) -> tuple :
+    r1, r2, tof, mu, revolutions, prograde, low_path = task
+    return izzo(r1, r2, tof, mu, revolutions, prograde, low_path)
+
+
+def porkchop(ephemeris : SampledEphemeris, host : int, target : int, departures : np.ndarray, tofs : np.ndarray,
+             mu : float, central : int = 0, revolutions : int = 0, prograde : bool = True, low_path : bool = True,
+             processes : int | None = None) -> dict :
+    # C3 (m^2/s^2) and arrival v-infinity (m/s) on the grid departures (D,) x
+    # tofs (T,), times in the ephemeris' seconds. states relative to central,
+    # cells without a transfer of that many revolutions are nan
+    departures, tofs = np.asarray(departures, dtype=float), np.asarray(tofs, dtype=float)
+    departure_r, departure_v = ephemeris(departures)
+    arrival_r, arrival_v = ephemeris(departures[:, np.newaxis] + tofs[np.newaxis, :])
+
+    r1 = np.broadcast_to((departure_r[:, host] - departure_r[:, central])[:, np.newaxis], arrival_r.shape[:2] + (3,))
+    host_v = (departure_v[:, host] - departure_v[:, central])[:, np.newaxis]
+    r2 = arrival_r[..., target, :] - arrival_r[..., central, :]
+    target_v = arrival_v[..., target, :] - arrival_v[..., central, :]
+    tof = np.broadcast_to(tofs, r2.shape[:2])
+
+    # rows of departure dates per worker, each solved as one array
+    processes = processes or os.cpu_count() or 1
+    chunks = np.array_split(np.arange(len(departures)), min(processes, len(departures)))
+    tasks = [(r1[rows], r2[rows], tof[rows], mu, revolutions, prograde, low_path) for rows in chunks if len(rows)]
+    if len(tasks) > 1 :
+        # spawned workers, see parallel_gravity.py
+        with get_context("spawn").Pool(len(tasks)) as pool :
+            solutions = pool.map(_solve, tasks)
+    else :
+        solutions = [_solve(task) for task in tasks]
+    v1 = np.concatenate([solution[0] for solution in solutions])
+    v2 = np.concatenate([solution[1] for solution in solutions])
+
+    departure_excess = v1 - host_v
+    return {
+        "departures": departures,
+        "tofs": tofs,
+        "c3": np.sum(departure_excess**2, axis=-1),
+        "arrival_vinf": np.linalg.norm(v2 - target_v, axis=-1),
+        "v1": v1,
+        "v2": v2,
+    }
+
+
+def optimum(result : dict, objective : str = "total") -> tuple[int, int] :
+    # grid indices of the best cell, total is |v-infinity| at both ends
+    assert objective in OBJECTIVES, f"objective must be one of {OBJECTIVES}"
+    if objective == "c3" :
+        cost = result["c3"]
+    elif objective == "arrival" :
+        cost = result["arrival_vinf"]
+    else :
+        cost = np.sqrt(result["c3"]) + result["arrival_vinf"]
+    cost = np.where(np.isfinite(cost), cost, np.inf)
+    return np.unravel_index(np.argmin(cost), cost.shape)
+
+
+def parse_args(argv=None) :
+    parser = argparse.ArgumentParser(description="Porkchop plot of two-body transfers between two bodies.")
+    parser.add_argument("--host", default="EARTH")
+    parser.add_argument("--target", default="MARS")
+    parser.add_argument("--bodies", default="SUN,EARTH,MARS,JUPITER,SATURN",
+                        help="bodies of the ephemeris, the first is the central one, host and target are added")
+    parser.add_argument("--from", dest="start", default=None, help="first departure YYYY-MM-DD, the TimeManager start by default")
+    parser.add_argument("--to", required=True, help="last departure YYYY-MM-DD")
+    parser.add_argument("--step-days", type=float, default=1.0, help="between departure dates")
+    parser.add_argument("--tof-min", type=float, default=100.0, help="shortest time of flight in days")
+    parser.add_argument("--tof-max", type=float, default=400.0, help="longest time of flight in days")
+    parser.add_argument("--tof-step", type=float, default=1.0, help="time of flight step in days")
+    parser.add_argument("--revolutions", type=int, default=0, help="complete revolutions on the transfer")
+    parser.add_argument("--high-path", action="store_true", help="the high path of multi revolution transfers")
+    parser.add_argument("--retrograde", action="store_true", help="transfers against the direction of the planets")
+    parser.add_argument("--objective", default="total", choices=OBJECTIVES,
+                        help="c3 at departure, v-infinity at arrival, or the sum of both v-infinities")
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--data", default=str(BODY_DATA))
+    parser.add_argument("--output", default=str(ROOT / "data" / "porkchop.npz"))
+    return parser.parse_args(argv)
+
+
+def main(argv=None) :
+    args = parse_args(argv)
+    names = [body.strip().upper() for body in args.bodies.split(",") if body.strip()]
+    names += [name for name in (args.host.upper(), args.target.upper()) if name not in names]
+
+    start = TimeManager.unix_start if args.start is None else datetime.strptime(args.start, "%Y-%m-%d").timestamp()
+    end = datetime.strptime(args.to, "%Y-%m-%d").timestamp()
+    if start < TimeManager.unix_start or end < start :
+        raise SystemExit(f"departures must run forward from {datetime.fromtimestamp(TimeManager.unix_start):%Y-%m-%d}")
+    departures = np.arange(start, end + 1, args.step_days * DAY) - TimeManager.unix_start
+    tofs = np.arange(args.tof_min, args.tof_max + args.tof_step / 2, args.tof_step) * DAY
+
+    clock = time.perf_counter()
+    bodies_state = Bodies.from_bodies(LoadBodies(args.data, names), precision="float64")
+    ephemeris = SampledEphemeris.from_result(propagate(bodies_state, departures[-1] + tofs[-1], 1369.0, "dop853", DAY))
+    print("Ephemeris :", f"{time.perf_counter() - clock:.2f}", "s")
+
+    # the bodies come in the order of the csv
+    ids = [body.ID for body in bodies_state.bodies]
+    central = ids.index(names[0])
+    clock = time.perf_counter()
+    result = porkchop(ephemeris, ids.index(args.host.upper()), ids.index(args.target.upper()), departures, tofs,
+                      G * bodies_state.masses[central], central, args.revolutions, not args.retrograde,
+                      not args.high_path, args.processes)
+    elapsed = time.perf_counter() - clock
+    i, j = optimum(result, args.objective)
+
+    result["departures"] = result["departures"] + TimeManager.unix_start
+    result["optimum"] = np.array([i, j])
+    np.savez(args.output, **result)
+
+    print("Lambert Solves :", f"{result['c3'].size} in {elapsed:.2f} s ({result['c3'].size / elapsed:.0f} /s)")
+    print("Optimum :", f"depart {datetime.fromtimestamp(result['departures'][i]):%Y-%m-%d},",
+          f"{tofs[j] / DAY:.0f} days,", f"C3 {result['c3'][i, j] / 1e6:.2f} km^2/s^2,",
+          f"arrival v-infinity {result['arrival_vinf'][i, j] / 1e3:.2f} km/s")
+    print("Saved :", args.output)
+
+
+if __name__ == "__main__":
+    main()
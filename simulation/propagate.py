@@ -0,0 +1,291 @@
+# headless propagation, runs the integrators as fast as the cpu allows with no
+# window or GL context, e.g.
+#
+#   python -m simulation.propagate --bodies SUN,EARTH,MARS --until 2030-01-01
+
+import argparse
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+from simulation.body import Bodies, PRECISIONS
+from simulation.load_bodies import LoadBodies
+from simulation.odes import DEFAULT_GRAVITY, GRAVITY_BACKENDS, set_gravity
+from simulation.integrators import (
+    AdaptiveStepper,
+    EnsembleStepper,
+    Tolerances,
+    update_bodies_rungekutta,
+    update_bodies_butchers_rungekutta,
+    update_bodies_fixed_fehlberg_rungekutta,
+    update_bodies_fixed_dormand_prince,
+)
+from simulation.symplectic import (
+    update_bodies_leapfrog,
+    update_bodies_yoshida4,
+    update_bodies_yoshida6,
+    update_bodies_wisdom_holman,
+    update_bodies_hierarchical_wisdom_holman,
+)
+from simulation.ias15 import IAS15
+from simulation.bulirsch_stoer import BulirschStoer
+from simulation.block_timestep import BlockHermite
+from simulation.tableaux import DORMAND_PRINCE, FEHLBERG_RK45, DOP853
+from utils.deltatime import TimeManager
+
+ROOT = Path(__file__).resolve().parents[1]
+BODY_DATA = ROOT / "data" / "body_data.csv"
+
+# adaptive integrators are run through their own stepper object, built from
+# (dt, tolerances, epsilon), fixed step ones through the update_bodies_* functions
+ADAPTIVE = {
+    "dormand_prince": lambda dt, tolerances, epsilon : AdaptiveStepper(DORMAND_PRINCE, dt, tolerances),
+    "fehlberg_rungekutta": lambda dt, tolerances, epsilon : AdaptiveStepper(FEHLBERG_RK45, dt, tolerances),
+    "dop853": lambda dt, tolerances, epsilon : AdaptiveStepper(DOP853, dt, tolerances),
+    "bulirsch_stoer": lambda dt, tolerances, epsilon : BulirschStoer(dt, tolerances),
+    "ias15": lambda dt, tolerances, epsilon : IAS15(dt, epsilon),
+    "block_hermite": lambda dt, tolerances, epsilon : BlockHermite(),
+}
+FIXED = {
+    "fixed_dormand_prince": update_bodies_fixed_dormand_prince,
+    "fixed_fehlberg_rungekutta": update_bodies_fixed_fehlberg_rungekutta,
+    "butchers_rungekutta": update_bodies_butchers_rungekutta,
+    "rungekutta": update_bodies_rungekutta,
+    "leapfrog": update_bodies_leapfrog,
+    "yoshida4": update_bodies_yoshida4,
+    "yoshida6": update_bodies_yoshida6,
+    "wisdom_holman": update_bodies_wisdom_holman,
+    "hierarchical_wisdom_holman": update_bodies_hierarchical_wisdom_holman,
+}
+INTEGRATORS = {**ADAPTIVE, **FIXED}
+
+# integrators that can advance a whole (K, N, 3) ensemble per call
+ENSEMBLE = {
+    "dormand_prince": DORMAND_PRINCE,
+    "fehlberg_rungekutta": FEHLBERG_RK45,
+    "dop853": DOP853,
+}
+
+DEFAULT_TARGETS = ["SUN", "EARTH", "MOON", "MARS", "JUPITER", "SATURN"]
+DEFAULT_TIMESTEP = (3.154e7) * 1 / (160 * 144)  # same as SimulationApp.prince_timestep
+
+
+def propagate(bodies_state : Bodies, duration : float, dt : float, integrator : str = "dormand_prince",
+              sample_interval : float | None = None, tolerances : Tolerances | None = None,
+              epsilon : float = 1e-9, progress = None) -> dict :
+    # progress, if given, is called with the simulated time after every step
+
+    if integrator in ADAPTIVE :
+        stepper = ADAPTIVE[integrator](dt, tolerances, epsilon)
+    else :
+        stepper = None
+        step = FIXED[integrator]
+
+    # samples are taken every sample_interval seconds of simulated time plus
+    # the initial and final states
+    if sample_interval is None or sample_interval <= 0 :
+        sample_interval = duration
+    n_samples = int(np.ceil(duration / sample_interval)) + 1
+
+    n = len(bodies_state)
+    times = np.zeros(n_samples)
+    positions = np.zeros((n_samples, n, 3), dtype=bodies_state.positions.dtype)
+    velocities = np.zeros((n_samples, n, 3), dtype=bodies_state.velocities.dtype)
+
+    positions[0] = bodies_state.positions
+    velocities[0] = bodies_state.velocities
+    sample = 1
+    next_sample = min(sample_interval, duration)
+
+    t = 0.0
+    steps = 0
+    while t < duration :
+        # never step past the next sample so every sample (and the final
+        # state) lands on its requested epoch. a step cut short for it keeps
+        # the controller's suggestion for the one after
+        if stepper is not None :
+            wanted = stepper.dt
+            stepper.dt = min(wanted, next_sample - t)
+            cut = stepper.dt < wanted
+            t += stepper.step(bodies_state)
+            if cut :
+                stepper.dt = max(stepper.dt, wanted)
+        else :
+            h = min(dt, next_sample - t)
+            step(bodies_state, h)
+            t += h
+
+        # a step that was cut to the epoch lands on it up to rounding
+        if next_sample - t <= 1e-9 * sample_interval :
+            t = next_sample
+
+        steps += 1
+        if progress is not None :
+            progress(t)
+
+        if t >= next_sample and sample < n_samples :
+            times[sample] = t
+            positions[sample] = bodies_state.positions
+            velocities[sample] = bodies_state.velocities
+            sample += 1
+            next_sample = min(next_sample + sample_interval, duration)
+
+    return {
+        "ids": np.array([body.ID for body in bodies_state.bodies]),
+        "times": times[:sample],
+        "positions": positions[:sample],
+        "velocities": velocities[:sample],
+        "steps": steps,
+        "rejected": 0 if stepper is None else stepper.rejected,
+        "evaluations": -1 if stepper is None else stepper.evaluations,
+        # forces on single bodies, block_hermite only evaluates the bodies due
+        "body_evaluations": -1 if stepper is None else getattr(stepper, "body_evaluations", stepper.evaluations * n),
+    }
+
+
+def propagate_ensemble(bodies_state : Bodies, duration : float, dt : float, integrator : str = "dormand_prince",
+                       sample_interval : float | None = None, tolerances : Tolerances | None = None,
+                       synchronised : bool = False) -> dict :
+    # every member of an ensemble state (K, N, 3) to the same end epoch in one
+    # vectorised loop, each member's steps land on every sample epoch like in
+    # propagate so the samples line up across members
+    stepper = EnsembleStepper(ENSEMBLE[integrator], dt, tolerances, synchronised)
+
+    if sample_interval is None or sample_interval <= 0 :
+        sample_interval = duration
+    n_samples = int(np.ceil(duration / sample_interval)) + 1
+
+    members = bodies_state.members
+    times = np.zeros((n_samples, members))
+    positions = np.zeros((n_samples,) + bodies_state.positions.shape, dtype=bodies_state.positions.dtype)
+    velocities = np.zeros((n_samples,) + bodies_state.velocities.shape, dtype=bodies_state.velocities.dtype)
+
+    positions[0] = bodies_state.positions
+    velocities[0] = bodies_state.velocities
+    sample = np.ones(members, dtype=int)
+    next_sample = np.full(members, min(sample_interval, duration))
+
+    t = np.zeros(members)
+    steps = 0
+    while np.any(t < duration) :
+        # finished members sit at dt = 0, members cut short for a sample keep
+        # their suggestion if the step was accepted
+        wanted = np.array(np.broadcast_to(stepper.dt, members), dtype=float)
+        stepper.dt = np.minimum(wanted, next_sample - t)
+        cut = stepper.dt < wanted
+        taken = stepper.step(bodies_state)
+        t += taken
+        stepper.dt = np.where(cut & (taken > 0), np.maximum(stepper.dt, wanted), stepper.dt)
+        t = np.where(next_sample - t <= 1e-9 * sample_interval, next_sample, t)
+        steps += 1
+
+        due = np.flatnonzero((t >= next_sample) & (sample < n_samples))
+        if len(due) :
+            times[sample[due], due] = t[due]
+            positions[sample[due], due] = bodies_state.positions[due]
+            velocities[sample[due], due] = bodies_state.velocities[due]
+            sample[due] += 1
+            next_sample[due] = np.minimum(next_sample[due] + sample_interval, duration)
+
+    return {
+        "ids": np.array([body.ID for body in bodies_state.bodies]),
+        "times": times,
+        "positions": positions,
+        "velocities": velocities,
+        "steps": steps,
+        "accepted": stepper.accepted,
+        "rejected": stepper.rejected,
+        "evaluations": stepper.evaluations,
+    }
+
+
+def parse_args(argv=None) :
+    parser = argparse.ArgumentParser(description="Propagate the solar system without a window.")
+    parser.add_argument("--bodies", default=",".join(DEFAULT_TARGETS),
+                        help="comma separated body ids from body_data.csv")
+    parser.add_argument("--until", required=True,
+                        help="end date YYYY-MM-DD, the initial state is at the TimeManager start date")
+    parser.add_argument("--integrator", default="dormand_prince", choices=sorted(INTEGRATORS))
+    parser.add_argument("--dt", type=float, default=DEFAULT_TIMESTEP,
+                        help="(initial) timestep in seconds")
+    parser.add_argument("--rtol", type=float, default=1e-13,
+                        help="relative tolerance of the adaptive integrators")
+    parser.add_argument("--atol-positions", type=float, default=1e-4, help="absolute position tolerance in m")
+    parser.add_argument("--atol-velocities", type=float, default=1e-10, help="absolute velocity tolerance in m/s")
+    parser.add_argument("--epsilon", type=float, default=1e-9, help="ias15 precision parameter")
+    parser.add_argument("--precision", default="longdouble", choices=list(PRECISIONS),
+                        help="state precision, compensated is float64 with kahan summed updates")
+    parser.add_argument("--gravity", default=DEFAULT_GRAVITY, choices=sorted(GRAVITY_BACKENDS),
+                        help="force backend, barnes_hut pays off for thousands of bodies")
+    parser.add_argument("--theta", type=float, default=0.5, help="barnes-hut opening angle")
+    parser.add_argument("--sample-days", type=float, default=1.0,
+                        help="interval between stored states in days, 0 stores only the final state")
+    parser.add_argument("--members", type=int, default=0,
+                        help="ensemble size, members are advanced together with perturbed initial states")
+    parser.add_argument("--sigma-positions", type=float, default=0.0,
+                        help="gaussian position perturbation of the ensemble members in m (member 0 is kept nominal)")
+    parser.add_argument("--sigma-velocities", type=float, default=0.0,
+                        help="gaussian velocity perturbation of the ensemble members in m/s")
+    parser.add_argument("--perturb", default="",
+                        help="comma separated body ids to perturb, all bodies by default")
+    parser.add_argument("--synchronised", action="store_true", help="one shared step for all ensemble members")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the ensemble perturbations")
+    parser.add_argument("--data", default=str(BODY_DATA))
+    parser.add_argument("--output", default=str(ROOT / "data" / "propagation.npz"))
+    return parser.parse_args(argv)
+
+
+def main(argv=None) :
+    args = parse_args(argv)
+
+    targets = [body.strip().upper() for body in args.bodies.split(",") if body.strip()]
+    bodies_state = Bodies.from_bodies(LoadBodies(args.data, targets), precision=args.precision)
+
+    end = datetime.strptime(args.until, "%Y-%m-%d").timestamp()
+    duration = end - TimeManager.unix_start
+    if duration <= 0 :
+        raise SystemExit(f"--until must be after {datetime.fromtimestamp(TimeManager.unix_start):%Y-%m-%d}")
+
+    set_gravity(args.gravity, **({"theta": args.theta} if args.gravity == "barnes_hut" else {}))
+    tolerances = Tolerances(args.rtol, args.atol_positions, args.atol_velocities)
+
+    start = time.perf_counter()
+    if args.members > 0 :
+        if args.integrator not in ENSEMBLE :
+            raise SystemExit(f"ensembles run with one of {', '.join(ENSEMBLE)}")
+        bodies_state = bodies_state.replicate(args.members)
+        perturbed = [body.strip().upper() for body in args.perturb.split(",") if body.strip()] or targets
+        rows = [i for i, body in enumerate(bodies_state.bodies) if body.ID in perturbed]
+        shape = (args.members - 1, len(rows), 3)
+        rng = np.random.default_rng(args.seed)
+        bodies_state.positions[1:, rows] += rng.normal(0, args.sigma_positions, shape)
+        bodies_state.velocities[1:, rows] += rng.normal(0, args.sigma_velocities, shape)
+        result = propagate_ensemble(bodies_state, duration, args.dt, args.integrator, args.sample_days * 24 * 60 * 60,
+                                    tolerances, args.synchronised)
+    else :
+        result = propagate(bodies_state, duration, args.dt, args.integrator, args.sample_days * 24 * 60 * 60,
+                           tolerances, args.epsilon)
+    elapsed = time.perf_counter() - start
+
+    result["times"] = result["times"] + TimeManager.unix_start
+    np.savez(args.output, **result)
+
+    print("Bodies :", ", ".join(result["ids"]), f"x {args.members} members" if args.members > 0 else "")
+    print("Simulated Time :", f"{duration/3.154e+7:.5f}", "yr",
+          f"in {result['steps']} steps ({np.sum(result['rejected'])} rejected)")
+    if result["evaluations"] >= 0 and "body_evaluations" in result :
+        # in full n-body evaluations so block steps compare with global ones
+        evaluations = f"{result['body_evaluations'] / len(result['ids']):.0f}"
+        if args.integrator == "block_hermite" :
+            evaluations += f" ({result['evaluations']} block steps)"
+        print("Force Evaluations :", evaluations)
+    elif result["evaluations"] >= 0 :
+        print("Force Evaluations :", result["evaluations"])
+    print("Wall Time :", f"{elapsed:.2f}", "s", f"({duration/3.154e+7/elapsed:.3f} yr/s)")
+    print("Saved :", args.output)
+
+
+if __name__ == "__main__":
+    main()
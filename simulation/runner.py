@@ -0,0 +1,250 @@
+# process pool runner, fans scenario variants (bodies, integrator, tolerances,
+# perturbed initial states) out over all cores with the headless propagation
+# loop. results are written by the workers straight into shared memory, one
+# slot per scenario, so nothing but the scenario index is pickled. e.g.
+#
+#   python -m simulation.runner --until 2030-01-01 --vary integrator=dormand_prince,dop853 \
+#       --vary rtol=1e-12,1e-13 --repeats 8 --sigma-positions 1e3 --perturb EARTH
+
+import argparse
+import itertools
+import os
+import time
+from dataclasses import dataclass, fields, replace
+from datetime import datetime
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from simulation.body import Bodies
+from simulation.load_bodies import LoadBodies
+from simulation.integrators import Tolerances
+from simulation.propagate import BODY_DATA, DEFAULT_TARGETS, DEFAULT_TIMESTEP, INTEGRATORS, ROOT, propagate
+from utils.deltatime import TimeManager
+
+YEAR = 3.154e7
+STATS = ("steps", "rejected", "evaluations", "wall_time", "worker")
+
+
+@dataclass(frozen=True)
+class Scenario :
+    bodies : tuple = tuple(DEFAULT_TARGETS)
+    duration : float = YEAR
+    integrator : str = "dormand_prince"
+    dt : float = DEFAULT_TIMESTEP
+    rtol : float = 1e-13
+    atol_positions : float = 1e-4
+    atol_velocities : float = 1e-10
+    epsilon : float = 1e-9
+    precision : str = "longdouble"
+    sigma_positions : float = 0.0       # gaussian perturbation of the initial state
+    sigma_velocities : float = 0.0
+    perturb : tuple = ()                # ids to perturb, all bodies when empty
+    seed : int = 0
+
+    def initial_state(self, data : str = str(BODY_DATA)) -> Bodies :
+        bodies_state = Bodies.from_bodies(LoadBodies(data, list(self.bodies)), precision=self.precision)
+        if self.sigma_positions or self.sigma_velocities :
+            rows = [i for i, body in enumerate(bodies_state.bodies) if not self.perturb or body.ID in self.perturb]
+            rng = np.random.default_rng(self.seed)
+            bodies_state.positions[rows] += rng.normal(0, self.sigma_positions, (len(rows), 3))
+            bodies_state.velocities[rows] += rng.normal(0, self.sigma_velocities, (len(rows), 3))
+        return bodies_state
+
+
+class SharedResults :
+    # named shared memory blocks holding every scenario's samples, created by
+    # the parent and attached to by name in the workers
+    #
+    #   states   (S, samples, bodies, 6)  positions & velocities, NaN padded
+    #   times    (S, samples)
+    #   progress (S,)                     simulated fraction, for reporting
+    #   stats    (S, len(STATS))
+
+    def __init__(self, shapes : dict, names : dict | None = None) -> None :
+        self.shapes = shapes
+        self.owner = names is None
+        self.blocks = {}
+        self.arrays = {}
+        for key, shape in shapes.items() :
+            size = max(int(np.prod(shape)) * np.dtype(np.float64).itemsize, 1)
+            block = SharedMemory(create=True, size=size) if self.owner else SharedMemory(name=names[key])
+            self.blocks[key] = block
+            self.arrays[key] = np.ndarray(shape, dtype=np.float64, buffer=block.buf)
+
+        if self.owner :
+            self.arrays["states"].fill(np.nan)
+            self.arrays["times"].fill(np.nan)
+            self.arrays["progress"].fill(0.0)
+            self.arrays["stats"].fill(0.0)
+
+    @property
+    def names(self) -> dict :
+        return {key : block.name for key, block in self.blocks.items()}
+
+    def __getitem__(self, key : str) -> np.ndarray :
+        return self.arrays[key]
+
+    def close(self) -> None :
+        self.arrays.clear()
+        for block in self.blocks.values() :
+            block.close()
+            if self.owner :
+                block.unlink()
+        self.blocks.clear()
+
+
+# per worker state, set once by the pool initializer
+_scenarios = None
+_results = None
+_sample_interval = None
+_data = None
+
+def _initialise(scenarios : list, shapes : dict, names : dict, sample_interval : float, data : str) -> None :
+    global _scenarios, _results, _sample_interval, _data
+    _scenarios = scenarios
+    _results = SharedResults(shapes, names)
+    _sample_interval = sample_interval
+    _data = data
+
+def _run(index : int) -> int :
+    scenario = _scenarios[index]
+    bodies_state = scenario.initial_state(_data)
+    tolerances = Tolerances(scenario.rtol, scenario.atol_positions, scenario.atol_velocities)
+    progress = _results["progress"]
+    _results["stats"][index, STATS.index("worker")] = os.getpid()
+
+    def report(t : float) -> None :
+        progress[index] = t / scenario.duration
+
+    start = time.perf_counter()
+    result = propagate(bodies_state, scenario.duration, scenario.dt, scenario.integrator, _sample_interval,
+                       tolerances, scenario.epsilon, report)
+
+    samples, n = len(result["times"]), len(bodies_state)
+    _results["times"][index, :samples] = result["times"]
+    _results["states"][index, :samples, :n, :3] = result["positions"]
+    _results["states"][index, :samples, :n, 3:] = result["velocities"]
+    # in full n-body evaluations so block_hermite compares with the global steppers
+    evaluations = result["body_evaluations"] / n if scenario.integrator == "block_hermite" else result["evaluations"]
+    _results["stats"][index] = (result["steps"], result["rejected"], evaluations,
+                                time.perf_counter() - start, os.getpid())
+    progress[index] = 1.0
+    return index
+
+
+def run_scenarios(scenarios : list[Scenario], processes : int | None = None, sample_interval : float = 86400.0,
+                  data : str = str(BODY_DATA), report_every : float | None = 2.0) -> dict :
+    # runs every scenario on a pool of processes (all cores by default) and
+    # returns the samples as plain arrays, see SharedResults for the layout
+    n_bodies = max(len(scenario.bodies) for scenario in scenarios)
+    n_samples = max(int(np.ceil(scenario.duration / sample_interval)) + 1 for scenario in scenarios)
+    shapes = {
+        "states": (len(scenarios), n_samples, n_bodies, 6),
+        "times": (len(scenarios), n_samples),
+        "progress": (len(scenarios),),
+        "stats": (len(scenarios), len(STATS)),
+    }
+    results = SharedResults(shapes)
+    total_years = sum(scenario.duration for scenario in scenarios) / YEAR
+
+    try :
+        start = time.perf_counter()
+        # spawned workers, see parallel_gravity.py
+        with get_context("spawn").Pool(processes, _initialise, (scenarios, shapes, results.names, sample_interval, data)) as pool :
+            pending = pool.map_async(_run, range(len(scenarios)), chunksize=1)
+            while not pending.ready() :
+                pending.wait(report_every)
+                if report_every is not None and not pending.ready() :
+                    _report(scenarios, results, time.perf_counter() - start, total_years)
+            pending.get()
+        elapsed = time.perf_counter() - start
+        if report_every is not None :
+            _report(scenarios, results, elapsed, total_years)
+
+        output = {key : np.array(results[key]) for key in shapes}
+    finally :
+        results.close()
+
+    output["wall_time"] = elapsed
+    output["simulated_years"] = total_years
+    return output
+
+
+def _report(scenarios : list[Scenario], results : SharedResults, elapsed : float, total_years : float) -> None :
+    # one line per worker with the scenario it is on, then the throughput
+    progress, workers = results["progress"], results["stats"][:, STATS.index("worker")]
+    running = np.flatnonzero((workers > 0) & (progress < 1))
+    done = int(np.sum(progress >= 1))
+    for index in running :
+        print(f"  worker {int(workers[index]):>7} scenario {index:>4} {scenarios[index].integrator:<22} "
+              f"{100 * progress[index]:6.1f} %")
+
+    simulated = sum(min(progress[i], 1.0) * scenario.duration for i, scenario in enumerate(scenarios)) / YEAR
+    print(f"{done}/{len(scenarios)} done, {simulated:.2f}/{total_years:.2f} yr in {elapsed:.1f} s "
+          f"({simulated / max(elapsed, 1e-9):.3f} yr/s)")
+
+
+def scenario_grid(base : Scenario, vary : dict, repeats : int = 1) -> list[Scenario] :
+    # cartesian product of the varied fields, each repeated with seeds 0..repeats-1
+    keys = list(vary)
+    return [replace(base, **dict(zip(keys, values)), seed=seed)
+            for values in itertools.product(*(vary[key] for key in keys))
+            for seed in range(repeats)]
+
+
+def parse_args(argv=None) :
+    parser = argparse.ArgumentParser(description="Run scenario variants on all cores.")
+    parser.add_argument("--bodies", default=",".join(DEFAULT_TARGETS), help="comma separated body ids")
+    parser.add_argument("--until", required=True, help="end date YYYY-MM-DD")
+    parser.add_argument("--integrator", default="dormand_prince", choices=sorted(INTEGRATORS))
+    parser.add_argument("--vary", action="append", default=[],
+                        help="field=value,value,... of Scenario, repeatable, the runs are the product of all of them")
+    parser.add_argument("--repeats", type=int, default=1, help="seeds per variant, for perturbed runs")
+    parser.add_argument("--sigma-positions", type=float, default=0.0, help="initial position perturbation in m")
+    parser.add_argument("--sigma-velocities", type=float, default=0.0, help="initial velocity perturbation in m/s")
+    parser.add_argument("--perturb", default="", help="comma separated ids to perturb, all by default")
+    parser.add_argument("--precision", default="longdouble")
+    parser.add_argument("--processes", type=int, default=None, help="worker processes, all cores by default")
+    parser.add_argument("--sample-days", type=float, default=1.0)
+    parser.add_argument("--data", default=str(BODY_DATA))
+    parser.add_argument("--output", default=str(ROOT / "data" / "scenarios.npz"))
+    return parser.parse_args(argv)
+
+
+def main(argv=None) :
+    args = parse_args(argv)
+
+    end = datetime.strptime(args.until, "%Y-%m-%d").timestamp()
+    duration = end - TimeManager.unix_start
+    if duration <= 0 :
+        raise SystemExit("--until must be after the TimeManager start date")
+
+    base = Scenario(bodies=tuple(body.strip().upper() for body in args.bodies.split(",") if body.strip()),
+                    duration=duration, integrator=args.integrator, precision=args.precision,
+                    sigma_positions=args.sigma_positions, sigma_velocities=args.sigma_velocities,
+                    perturb=tuple(body.strip().upper() for body in args.perturb.split(",") if body.strip()))
+
+    # values are parsed with the type of the field's default
+    types = {field.name : type(getattr(base, field.name)) for field in fields(Scenario)}
+    vary = {}
+    for item in args.vary :
+        key, values = item.split("=", 1)
+        if key not in types :
+            raise SystemExit(f"unknown scenario field '{key}'")
+        parse = (lambda value : tuple(value.upper().split("+"))) if types[key] is tuple else types[key]
+        vary[key] = [parse(value) for value in values.split(",")]
+
+    scenarios = scenario_grid(base, vary, args.repeats)
+    print(f"{len(scenarios)} scenarios on {args.processes or os.cpu_count()} processes")
+    output = run_scenarios(scenarios, args.processes, args.sample_days * 24 * 60 * 60, args.data)
+
+    np.savez(args.output, **output, scenarios=np.array([repr(scenario) for scenario in scenarios]))
+    print("Wall Time :", f"{output['wall_time']:.2f}", "s",
+          f"({output['simulated_years'] / output['wall_time']:.3f} yr/s total)")
+    print("Saved :", args.output)
+
+
+if __name__ == "__main__":
+    main()
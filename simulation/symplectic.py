@@ -0,0 +1,224 @@
+# symplectic integrators, energy errors stay bounded instead of drifting
+# https://en.wikipedia.org/wiki/Leapfrog_integration
+# https://en.wikipedia.org/wiki/Symplectic_integrator (yoshida compositions)
+# Wisdom & Holman (1991), Duncan, Levison & Lee (1998) for the democratic
+# heliocentric splitting
+
+from simulation.odes import G, gravitation
+from simulation.kepler import kepler_drift
+from simulation.hierarchy import DEFAULT_GROUPS, Hierarchy
+import numpy as np
+
+# yoshida (1990) substep weights, compositions of the second order leapfrog
+_w1 = 1 / (2 - 2**(1/3))
+YOSHIDA4 = (_w1, 1 - 2*_w1, _w1)
+
+_w = (-1.17767998417887, 0.235573213359357, 0.784513610477560)  # solution A
+YOSHIDA6 = (_w[2], _w[1], _w[0], 1 - 2*sum(_w), _w[0], _w[1], _w[2])
+
+
+class Leapfrog :
+    # kick-drift-kick leapfrog composed over substeps of weight w * dt. the
+    # acceleration at the end of one substep starts the next, and is kept
+    # between calls while the state is left untouched, so each step costs one
+    # force evaluation per substep
+
+    def __init__(self, weights : tuple = (1.0,), gravitation = gravitation) -> None :
+        self.weights = weights
+        self.gravitation = gravitation
+        self.evaluations = 0
+
+        self._acceleration = None
+        self._positions = None
+        self._masses = None
+
+    def _accelerations(self, t : float, bodies_state : object) -> np.ndarray :
+        _, accelerations = self.gravitation(t, bodies_state.positions, bodies_state.velocities, bodies_state.masses)
+        self.evaluations += 1
+        return accelerations
+
+    def _cached(self, bodies_state : object) -> bool :
+        return (self._positions is not None
+                and self._positions.shape == bodies_state.positions.shape
+                and np.array_equal(self._positions, bodies_state.positions)
+                and np.array_equal(self._masses, bodies_state.masses))
+
+    def step(self, bodies_state : object, dt : float, t : float = 0) -> None :
+        accelerations = self._acceleration if self._cached(bodies_state) else self._accelerations(t, bodies_state)
+
+        for weight in self.weights :
+            h = weight * dt
+            bodies_state.advance(dvs=accelerations * (h / 2))
+            bodies_state.advance(drs=bodies_state.velocities * h)
+            t += h
+            accelerations = self._accelerations(t, bodies_state)
+            bodies_state.advance(dvs=accelerations * (h / 2))
+
+        self._acceleration = accelerations
+        self._positions = np.copy(bodies_state.positions)
+        self._masses = np.copy(bodies_state.masses)
+
+
+class WisdomHolman :
+    # wisdom-holman map in democratic heliocentric coordinates: positions
+    # relative to the central body, barycentric velocities. each body follows
+    # its exact kepler orbit about the central body and the interactions
+    # between the other bodies are applied as kicks,
+    #
+    #   kick(dt/2) jump(dt/2) kepler(dt) jump(dt/2) kick(dt/2)
+    #
+    # which allows steps that are a sizeable fraction of the shortest orbital
+    # period. bodies that are tightly bound to something other than the central
+    # body (the MOON) make the interaction term large and should be avoided.
+
+    def __init__(self, central : str = "SUN", gravitation = gravitation) -> None :
+        self.central = central
+        self.gravitation = gravitation
+        self.evaluations = 0
+
+        # heliocentric state kept between steps while the bodies are untouched,
+        # saves converting back and forth (and the roundoff that comes with it)
+        self._written = None
+        self._state = None
+
+    def _interaction(self, t : float, X : np.ndarray, U : np.ndarray, masses : np.ndarray) -> np.ndarray :
+        _, accelerations = self.gravitation(t, X, U, masses)
+        self.evaluations += 1
+        return accelerations
+
+    def _to_heliocentric(self, bodies_state : object, t : float) -> tuple :
+        ids = [body.ID for body in bodies_state.bodies]
+        centre = ids.index(self.central) if self.central in ids else 0
+        others = np.arange(len(bodies_state)) != centre
+
+        positions, velocities, masses = bodies_state.positions, bodies_state.velocities, bodies_state.masses
+        total_mass = np.sum(masses)
+        R = np.sum(masses[:, np.newaxis] * positions, axis=0) / total_mass
+        V = np.sum(masses[:, np.newaxis] * velocities, axis=0) / total_mass
+
+        X = positions[others] - positions[centre]
+        U = velocities[others] - V
+        return centre, others, R, V, X, U, self._interaction(t, X, U, masses[others])
+
+    def _cached(self, bodies_state : object) -> bool :
+        if self._written is None :
+            return False
+        positions, velocities, masses = self._written
+        return (positions.shape == bodies_state.positions.shape
+                and np.array_equal(positions, bodies_state.positions)
+                and np.array_equal(velocities, bodies_state.velocities)
+                and np.array_equal(masses, bodies_state.masses))
+
+    def step(self, bodies_state : object, dt : float, t : float = 0) -> None :
+        if self._cached(bodies_state) :
+            centre, others, R, V, X, U, accelerations = self._state
+        else :
+            centre, others, R, V, X, U, accelerations = self._to_heliocentric(bodies_state, t)
+
+        masses = bodies_state.masses
+        central_mass = masses[centre]
+        other_masses = masses[others][:, np.newaxis]
+        half = dt / 2
+
+        U = U + accelerations * half
+        X = X + np.sum(other_masses * U, axis=0) / central_mass * half
+        X, U = kepler_drift(X, U, G * central_mass, dt)
+        X = X + np.sum(other_masses * U, axis=0) / central_mass * half
+        accelerations = self._interaction(t + dt, X, U, masses[others])
+        U = U + accelerations * half
+        R = R + V * dt
+
+        # back to barycentric, the heliocentric state is the one carried
+        # between steps so there is nothing to compensate
+        total_mass = np.sum(masses)
+        central_position = R - np.sum(other_masses * X, axis=0) / total_mass
+        positions = np.empty_like(bodies_state.positions)
+        velocities = np.empty_like(bodies_state.velocities)
+        positions[others] = X + central_position
+        positions[centre] = central_position
+        velocities[others] = U + V
+        velocities[centre] = V - np.sum(other_masses * U, axis=0) / central_mass
+        bodies_state.assign(positions, velocities)
+
+        self._state = (centre, others, R, V, X, U, accelerations)
+        self._written = (np.copy(bodies_state.positions), np.copy(bodies_state.velocities), np.copy(masses))
+
+
+class HierarchicalWisdomHolman :
+    # wisdom-holman map in hierarchical jacobi coordinates (hierarchy.py),
+    #
+    #   kick(dt/2) kepler(dt) kick(dt/2)
+    #
+    # every row drifts on its own kepler orbit, so the moon goes around the
+    # earth and the earth-moon barycenter around the sun exactly and only the
+    # tidal terms are left for the kicks. the step then only has to resolve
+    # how fast those change (a fraction of the month for the moon) rather than
+    # the moon's pull on the earth, which plain wisdom_holman can't handle.
+
+    def __init__(self, groups : dict = DEFAULT_GROUPS, central : str = "SUN", gravitation = gravitation) -> None :
+        self.groups = groups
+        self.central = central
+        self.gravitation = gravitation
+        self.evaluations = 0
+
+        self._written = None
+        self._state = None
+
+    def _interaction(self, t : float, hierarchy : Hierarchy, X : np.ndarray, U : np.ndarray, masses : np.ndarray) -> np.ndarray :
+        # everything but the kepler terms, in hierarchical coordinates
+        _, accelerations = self.gravitation(t, hierarchy.to_cartesian(X), hierarchy.to_cartesian(U), masses)
+        self.evaluations += 1
+        return hierarchy.to_hierarchical(accelerations) - hierarchy.kepler_accelerations(X)
+
+    def _cached(self, bodies_state : object) -> bool :
+        if self._written is None :
+            return False
+        positions, velocities, masses = self._written
+        return (positions.shape == bodies_state.positions.shape
+                and np.array_equal(positions, bodies_state.positions)
+                and np.array_equal(velocities, bodies_state.velocities)
+                and np.array_equal(masses, bodies_state.masses))
+
+    def step(self, bodies_state : object, dt : float, t : float = 0) -> None :
+        masses = bodies_state.masses
+        if self._cached(bodies_state) :
+            hierarchy, X, U, accelerations = self._state
+        else :
+            hierarchy = Hierarchy.from_state(bodies_state, self.groups, self.central)
+            X = hierarchy.to_hierarchical(bodies_state.positions)
+            U = hierarchy.to_hierarchical(bodies_state.velocities)
+            accelerations = self._interaction(t, hierarchy, X, U, masses)
+
+        moving = hierarchy.moving
+        U = U + accelerations * (dt / 2)
+        X = np.copy(X)
+        X[~moving] += U[~moving] * dt
+        X[moving], U[moving] = kepler_drift(X[moving], U[moving], hierarchy.mu[moving], dt)
+        accelerations = self._interaction(t + dt, hierarchy, X, U, masses)
+        U = U + accelerations * (dt / 2)
+
+        bodies_state.assign(hierarchy.to_cartesian(X), hierarchy.to_cartesian(U))
+        self._state = (hierarchy, X, U, accelerations)
+        self._written = (np.copy(bodies_state.positions), np.copy(bodies_state.velocities), np.copy(masses))
+
+
+_leapfrog      = Leapfrog()
+_yoshida4      = Leapfrog(YOSHIDA4)
+_yoshida6      = Leapfrog(YOSHIDA6)
+_wisdom_holman = WisdomHolman()
+_hierarchical_wisdom_holman = HierarchicalWisdomHolman()
+
+def update_bodies_leapfrog(bodies_state : object, dt : float) -> None :
+    _leapfrog.step(bodies_state, dt)
+
+def update_bodies_yoshida4(bodies_state : object, dt : float) -> None :
+    _yoshida4.step(bodies_state, dt)
+
+def update_bodies_yoshida6(bodies_state : object, dt : float) -> None :
+    _yoshida6.step(bodies_state, dt)
+
+def update_bodies_wisdom_holman(bodies_state : object, dt : float) -> None :
+    _wisdom_holman.step(bodies_state, dt)
+
+def update_bodies_hierarchical_wisdom_holman(bodies_state : object, dt : float) -> None :
+    _hierarchical_wisdom_holman.step(bodies_state, dt)
@@ -0,0 +1,148 @@
+# butcher tableaux for the explicit runge-kutta engine in integrators.py
+# https://en.wikipedia.org/wiki/List_of_Runge%E2%80%93Kutta_methods
+#
+# coefficients are written exactly as they appeared in the hand unrolled
+# steppers so that the engine reproduces their results bit-for-bit
+
+from dataclasses import dataclass
+
+@dataclass(frozen=True)
+class ButcherTableau :
+    name  : str
+    c     : tuple                   # nodes
+    a     : tuple                   # strictly lower triangular, row i has i entries
+    b     : tuple                   # weights of the propagated solution
+    order : int
+    b_scale : float = 1.0           # common factor applied after summing b
+    b_hat : tuple | None = None     # weights of the embedded solution, error = b - b_hat
+    e     : tuple | None = None     # or the error weights directly
+    e_low : tuple | None = None     # lower order error weights, blended with e as in dop853
+    embedded_order : int | None = None
+    error_exponent : float | None = None    # of the step size controller, 1 / (q + 1) for an error estimate of order q
+    fsal  : bool = False            # last stage is the first stage of the next step
+
+    @property
+    def stages(self) -> int :
+        return len(self.c)
+
+    @property
+    def adaptive(self) -> bool :
+        return self.b_hat is not None or self.e is not None
+
+
+RK4 = ButcherTableau(
+    name  = "rungekutta",
+    c     = (0, 1/2, 1/2, 1),
+    a     = ((),
+             (1/2,),
+             (0, 1/2),
+             (0, 0, 1)),
+    b     = (1, 2, 2, 1),
+    b_scale = 1/6,
+    order = 4,
+)
+
+BUTCHER_RK5 = ButcherTableau(
+    name  = "butchers_rungekutta",
+    c     = (0, 1/4, 1/4, 1/2, 3/4, 1),
+    a     = ((),
+             (1/4,),
+             (1/8, 1/8),
+             (0, -1/2, 1),
+             (3/16, 0, 0, 9/16),
+             (-3/7, 2/7, 12/7, -12/7, 8/7)),
+    b     = (7, 0, 32, 12, 32, 7),
+    b_scale = 1/90,
+    order = 5,
+)
+
+FEHLBERG_RK45 = ButcherTableau(
+    name  = "fehlberg_rungekutta",
+    c     = (0, 1/2, 1/2, 1, 2/3, 1/5),
+    a     = ((),
+             (1/2,),
+             (1/4, 1/4),
+             (0, (-1), 2),
+             (7/27, 10/27, 0, 1/27),
+             (28/625, (-1/5), 546/625, 54/625, (-378/625))),
+    b     = (1/24, 0, 0, 5/48, 27/56, 125/336),
+    e     = (1/8, 0, 2/3, 1/16, (-27/56), (-125/336)),
+    order = 5,              # b is the 5th order solution (local extrapolation),
+    embedded_order = 4,     # b + e the 4th order one
+    error_exponent = 1/5,
+)
+
+DORMAND_PRINCE = ButcherTableau(
+    name  = "dormand_prince",
+    c     = (0, 1/5, 3/10, 4/5, 8/9, 1, 1),
+    a     = ((),
+             ((1/5),),
+             ((3/40), (9/40)),
+             ((44/45), (-56/15), (32/9)),
+             ((19372/6561), (-25360/2187), (64448/6561), (-212/729)),
+             ((9017/3168), (-355/33), (46732/5247), (49/176), (-5103/18656)),
+             ((35/384), (0), (500/1113), (125/192), (-2187/6784), (11/84))),
+    b     = ((35/384), 0, (500/1113), (125/192), (-2187/6784), (11/84), 0),
+    b_hat = ((5179/57600), 0, (7571/16695), (393/640), (-92097/339200), (187/2100), (1/40)),
+    order = 5,
+    embedded_order = 4,
+    error_exponent = 1/5,
+    fsal  = True,
+)
+
+# Hairer's DOP853, 8th order with a 5th order estimate corrected by a 3rd order
+# one (Hairer, Norsett & Wanner, Solving ODEs I, sec. II.10)
+_DOP853_B = (5.42937341165687622380535766363e-2, 0, 0, 0, 0,
+             4.45031289275240888144113950566, 1.89151789931450038304281599044,
+             -5.8012039600105847814672114227, 3.1116436695781989440891606237e-1,
+             -1.52160949662516078556178806805e-1, 2.01365400804030348374776537501e-1,
+             4.47106157277725905176885569043e-2)
+
+DOP853 = ButcherTableau(
+    name  = "dop853",
+    c     = (0.0, 0.526001519587677318785587544488e-01, 0.789002279381515978178381316732e-01,
+             0.118350341907227396726757197510, 0.281649658092772603273242802490,
+             0.333333333333333333333333333333, 0.25, 0.307692307692307692307692307692,
+             0.651282051282051282051282051282, 0.6, 0.857142857142857142857142857142, 1.0),
+    a     = ((),
+             (5.26001519587677318785587544488e-2,),
+             (1.97250569845378994544595329183e-2, 5.91751709536136983633785987549e-2),
+             (2.95875854768068491816892993775e-2, 0, 8.87627564304205475450678981324e-2),
+             (2.41365134159266685502369798665e-1, 0, -8.84549479328286085344864962717e-1,
+              9.24834003261792003115737966543e-1),
+             (3.7037037037037037037037037037e-2, 0, 0, 1.70828608729473871279604482173e-1,
+              1.25467687566822425016691814123e-1),
+             (3.7109375e-2, 0, 0, 1.70252211019544039314978060272e-1,
+              6.02165389804559606850219397283e-2, -1.7578125e-2),
+             (3.70920001185047927108779319836e-2, 0, 0, 1.70383925712239993810214054705e-1,
+              1.07262030446373284651809199168e-1, -1.53194377486244017527936158236e-2,
+              8.27378916381402288758473766002e-3),
+             (6.24110958716075717114429577812e-1, 0, 0, -3.36089262944694129406857109825,
+              -8.68219346841726006818189891453e-1, 2.75920996994467083049415600797e1,
+              2.01540675504778934086186788979e1, -4.34898841810699588477366255144e1),
+             (4.77662536438264365890433908527e-1, 0, 0, -2.48811461997166764192642586468,
+              -5.90290826836842996371446475743e-1, 2.12300514481811942347288949897e1,
+              1.52792336328824235832596922938e1, -3.32882109689848629194453265587e1,
+              -2.03312017085086261358222928593e-2),
+             (-9.3714243008598732571704021658e-1, 0, 0, 5.18637242884406370830023853209,
+              1.09143734899672957818500254654, -8.14978701074692612513997267357,
+              -1.85200656599969598641566180701e1, 2.27394870993505042818970056734e1,
+              2.49360555267965238987089396762, -3.0467644718982195003823669022),
+             (2.27331014751653820792359768449, 0, 0, -1.05344954667372501984066689879e1,
+              -2.00087205822486249909675718444, -1.79589318631187989172765950534e1,
+              2.79488845294199600508499808837e1, -2.85899827713502369474065508674,
+              -8.87285693353062954433549289258, 1.23605671757943030647266201528e1,
+              6.43392746015763530355970484046e-1)),
+    b     = _DOP853_B,
+    e     = (0.1312004499419488073250102996e-1, 0, 0, 0, 0,
+             -0.1225156446376204440720569753e+1, -0.4957589496572501915214079952,
+             0.1664377182454986536961530415e+1, -0.3503288487499736816886487290,
+             0.3341791187130174790297318841, 0.8192320648511571246570742613e-1,
+             -0.2235530786388629525884427845e-1),
+    e_low = tuple(b - bhh for b, bhh in zip(_DOP853_B, (0.244094488188976377952755905512, 0, 0, 0, 0, 0, 0, 0,
+                                                       0.733846688281611857341361741547, 0, 0,
+                                                       0.220588235294117647058823529412e-1))),
+    order = 8,
+    embedded_order = 5,     # e, blended with the 3rd order e_low
+    error_exponent = 1/8,   # hairer's, the blend behaves like an error of order 7
+)
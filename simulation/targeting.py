@@ -0,0 +1,231 @@
+# differential correction of a transfer in the full n-body system, from a
+# two-body (lambert) guess of the departure velocity
+#
+# the spacecraft is a massless test particle, the bodies are propagated with
+# it and the sensitivities come from the variational equations
+# (variational.py), so every arc is one propagation with its STM.
+#
+#   single shooting    one arc from departure to arrival, newton on the
+#                      departure velocity, dv = -Phi_rv^-1 (r(T) - r_target)
+#   multiple shooting  the transfer cut into arcs whose start states are
+#                      unknowns too, continuity at the joints plus the
+#                      arrival position make a square newton system. each
+#                      arc is short so the guess stays in the linear range on
+#                      high curvature transfers, and the arcs are independent
+#                      so they run at once on a process pool
+#
+# the massive bodies don't feel the spacecraft, their states at the arc
+# starts come from one propagation of the system alone. e.g.
+#
+#   python -m simulation.targeting --host EARTH --target MARS --days 185 --arcs 4
+
+import argparse
+import os
+import time
+from datetime import datetime
+from multiprocessing import get_context
+
+import numpy as np
+
+from simulation.body import Body, Bodies
+from simulation.integrators import Tolerances
+from simulation.izzo import izzo
+from simulation.kepler import kepler_propagate
+from simulation.load_bodies import LoadBodies
+from simulation.odes import G
+from simulation.propagate import BODY_DATA, DEFAULT_TARGETS, DEFAULT_TIMESTEP, INTEGRATORS, propagate
+from simulation.variational import UNSUPPORTED, propagate_stm
+from utils.deltatime import TimeManager
+
+DAY = 24 * 60 * 60
+SPACECRAFT = "SPACECRAFT"
+
+
+def _arc(task : tuple) -> tuple :
+    # one arc of the spacecraft through the system on a worker, only arrays
+    # and ids are sent like parareal's slices
+    ids, positions, velocities, masses, n_active, precision, duration, dt, integrator, tolerances, epsilon = task
+    bodies = [Body(ID, None, 0.0, None, None, None) for ID in ids]
+    bodies_state = Bodies(bodies, positions, velocities, masses, n_active, precision)
+    result = propagate_stm(bodies_state, duration, dt, integrator, [SPACECRAFT], None, tolerances, epsilon)
+    final = np.concatenate([bodies_state.positions[-1], bodies_state.velocities[-1]]).astype(float)
+    return final, result["stm"][-1, 0].astype(float), result["steps"]
+
+
+class Targeter :
+
+    def __init__(self, bodies_state : Bodies, target : str, duration : float, arcs : int = 1,
+                 dt : float = DEFAULT_TIMESTEP, integrator : str = "dop853", tolerances : Tolerances | None = None,
+                 epsilon : float = 1e-9, processes : int | None = None) -> None :
+        # bodies_state is the system at departure (without the spacecraft),
+        # it is not changed
+        assert integrator not in UNSUPPORTED, f"{integrator} can't propagate the variational equations"
+        self.target = target
+        self.duration = duration
+        self.arcs = arcs
+        self.dt = dt
+        self.integrator = integrator
+        self.tolerances = tolerances or Tolerances(1e-12, 1e-2, 1e-8)
+        self.epsilon = epsilon
+        self.processes = processes or os.cpu_count() or 1
+
+        self.ids = [body.ID for body in bodies_state.bodies] + [SPACECRAFT]
+        self.masses = np.append(np.asarray(bodies_state.masses, dtype=float), 0.0)
+        self.n_active = bodies_state.n_active
+        self.precision = "float64"
+        self.times = np.linspace(0.0, duration, arcs + 1)
+
+        # the system on its own at every arc start and at arrival
+        system = Bodies(bodies_state.bodies, np.array(bodies_state.positions, dtype=float),
+                        np.array(bodies_state.velocities, dtype=float), np.array(bodies_state.masses, dtype=float),
+                        bodies_state.n_active, self.precision)
+        self.system_positions = [np.copy(system.positions)]
+        self.system_velocities = [np.copy(system.velocities)]
+        for span in np.diff(self.times) :
+            propagate(system, span, dt, integrator, None, self.tolerances, epsilon)
+            self.system_positions.append(np.copy(system.positions))
+            self.system_velocities.append(np.copy(system.velocities))
+        self.arrival = self.system_positions[-1][self.ids.index(target)]
+
+    def _tasks(self, starts : list[np.ndarray]) -> list[tuple] :
+        return [(self.ids, np.vstack([self.system_positions[k], start[:3]]),
+                 np.vstack([self.system_velocities[k], start[3:]]), self.masses, self.n_active, self.precision,
+                 self.times[k + 1] - self.times[k], self.dt, self.integrator, self.tolerances, self.epsilon)
+                for k, start in enumerate(starts)]
+
+    def _guess(self, position : np.ndarray, velocity : np.ndarray) -> list[np.ndarray] :
+        # arc starts on the keplerian orbit about the first body (the sun)
+        # through the departure state
+        sun_r, sun_v = self.system_positions[0][0], self.system_velocities[0][0]
+        mu = G * (self.masses[0])
+        r, v = kepler_propagate(position - sun_r, velocity - sun_v, mu, self.times[1:-1])
+        starts = [np.concatenate([position, velocity])]
+        for k in range(1, self.arcs) :
+            starts.append(np.concatenate([self.system_positions[k][0] + r[k - 1], self.system_velocities[k][0] + v[k - 1]]))
+        return starts
+
+    def correct(self, position : np.ndarray, velocity : np.ndarray, offset : np.ndarray | None = None,
+                tolerance : float = 1e3, max_iterations : int = 10, report : bool = False) -> dict :
+        # departure velocity that brings the spacecraft from position to the
+        # target's position (plus offset, an aim point beside the planet) at
+        # arrival. converged when the miss and every joint's position defect
+        # are below tolerance in m and the velocity defects below tolerance /
+        # the arc length
+        position, velocity = np.asarray(position, dtype=float), np.asarray(velocity, dtype=float)
+        aim = self.arrival + (np.zeros(3) if offset is None else np.asarray(offset, dtype=float))
+        starts = self._guess(position, velocity)
+        arc_length = self.duration / self.arcs
+        m = self.arcs
+
+        misses, steps, converged = [], 0, False
+        # spawned workers, see parallel_gravity.py
+        pool = get_context("spawn").Pool(min(self.processes, m)) if m > 1 and self.processes > 1 else None
+        try :
+            for iteration in range(1, max_iterations + 1) :
+                tasks = self._tasks(starts)
+                arcs = pool.map(_arc, tasks, chunksize=1) if pool is not None else [_arc(task) for task in tasks]
+                steps += sum(arc[2] for arc in arcs)
+
+                # residuals: the joints then the arrival position, unknowns:
+                # the departure velocity then every later arc start
+                residual = np.concatenate([arcs[k][0] - starts[k + 1] for k in range(m - 1)]
+                                          + [arcs[-1][0][:3] - aim])
+                jacobian = np.zeros((6 * m - 3, 6 * m - 3))
+                for k, (_, stm, _) in enumerate(arcs) :
+                    rows = slice(6 * k, 6 * k + (6 if k < m - 1 else 3))
+                    block = stm[:6 if k < m - 1 else 3]
+                    if k == 0 :
+                        jacobian[rows, :3] = block[:, 3:]
+                    else :
+                        jacobian[rows, 6 * k - 3:6 * k + 3] = block
+                    if k < m - 1 :
+                        jacobian[rows, 6 * k + 3:6 * k + 9] = -np.eye(6)
+
+                miss = float(np.linalg.norm(residual[-3:]))
+                joints = residual[:-3].reshape(-1, 6)
+                misses.append(miss)
+                if report :
+                    defect = float(np.max(np.linalg.norm(joints[:, :3], axis=-1))) if m > 1 else 0.0
+                    print(f"iteration {iteration:>3} : miss {miss:10.3e} m, largest joint defect {defect:10.3e} m")
+                converged = (miss <= tolerance and np.all(np.abs(joints[:, :3]) <= tolerance)
+                             and np.all(np.abs(joints[:, 3:]) <= tolerance / arc_length))
+                if converged :
+                    break
+
+                correction = np.linalg.solve(jacobian, -residual)
+                starts[0] = np.concatenate([position, starts[0][3:] + correction[:3]])
+                for k in range(1, m) :
+                    starts[k] = starts[k] + correction[6 * k - 3:6 * k + 3]
+        finally :
+            if pool is not None :
+                pool.close()
+                pool.join()
+
+        return {
+            "velocity": starts[0][3:],
+            "arrival": arcs[-1][0],
+            "aim": aim,
+            "misses": np.array(misses),
+            "iterations": len(misses),
+            "converged": converged,
+            "steps": steps,
+        }
+
+
+def parse_args(argv=None) :
+    parser = argparse.ArgumentParser(description="Correct a transfer in the full n-body system by shooting.")
+    parser.add_argument("--bodies", default=",".join(DEFAULT_TARGETS), help="massive bodies, the first is the central one")
+    parser.add_argument("--host", default="EARTH", help="body the spacecraft departs from")
+    parser.add_argument("--target", default="MARS")
+    parser.add_argument("--offset", type=float, default=1e9, help="depart this far from the host, away from the sun, in m")
+    parser.add_argument("--miss", type=float, default=1e7, help="aim this far from the target's centre, on its sunward side, in m")
+    parser.add_argument("--days", type=float, default=185.0, help="time of flight")
+    parser.add_argument("--arcs", type=int, default=1, help="1 for single shooting, more for multiple shooting")
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--integrator", default="dop853", choices=sorted(name for name in INTEGRATORS if name not in UNSUPPORTED))
+    parser.add_argument("--tolerance", type=float, default=1e3, help="accepted miss in m")
+    parser.add_argument("--max-iterations", type=int, default=10)
+    parser.add_argument("--data", default=str(BODY_DATA))
+    return parser.parse_args(argv)
+
+
+def main(argv=None) :
+    args = parse_args(argv)
+    targets = [body.strip().upper() for body in args.bodies.split(",") if body.strip()]
+    duration = args.days * DAY
+
+    bodies_state = Bodies.from_bodies(LoadBodies(args.data, targets), precision="float64")
+    host = bodies_state.get_target(args.host)
+    sun = bodies_state[0]
+    outward = (host.position - sun.position) / np.linalg.norm(host.position - sun.position)
+    position = host.position + args.offset * outward
+
+    start = time.perf_counter()
+    targeter = Targeter(bodies_state, args.target, duration, args.arcs, processes=args.processes,
+                        integrator=args.integrator)
+    arrival = targeter.arrival - targeter.system_positions[-1][0]
+    offset = -args.miss * arrival / np.linalg.norm(arrival)
+    print("Ephemeris :", f"{time.perf_counter() - start:.2f}", "s")
+
+    # two-body (lambert) guess about the sun
+    departure, _ = izzo(position - sun.position, targeter.arrival + offset - targeter.system_positions[-1][0],
+                        duration, G * sun.mass)
+    guess = sun.velocity + departure
+    # the two-body arc flown in the full system
+    flown = Bodies(bodies_state.bodies + [Body(SPACECRAFT, None, 0.0, None, None, 0.0)],
+                   np.vstack([bodies_state.positions, position]), np.vstack([bodies_state.velocities, guess]),
+                   np.append(bodies_state.masses, 0.0), bodies_state.n_active, "float64")
+    propagate(flown, duration, DEFAULT_TIMESTEP, args.integrator, None, targeter.tolerances)
+    print("Two Body Guess :", f"{np.linalg.norm(guess - host.velocity):.1f} m/s from the host,",
+          f"misses by {np.linalg.norm(flown.positions[-1] - targeter.arrival - offset):.3e} m in the full system")
+
+    start = time.perf_counter()
+    result = targeter.correct(position, guess, offset, args.tolerance, args.max_iterations, report=True)
+    print("Corrected :", f"{result['iterations']} iterations,", f"{result['steps']} steps,",
+          f"{time.perf_counter() - start:.2f} s", "" if result["converged"] else "(not converged)")
+    print("Departure Velocity Change :", f"{np.linalg.norm(result['velocity'] - guess):.3f} m/s",
+          f"(arrival {datetime.fromtimestamp(TimeManager.unix_start + duration):%Y-%m-%d})")
+
+
+if __name__ == "__main__":
+    main()
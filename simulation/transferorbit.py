@@ -1,37 +1,92 @@
-from scipy.constants import pi
 from simulation.body import Body, Bodies
 import numpy as np
 from simulation.lambert import lambert
+from simulation.kepler import kepler_propagate
+from simulation.odes import G
+from simulation.targeting import Targeter
     
 class Spaceship() :
-    def __init__(self,launch_location : object, launch_target : object) :
+    # mode "two_body" flies the satellite around its own copy of the sun, kept
+    # for the lambert comparison, on the exact kepler orbit (propagate,
+    # state_at). "test_particle" adds it as a massless particle to the main
+    # system so it feels every body and rides in the main step
+    MODES = ("two_body", "test_particle")
+
+    def __init__(self,launch_location : object, launch_target : object, mode : str = "two_body", ID : str = 'SATELLITE',
+                 transfer_days : float = 185, offset : float = 1e9, correct : bool = False) :
+        # transfer_days is the time of flight handed to lambert, see
+        # simulation/porkchop.py for good (departure, time of flight) pairs.
+        # a test particle starts offset m from the host (outside the earth's
+        # ~9e8 m sphere of influence, as in encke.py and targeting.py), on the
+        # host's centre it would drag the one global step down to nothing.
+        # correct has targeting.Targeter take its departure velocity from
+        # the two body one to the same distance from the target in the full
+        # system, on the launching frame (seconds for a 185 day transfer)
+        assert mode in self.MODES, f"mode must be one of {self.MODES}"
         self.launch_location = launch_location
         self.launch_target   = launch_target
+        self.mode = mode
+        self.ID = ID
+        self.transfer_days = transfer_days
+        self.offset = offset
+        self.correct = correct
         
         self.satellite = None
+        self.index = None
         self.mission_time = 0.0
         self.transfer_time = 0.0
 
         self.boosted = False
         
-    def launch(self, t0 : float, current_state : Bodies) : 
+    def launch(self, t0 : float, current_state : Bodies, solution : dict | None = None) : 
+        # solution is a finished one of planner.LaunchPlanner, without it the
+        # lambert solve runs here
     
-        launch_body = current_state.get_target(self.launch_location)
+        # indexed so the bodies carry the current state, not stale arrays
+        ids = [body.ID for body in current_state.bodies]
+        launch_body = current_state[ids.index(self.launch_location)]
         launch_pos = launch_body.position
         launch_vel = launch_body.velocity
         
-        target_body = current_state.get_target(self.launch_target)
+        target_body = current_state[ids.index(self.launch_target)]
         target_pos = target_body.position
         target_vel = target_body.velocity
         
-        v_i, self.v_f, self.t = lambert(self.launch_location,self.launch_target, t0, launch_pos, 185)
+        if solution is None :
+            v_i, self.v_f, self.t = lambert(self.launch_location,self.launch_target, t0, launch_pos, self.transfer_days)
+        else :
+            launch_pos, v_i = solution["position"], solution["velocity"]
+            self.v_f, self.t = solution["arrival_velocity"], solution["duration"]
 
-        self.satellite = Body('SATELLITE',
+        self.satellite = Body(self.ID,
                               np.array([255,255,255]),
                               0.2,
                               launch_pos,
                               v_i,
                               3e3)
+
+        if self.mode == "test_particle" :
+            # out along the departure asymptote, v_inf from the host's own
+            # state, at the speed of the escape hyperbola there
+            host_pos = np.asarray(launch_body.position, dtype=float)
+            host_vel = np.asarray(launch_body.velocity, dtype=float)
+            v_inf = np.asarray(v_i, dtype=float) - host_vel
+            speed = np.linalg.norm(v_inf)
+            direction = v_inf / speed
+            self.satellite.position = host_pos + self.offset * direction
+            self.satellite.velocity = host_vel + direction * np.sqrt(speed**2 + 2 * G * float(launch_body.mass) / self.offset)
+            if self.correct :
+                # aimed offset m sunward of the target, as far out of its
+                # sphere of influence as the start is out of the host's
+                targeter = Targeter(current_state, self.launch_target, self.t)
+                arrival = targeter.arrival - targeter.system_positions[-1][0]
+                result = targeter.correct(self.satellite.position, self.satellite.velocity,
+                                          -self.offset * arrival / np.linalg.norm(arrival))
+                self.satellite.velocity = result["velocity"]
+            current_state.add_test_particles([self.satellite])
+            self.bodies_state = current_state
+            self.index = len(current_state) - 1
+            return
         
         self.sun = Body('SATELLITE_SUN',
                               current_state.get_target('SUN').color,
@@ -41,8 +96,43 @@ class Spaceship() :
                               current_state.get_target('SUN').mass)
         
         self.bodies_state = Bodies.from_bodies([self.sun,self.satellite]) 
+        self.index = 1
+        self._set_epoch()
+
+    def _set_epoch(self) -> None :
+        # barycenter and relative orbit of the two body system at the current
+        # mission time, every later state follows from them in closed form
+        positions, velocities, masses = self.bodies_state.positions, self.bodies_state.velocities, self.bodies_state.masses
+        total = np.sum(masses)
+        self._epoch = (self.mission_time,
+                       np.sum(masses[:, np.newaxis] * positions, axis=0) / total,
+                       np.sum(masses[:, np.newaxis] * velocities, axis=0) / total,
+                       positions[1] - positions[0],
+                       velocities[1] - velocities[0],
+                       G * total)
+
+    def state_at(self, mission_times) -> tuple[np.ndarray, np.ndarray] :
+        # positions and velocities (..., 2, 3) of the sun and the satellite at
+        # any mission times, two body mode only
+        t0, R, V, r, v, mu = self._epoch
+        dt = np.asarray(mission_times, dtype=float) - t0
+        relative_positions, relative_velocities = kepler_propagate(r, v, mu, dt)
+
+        masses = self.bodies_state.masses
+        fractions = np.array([-masses[1], masses[0]]) / np.sum(masses)
+        positions = (R + V * dt[..., np.newaxis])[..., np.newaxis, :] + fractions[:, np.newaxis] * relative_positions[..., np.newaxis, :]
+        velocities = V + fractions[:, np.newaxis] * relative_velocities[..., np.newaxis, :]
+        return positions, velocities
+
+    def propagate(self, dt : float) -> None :
+        # advances the two body system by dt, exact whatever the step
+        self.mission_time += dt
+        positions, velocities = self.state_at(self.mission_time)
+        self.bodies_state.assign(positions, velocities)
 
     def second_impulse(self) : # redundant 
         if self.boosted == False :
-            self.bodies_state.update('velocities',-1,self.v_f)
-            self.boosted = True
\ No newline at end of file
+            self.bodies_state.update('velocities',self.index,self.v_f)
+            self.boosted = True
+            if self.mode == "two_body" :
+                self._set_epoch()
\ No newline at end of file
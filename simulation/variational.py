@@ -0,0 +1,176 @@
+# state transition matrices from the variational equations
+#
+# the 6 x 6 STM of a body, Phi(t) = d(r, v)(t) / d(r, v)(t0), obeys
+#
+#   Phi' = [[0, I], [da/dr, 0]] Phi
+#
+# split into its position rows R and velocity rows V (3 x 6 each) that is
+# R' = V, V' = (da/dr) R, so each of the 6 columns moves like a particle
+# whose acceleration is the tidal tensor applied to its position. the columns
+# ride along as 6 extra massless rows per body in an ordinary state and every
+# integrator that goes through gravitation propagates them with the same
+# steps (and the same error control) as the bodies, the kernel computes the
+# accelerations and da/dr in one pass (odes.accelerations_and_gradients).
+#
+# da/dr is taken with respect to the body's own position with the others on
+# their nominal paths, exact for spacecraft and other test particles. for a
+# massive body it leaves out how the rest of the system responds to it. e.g.
+#
+#   python -m simulation.variational --until 2025-03-01 --stm MARS --check
+
+import argparse
+import time
+from datetime import datetime
+
+import numpy as np
+
+from simulation.body import Body, Bodies, PRECISIONS
+from simulation.integrators import Tolerances
+from simulation.load_bodies import LoadBodies
+from simulation.odes import accelerations_and_gradients, using_gravity
+from simulation.propagate import BODY_DATA, DEFAULT_TARGETS, DEFAULT_TIMESTEP, INTEGRATORS, propagate
+from utils.deltatime import TimeManager
+
+# steppers with kernels of their own (kepler drifts, jerks) that would not
+# move the variational rows correctly
+UNSUPPORTED = ("wisdom_holman", "hierarchical_wisdom_holman", "block_hermite")
+
+
+class Variational :
+    # a copy of bodies_state extended by the STM columns of the bodies in ids
+    # (all by default), starting from the identity. the object itself is the
+    # gravity kernel for that state, use it with set_gravity / using_gravity
+
+    def __init__(self, bodies_state : Bodies, ids : list[str] | None = None) -> None :
+        self.n = len(bodies_state)
+        names = [body.ID for body in bodies_state.bodies]
+        self.ids = names if ids is None else list(ids)
+        self.rows = np.array([names.index(ID) for ID in self.ids], dtype=int)
+        k = len(self.rows)
+
+        # column j of the identity, position part then velocity part
+        shape = bodies_state.positions.shape[:-2] + (6 * k, 3)
+        identity = np.eye(6)
+        columns_r = np.broadcast_to(np.tile(identity[:3].T, (k, 1)), shape)
+        columns_v = np.broadcast_to(np.tile(identity[3:].T, (k, 1)), shape)
+
+        stubs = [Body(f"{ID}:STM{j}", None, 0.0, None, None, 0.0) for ID in self.ids for j in range(6)]
+        masses = np.concatenate([bodies_state.masses, np.zeros(bodies_state.masses.shape[:-1] + (6 * k,))], axis=-1)
+        self.state = Bodies(list(bodies_state.bodies) + stubs,
+                            np.concatenate([bodies_state.positions, columns_r.astype(bodies_state.positions.dtype)], axis=-2),
+                            np.concatenate([bodies_state.velocities, columns_v.astype(bodies_state.velocities.dtype)], axis=-2),
+                            masses, bodies_state.n_active, bodies_state.precision)
+
+    def __call__(self, t, positions, velocities, masses) :
+        n = self.n
+        accelerations, gradients = accelerations_and_gradients(positions[..., :n, :], masses[..., :n])
+        columns = positions[..., n:, :].reshape(positions.shape[:-2] + (len(self.rows), 6, 3))
+        variations = np.einsum("...iab,...ijb->...ija", gradients[..., self.rows, :, :], columns)
+        return np.copy(velocities), np.concatenate([accelerations, variations.reshape(positions[..., n:, :].shape)], axis=-2)
+
+    def stm(self, positions : np.ndarray | None = None, velocities : np.ndarray | None = None) -> np.ndarray :
+        # (..., k, 6, 6) from the extended state, or from sampled arrays of it
+        positions = self.state.positions if positions is None else positions
+        velocities = self.state.velocities if velocities is None else velocities
+        shape = positions.shape[:-2] + (len(self.rows), 6, 3)
+        columns = np.concatenate([positions[..., self.n:, :].reshape(shape),
+                                  velocities[..., self.n:, :].reshape(shape)], axis=-1)
+        return np.swapaxes(columns, -1, -2)
+
+
+def propagate_stm(bodies_state : Bodies, duration : float, dt : float, integrator : str = "dormand_prince",
+                  ids : list[str] | None = None, sample_interval : float | None = None,
+                  tolerances : Tolerances | None = None, epsilon : float = 1e-9) -> dict :
+    # propagate with the STMs of ids alongside, the bodies' final state is
+    # written back into bodies_state and result["stm"] is (samples, k, 6, 6)
+    assert integrator not in UNSUPPORTED, f"{integrator} can't propagate the variational equations"
+    variational = Variational(bodies_state, ids)
+    with using_gravity(variational) :
+        result = propagate(variational.state, duration, dt, integrator, sample_interval, tolerances, epsilon)
+
+    n = variational.n
+    bodies_state.assign(variational.state.positions[..., :n, :], variational.state.velocities[..., :n, :])
+    result["stm"] = variational.stm(result["positions"], result["velocities"])
+    result["stm_ids"] = np.array(variational.ids)
+    result["ids"] = result["ids"][:n]
+    result["positions"] = result["positions"][..., :n, :]
+    result["velocities"] = result["velocities"][..., :n, :]
+    return result
+
+
+def finite_difference_stm(bodies_state : Bodies, target : str, duration : float, dt : float, integrator : str,
+                          tolerances : Tolerances | None, epsilon : float, steps : tuple = (1.0, 1e-3)) -> np.ndarray :
+    # central differences of the final state of target, the reference the
+    # variational STM replaces. steps are the perturbations in m and m/s
+    row = [body.ID for body in bodies_state.bodies].index(target)
+    stm = np.zeros((6, 6))
+    for j in range(6) :
+        h = steps[j // 3]
+        final = []
+        for sign in (1, -1) :
+            state = Bodies(bodies_state.bodies, np.copy(bodies_state.positions), np.copy(bodies_state.velocities),
+                           np.copy(bodies_state.masses), bodies_state.n_active, bodies_state.precision)
+            (state.positions if j < 3 else state.velocities)[row, j % 3] += sign * h
+            propagate(state, duration, dt, integrator, None, tolerances, epsilon)
+            final.append(np.concatenate([state.positions[row], state.velocities[row]]))
+        stm[:, j] = (final[0] - final[1]) / (2 * h)
+    return stm
+
+
+def parse_args(argv=None) :
+    parser = argparse.ArgumentParser(description="Propagate state transition matrices with the variational equations.")
+    parser.add_argument("--bodies", default=",".join(DEFAULT_TARGETS), help="comma separated body ids")
+    parser.add_argument("--until", required=True, help="end date YYYY-MM-DD")
+    parser.add_argument("--stm", default="", help="comma separated body ids to carry an STM for, all by default")
+    parser.add_argument("--integrator", default="dormand_prince",
+                        choices=sorted(name for name in INTEGRATORS if name not in UNSUPPORTED))
+    parser.add_argument("--dt", type=float, default=DEFAULT_TIMESTEP)
+    parser.add_argument("--rtol", type=float, default=1e-13)
+    parser.add_argument("--atol-positions", type=float, default=1e-4)
+    parser.add_argument("--atol-velocities", type=float, default=1e-10)
+    parser.add_argument("--epsilon", type=float, default=1e-9, help="ias15 precision parameter")
+    parser.add_argument("--precision", default="float64", choices=list(PRECISIONS))
+    parser.add_argument("--check", action="store_true", help="compare with central finite differences (12 more runs per body)")
+    parser.add_argument("--data", default=str(BODY_DATA))
+    return parser.parse_args(argv)
+
+
+def main(argv=None) :
+    args = parse_args(argv)
+    targets = [body.strip().upper() for body in args.bodies.split(",") if body.strip()]
+    ids = [body.strip().upper() for body in args.stm.split(",") if body.strip()] or None
+    end = datetime.strptime(args.until, "%Y-%m-%d").timestamp()
+    duration = end - TimeManager.unix_start
+    if duration <= 0 :
+        raise SystemExit("--until must be after the TimeManager start date")
+    tolerances = Tolerances(args.rtol, args.atol_positions, args.atol_velocities)
+
+    bodies_state = Bodies.from_bodies(LoadBodies(args.data, targets), precision=args.precision)
+    initial = Bodies(bodies_state.bodies, np.copy(bodies_state.positions), np.copy(bodies_state.velocities),
+                     np.copy(bodies_state.masses), bodies_state.n_active, bodies_state.precision)
+
+    start = time.perf_counter()
+    result = propagate_stm(bodies_state, duration, args.dt, args.integrator, ids, None, tolerances, args.epsilon)
+    print("With STM :", f"{result['steps']} steps, {time.perf_counter() - start:.2f} s")
+
+    start = time.perf_counter()
+    propagate(Bodies(initial.bodies, np.copy(initial.positions), np.copy(initial.velocities), np.copy(initial.masses),
+                     initial.n_active, initial.precision), duration, args.dt, args.integrator, None, tolerances, args.epsilon)
+    print("State only :", f"{time.perf_counter() - start:.2f} s")
+
+    np.set_printoptions(precision=4, linewidth=120)
+    for ID, stm in zip(result["stm_ids"], result["stm"][-1]) :
+        print(f"\n{ID} :\n{stm.astype(float)}")
+        if args.check :
+            start = time.perf_counter()
+            reference = finite_difference_stm(initial, ID, duration, args.dt, args.integrator, tolerances, args.epsilon)
+            # per 3 x 3 block, the blocks have different units
+            blocks = [(slice(i, i + 3), slice(j, j + 3)) for i in (0, 3) for j in (0, 3)]
+            difference = max(np.max(np.abs(stm[block] - reference[block])) / np.max(np.abs(reference[block]))
+                             for block in blocks)
+            print("Finite Differences :", f"{time.perf_counter() - start:.2f} s,",
+                  f"largest difference {difference:.2e} relative to its block")
+
+
+if __name__ == "__main__":
+    main()